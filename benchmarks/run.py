@@ -0,0 +1,147 @@
+"""
+Benchmarks throughput and peak memory of the parser and annotation
+generation on synthetic scores of several sizes, and writes the
+results as JSON so they can be compared between releases
+
+Usage: python -m benchmarks.run [--tiers small medium] [--output results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tempfile
+import tracemalloc
+
+from musicxmlannotations.musicxml import MusicXML, PARSER_VERSION
+from musicxmlannotations.genannotations import gen_annotations, get_bar_annotations, split_staves
+from musicxmlannotations.backends import get_backend
+
+from .synthetic import generate_score
+
+# Settings of the synthetic score of each size tier
+TIERS = {
+    'small': {'measures': 32},
+    'medium': {'measures': 512},
+    'large': {'measures': 4096},
+    'dense': {'measures': 512, 'voices': 3, 'chords': 0.5, 'grace': 0.2, 'directions': 0.6, 'multirests': 0.1},
+    'orchestral': {'measures': 256, 'parts': 12, 'page_breaks': 0.02},
+}
+
+
+def bench_get_sequences(path, backend):
+    MusicXML(path, backend=backend).get_sequences()
+
+
+def bench_gen_annotations(path, backend):
+    gen_annotations(path, False, False, backend=backend)
+
+
+def prepare_bar_annotations(path, backend):
+
+    """
+    Returns the staves passed to get_bar_annotations (parsed beforehand
+    so only the annotation step is measured)
+    """
+
+    sequences = MusicXML(path, backend=backend).get_sequences(tokens=True)
+    return split_staves(sequences)
+
+
+def measure(function, args, repeat):
+
+    """
+    Returns the wall times of repeat calls and the peak memory
+    (traced separately, so tracing does not slow the timed calls)
+    """
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return times, peak
+
+
+def run(tiers, repeat, seed, backend):
+
+    """
+    Runs every benchmark on every tier and returns the results
+    """
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for tier in tiers:
+            settings = TIERS[tier]
+            path = os.path.join(tmp_dir, tier + '.musicxml')
+            with open(path, 'wb') as f:
+                f.write(generate_score(seed, **settings))
+            size = os.path.getsize(path)
+            measures = settings['measures']
+
+            benchmarks = [
+                ('get_sequences', bench_get_sequences, (path, backend)),
+                ('get_bar_annotations', get_bar_annotations, (prepare_bar_annotations(path, backend),)),
+                ('gen_annotations', bench_gen_annotations, (path, backend)),
+            ]
+
+            for name, function, args in benchmarks:
+                times, peak = measure(function, args, repeat)
+                best = min(times)
+                results.append({
+                    'benchmark': name,
+                    'tier': tier,
+                    'measures': measures,
+                    'bytes': size,
+                    'best_seconds': best,
+                    'median_seconds': statistics.median(times),
+                    'measures_per_second': measures / best,
+                    'megabytes_per_second': size / best / 1e6,
+                    'peak_memory_bytes': peak,
+                })
+                print('%-20s %-10s %8.3fs %10.0f measures/s %8.1f MB peak' %
+                      (name, tier, best, measures / best, peak / 1e6), file=sys.stderr)
+
+    return results
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark musicxmlannotations on synthetic scores')
+    parser.add_argument('--tiers', nargs='+', default=['small', 'medium', 'large'], choices=sorted(TIERS))
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic scores')
+    parser.add_argument('--backend', default=None, choices=['etree', 'lxml', 'expat'])
+    parser.add_argument('-o', '--output', default='bench_results.json', help='JSON results file')
+    args = parser.parse_args(argv)
+
+    results = run(args.tiers, args.repeat, args.seed, args.backend)
+
+    report = {
+        'parser_version': PARSER_VERSION,
+        'backend': get_backend(args.backend).name,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
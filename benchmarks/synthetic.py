@@ -0,0 +1,258 @@
+"""
+Seeded generator of synthetic MusicXML scores
+(partwise, one or more parts, any number of staves)
+"""
+
+import random
+import xml.etree.ElementTree as ET
+
+# Divisions per quarter note, allows every duration down to 32nd notes
+DIVISIONS = 24
+
+# Note types and their durations in divisions
+NOTE_TYPES = [('whole', 96), ('half', 48), ('quarter', 24), ('eighth', 12), ('16th', 6), ('32nd', 3)]
+
+STEPS = 'CDEFGAB'
+ACCIDENTALS = ['sharp', 'flat', 'natural', 'double-sharp', 'flat-flat']
+ARTICULATIONS = ['staccato', 'accent', 'tenuto']
+WORDS = ['cresc.', 'dim.', 'rit.', 'a tempo', 'Allegro', 'dolce', 'poco rall.']
+DYNAMICS = ['p', 'pp', 'f', 'ff', 'mf', 'mp', 'sfz']
+
+# (beats, beat-type, symbol) of the time signatures used
+TIME_SIGNATURES = [(4, 4, None), (3, 4, None), (6, 8, None), (2, 2, 'cut'), (4, 4, 'common'),
+                   (2, 4, None), (3, 8, None), (4, 8, None)]
+
+
+def sub(parent, tag, text=None, **attrib):
+
+    """
+    Adds a child element (with optional text) to parent
+    """
+
+    e = ET.SubElement(parent, tag, attrib)
+    if text is not None:
+        e.text = str(text)
+    return e
+
+
+def fill_bar(rng, total):
+
+    """
+    Returns random (type, duration, dot) notes filling total divisions
+    """
+
+    notes = []
+    while total > 0:
+        note_type, duration = rng.choice([(t, d) for t, d in NOTE_TYPES if d <= total])
+        dot = False
+        if rng.random() < 0.15 and duration % 2 == 0 and duration * 3 // 2 <= total:
+            duration = duration * 3 // 2
+            dot = True
+        notes.append((note_type, duration, dot))
+        total -= duration
+    return notes
+
+
+def add_note(rng, measure, note_type, duration, dot, staff, voice,
+             rest=False, chord=False, grace=False, hidden=False, measure_rest=False):
+
+    """
+    Adds a <note> element to measure
+    """
+
+    note = sub(measure, 'note')
+    if hidden:
+        note.set('print-object', 'no')
+    if grace:
+        sub(note, 'grace')
+    if chord:
+        sub(note, 'chord')
+    if rest:
+        r = sub(note, 'rest')
+        if measure_rest:
+            r.set('measure', 'yes')
+    else:
+        pitch = sub(note, 'pitch')
+        sub(pitch, 'step', rng.choice(STEPS))
+        if rng.random() < 0.2:
+            sub(pitch, 'alter', rng.choice([-1, 1]))
+        sub(pitch, 'octave', rng.randint(2, 6))
+    if not grace:
+        sub(note, 'duration', duration)
+    sub(note, 'voice', voice)
+    sub(note, 'type', note_type)
+    if dot:
+        sub(note, 'dot')
+    if not rest:
+        if rng.random() < 0.15:
+            sub(note, 'accidental', rng.choice(ACCIDENTALS))
+        sub(note, 'stem', rng.choice(['up', 'down']))
+    sub(note, 'staff', staff)
+    if not rest and rng.random() < 0.1:
+        notations = sub(note, 'notations')
+        if rng.random() < 0.5:
+            sub(notations, 'tied', type='start')
+        sub(sub(notations, 'articulations'), rng.choice(ARTICULATIONS))
+        if rng.random() < 0.3:
+            sub(notations, 'fermata')
+    return note
+
+
+def add_direction(rng, measure, staff):
+
+    """
+    Adds a <direction> element (dynamics or words) to measure
+    """
+
+    direction = sub(measure, 'direction', placement='above')
+    direction_type = sub(direction, 'direction-type')
+    if rng.random() < 0.5:
+        sub(sub(direction_type, 'dynamics'), rng.choice(DYNAMICS))
+    else:
+        sub(direction_type, 'words', rng.choice(WORDS))
+    sub(direction, 'staff', staff)
+
+
+def add_attributes(rng, measure, first, staves, time_signature, multirest):
+
+    """
+    Adds an <attributes> element (key/time/clef changes, multirest) to
+    measure and returns its time signature and multirest length
+    """
+
+    attributes = sub(measure, 'attributes')
+    if first:
+        sub(attributes, 'divisions', DIVISIONS)
+    if first or rng.random() < 0.5:
+        sub(sub(attributes, 'key'), 'fifths', rng.randint(-7, 7))
+    if first or rng.random() < 0.5:
+        time_signature = rng.choice(TIME_SIGNATURES)
+        beats, beat_type, symbol = time_signature
+        time = sub(attributes, 'time')
+        if symbol is not None:
+            time.set('symbol', symbol)
+        sub(time, 'beats', beats)
+        sub(time, 'beat-type', beat_type)
+    if first:
+        sub(attributes, 'staves', staves)
+    for staff in range(staves):
+        if first or rng.random() < 0.3:
+            clef = sub(attributes, 'clef', number=str(staff + 1))
+            sub(clef, 'sign', rng.choice(['G', 'F', 'C']))
+            sub(clef, 'line', rng.randint(1, 5))
+
+    rest_length = 0
+    if multirest:
+        rest_length = rng.randint(2, 4)
+        sub(sub(attributes, 'measure-style'), 'multiple-rest', rest_length)
+
+    return time_signature, rest_length
+
+
+def add_part(rng, root, part_id, measures, staves, voices, chords, grace, multirests,
+             directions, page_breaks, changes, hidden):
+
+    """
+    Adds a <part> with its measures to root
+    """
+
+    part = sub(root, 'part', id=part_id)
+    time_signature = None
+    rest_left = 0
+
+    for i in range(measures):
+        measure = sub(part, 'measure', number=str(i + 1), width='%.2f' % rng.uniform(120, 420))
+
+        # New system (page) with the staff layout
+        if i == 0 or rng.random() < page_breaks:
+            layout = sub(measure, 'print')
+            sub(sub(layout, 'system-layout'), 'top-system-distance', 100)
+            if staves > 1:
+                sub(sub(layout, 'staff-layout', number=str(staves)), 'staff-distance', 65)
+
+        # Key/time/clef changes and multirests (never inside a multirest)
+        if i == 0 or (rest_left == 0 and rng.random() < changes):
+            multirest = i > 0 and rng.random() < multirests and i + 4 < measures
+            time_signature, rest_left = add_attributes(rng, measure, i == 0, staves, time_signature, multirest)
+        rest_left = max(rest_left - 1, 0)
+
+        beats, beat_type, _ = time_signature
+        bar = DIVISIONS * 4 * beats // beat_type
+
+        for staff in range(staves):
+            for voice in range(rng.randint(1, voices)):
+                if staff > 0 or voice > 0:
+                    sub(sub(measure, 'backup'), 'duration', bar)
+
+                if rng.random() < directions:
+                    add_direction(rng, measure, staff + 1)
+
+                voice_number = staff * 4 + voice + 1
+                if voice == 0 and rng.random() < 0.08:
+                    add_note(rng, measure, 'whole', bar, False, staff + 1, voice_number, rest=True, measure_rest=True)
+                    continue
+
+                for note_type, duration, dot in fill_bar(rng, bar):
+                    if rng.random() < grace:
+                        add_note(rng, measure, 'eighth', 0, False, staff + 1, voice_number, grace=True)
+                    if rng.random() < hidden:
+                        # Hidden content, either as a forward or an unprinted rest
+                        if rng.random() < 0.5:
+                            sub(sub(measure, 'forward'), 'duration', duration)
+                        else:
+                            add_note(rng, measure, note_type, duration, dot, staff + 1, voice_number,
+                                     rest=True, hidden=True)
+                        continue
+                    rest = rng.random() < 0.15
+                    add_note(rng, measure, note_type, duration, dot, staff + 1, voice_number, rest=rest)
+                    while not rest and rng.random() < chords:
+                        add_note(rng, measure, note_type, duration, dot, staff + 1, voice_number, chord=True)
+
+
+def generate_score(seed, measures=64, parts=1, staves=2, voices=2, chords=0.2, grace=0.05, multirests=0.03,
+                   directions=0.2, page_breaks=0.1, changes=0.05, hidden=0.05):
+
+    """
+    Returns the bytes of a synthetic MusicXML score,
+    the same seed and settings always give the same score
+
+    seed: random seed
+    measures: number of measures of each part
+    parts: number of parts
+    staves: number of staves of each part
+    voices: maximum number of voices per staff
+    chords: probability of adding another note to a chord
+    grace: probability of a grace note before a note
+    multirests: probability of a multirest at an attributes change
+    directions: probability of a direction (dynamics/words) per voice
+    page_breaks: probability of a new system per measure
+    changes: probability of an attributes change (key/time/clef) per measure
+    hidden: probability of hidden content (forward, unprinted rest) per note
+    """
+
+    rng = random.Random(seed)
+
+    root = ET.Element('score-partwise', version='3.1')
+    sub(sub(root, 'work'), 'work-title', 'Synthetic score %d' % seed)
+
+    # Page layout (margins defined for even and odd pages)
+    layout = sub(sub(root, 'defaults'), 'page-layout')
+    sub(layout, 'page-height', 1683.36)
+    sub(layout, 'page-width', 1190.88)
+    for page_type in ('even', 'odd'):
+        margins = sub(layout, 'page-margins', type=page_type)
+        sub(margins, 'left-margin', 70)
+        sub(margins, 'right-margin', 70)
+        sub(margins, 'top-margin', 70)
+        sub(margins, 'bottom-margin', 70)
+
+    part_list = sub(root, 'part-list')
+    for p in range(parts):
+        sub(sub(part_list, 'score-part', id='P%d' % (p + 1)), 'part-name', 'Part %d' % (p + 1))
+
+    for p in range(parts):
+        add_part(rng, root, 'P%d' % (p + 1), measures, staves, voices, chords, grace, multirests,
+                 directions, page_breaks, changes, hidden)
+
+    ET.indent(root, space='  ')
+    return b'<?xml version="1.0" encoding="UTF-8"?>\n' + ET.tostring(root)
@@ -0,0 +1,178 @@
+"""
+XML parsing backends used by MusicXML: stdlib ElementTree,
+lxml (if installed) or a lighter element builder on pyexpat
+
+The expat backend still builds a tree of elements (Node objects with
+the subset of the ElementTree interface the parser uses) and produces
+the same start/end events as the others. It is not an event engine
+emitting measures and notes directly: it only saves the cost of full
+ElementTree elements.
+"""
+
+import collections
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+try:
+    import lxml.etree as LET
+except ImportError:
+    LET = None
+
+# Size of the chunks fed to the parsers
+CHUNK_SIZE = 1 << 16
+
+# A backend parses a file into ('start'/'end', element) events, with
+# elements exposing the ElementTree interface used by the parser
+#   name: name of the backend
+#   iterparse: function taking a binary file object and returning the events
+#   errors: exceptions raised for invalid XML
+Backend = collections.namedtuple('Backend', ['name', 'iterparse', 'errors'])
+
+
+def etree_iterparse(source):
+
+    """
+    Events from the stdlib ElementTree (C accelerated) parser
+    """
+
+    return ET.iterparse(source, events=('start', 'end'))
+
+
+def lxml_iterparse(source):
+
+    """
+    Events from the lxml parser (comments and processing instructions
+    are dropped, as in ElementTree)
+    """
+
+    return LET.iterparse(source, events=('start', 'end'), remove_comments=True, remove_pis=True, huge_tree=True)
+
+
+class Node():
+
+    """
+    Minimal element built by the expat engine, with the part of the
+    ElementTree interface used by the parser
+    """
+
+    __slots__ = ('tag', 'attrib', 'text', 'children')
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.text = None
+        self.children = []
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __getitem__(self, index):
+        return self.children[index]
+
+    def __len__(self):
+        return len(self.children)
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def find(self, tag):
+        for child in self.children:
+            if child.tag == tag:
+                return child
+        return None
+
+    def remove(self, child):
+        self.children.remove(child)
+
+    def clear(self):
+        self.attrib = {}
+        self.text = None
+        self.children = []
+
+
+def expat_iterparse(source):
+
+    """
+    Events from a pyexpat parser building Node objects instead of
+    full ElementTree elements (a lighter element builder, the tree of
+    every element is still built)
+    """
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+
+    events = []     # Events produced by the chunk being parsed
+    stack = []      # Open nodes
+    text = []       # Character data of the innermost open node, before its first child
+
+    add_event = events.append
+
+    def start_element(tag, attrib):
+        node = Node(tag, attrib)
+        if stack:
+            parent = stack[-1]
+            if text:
+                parent.text = ''.join(text)
+                text.clear()
+            parent.children.append(node)
+        stack.append(node)
+        add_event(('start', node))
+
+    def end_element(tag):
+        # Text before the first child only (ElementTree's .text)
+        node = stack.pop()
+        if text:
+            if not node.children:
+                node.text = ''.join(text)
+            text.clear()
+        add_event(('end', node))
+
+    def character_data(data):
+        if stack and not stack[-1].children:
+            text.append(data)
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+
+    try:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            parser.Parse(chunk, len(chunk) == 0)
+            yield from events
+            events.clear()
+            if len(chunk) == 0:
+                break
+    except expat.ExpatError as e:
+        raise ET.ParseError(str(e))
+
+
+BACKENDS = {
+    'etree': Backend('etree', etree_iterparse, (ET.ParseError,)),
+    'expat': Backend('expat', expat_iterparse, (ET.ParseError,)),
+}
+if LET is not None:
+    BACKENDS['lxml'] = Backend('lxml', lxml_iterparse, (LET.XMLSyntaxError,))
+
+# Backends tried (in order) when none is requested or the requested one is not installed
+DEFAULT_BACKENDS = ('lxml', 'etree')
+
+
+def get_backend(name=None):
+
+    """
+    Returns the backend with the given name, falling back to the
+    first available default backend if it is not installed
+
+    name: 'etree', 'lxml', 'expat' or None
+    """
+
+    if name not in (None, 'etree', 'lxml', 'expat'):
+        raise ValueError('Unknown XML backend: ' + str(name))
+
+    if name in BACKENDS:
+        return BACKENDS[name]
+
+    for default in DEFAULT_BACKENDS:
+        if default in BACKENDS:
+            return BACKENDS[default]
@@ -0,0 +1,488 @@
+"""
+Runs gen_annotations over a corpus of MusicXML files,
+spreading the files across a pool of worker processes
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+import multiprocessing.connection
+
+from .genannotations import gen_annotations, gen_annotation_rows
+from .musicxml import MusicXML
+from .sources import source_name
+from .cache import SequenceCache, file_digest
+from .stats import ParseStats
+from .triage import triage, ScoreRejected
+from .budget import Budget, BudgetExceeded
+from .shards import Checkpoint, shard_of, parse_shard
+
+# Extensions of (compressed) MusicXML files picked up when walking a directory
+MUSICXML_EXTENSIONS = ('.musicxml', '.xml', '.mxl')
+
+# Extensions of manifest files (one path per line)
+MANIFEST_EXTENSIONS = ('.txt', '.lst', '.manifest')
+
+# Sequence cache opened by the current (worker) process
+_cache = None
+
+# Seconds past its time limit after which a file that did not stop by itself
+# (stuck outside the measure loop) has its worker killed and replaced
+KILL_GRACE = 2.0
+
+# Status of the result of a file that exceeded each limit of its budget
+BUDGET_STATUSES = {'time': 'timeout', 'memory': 'out-of-memory'}
+
+
+def find_files(sources):
+
+    """
+    Expands directories, glob patterns and manifests into
+    the list of MusicXML files to process (in a stable order)
+
+    sources: iterable of directories, glob patterns, manifest files
+             or MusicXML files
+    """
+
+    files = []
+
+    for source in sources:
+
+        if os.path.isdir(source):
+            # Every MusicXML file below the directory
+            for dirpath, dirnames, filenames in os.walk(source):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(MUSICXML_EXTENSIONS):
+                        files.append(os.path.join(dirpath, filename))
+
+        elif glob.has_magic(source):
+            files.extend(sorted(glob.glob(source, recursive=True)))
+
+        elif source.lower().endswith(MANIFEST_EXTENSIONS):
+            # Paths in a manifest are relative to the manifest itself
+            base_dir = os.path.dirname(source)
+            with open(source, 'r') as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if line == '' or line.startswith('#'):
+                        continue
+                    files.append(os.path.join(base_dir, line))
+
+        else:
+            files.append(source)
+
+    return files
+
+
+def file_size(path):
+
+    """
+    Returns the size of a file, 0 if it cannot be read (it fails when processed)
+    """
+
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def get_cache(cache_path, cache_size):
+
+    """
+    Returns the sequence cache of the current process
+    (SQLite connections cannot be shared between processes)
+    """
+
+    global _cache
+
+    if _cache is None or _cache.path != cache_path:
+        _cache = SequenceCache(cache_path, cache_size)
+
+    return _cache
+
+
+def process_file(args):
+
+    """
+    Generates the annotations of a single file, recording any failure
+    instead of raising it so one bad file does not stop the run. Files
+    rejected by the triage pre-scan are not parsed, files the parser
+    rejects further in get the same 'rejected' result.
+
+    args: (path, options) pair, options holding the time, backend,
+          cache_path, cache_size, profile, all_parts, errors, triage,
+          timeout, max_memory and checksum settings of the run (cache_path
+          is None when no cache is used), and optionally the workers reading
+          the file (1 by default, see gen_annotations), the incremental
+          setting (see gen_annotations) and the output
+          ('annotations' by default, or 'sequences': the result then holds
+          the sequences of the first part instead, see MusicXML.get_sequences,
+          or 'rows': the AnnotationRows, see gen_annotation_rows).
+          The path may also be the bytes of a file.
+    """
+
+    source, options = args
+    path = source_name(source)
+    errors = options.get('errors', 'strict')
+    all_parts = options.get('all_parts', False)
+
+    cache = None
+    if options['cache_path'] is not None:
+        cache = get_cache(options['cache_path'], options['cache_size'])
+    hits = cache.hits if cache is not None else 0
+
+    stats = ParseStats() if options.get('profile') else None
+
+    checksum = None
+    if options.get('checksum'):
+        try:
+            checksum = file_digest(source)
+        except OSError:
+            pass
+
+    budget = None
+    if options.get('timeout') is not None or options.get('max_memory') is not None:
+        budget = Budget(options.get('timeout'), options.get('max_memory'))
+
+    if options.get('triage', True):
+        try:
+            if stats is not None:
+                with stats.stage('triage'):
+                    reason, detail = triage(source, errors, all_parts)
+            else:
+                reason, detail = triage(source, errors, all_parts)
+        except Exception:
+            # Files that cannot be read at all fail below with their error
+            reason, detail = None, None
+
+        if reason is not None:
+            result = {'file': path, 'status': 'rejected', 'reason': reason, 'detail': detail}
+            if stats is not None:
+                result['stats'] = stats.as_dict()
+            if checksum is not None:
+                result['sha256'] = checksum
+            return result
+
+    try:
+        if options.get('output') == 'sequences':
+            musicxml_obj = MusicXML(source, cache, options['backend'], stats, errors, budget)
+            if options.get('incremental'):
+                sequences = musicxml_obj.get_sequences_incremental()
+            else:
+                sequences = musicxml_obj.get_sequences(workers=options.get('workers', 1))
+            if musicxml_obj.rejected is not None:
+                raise ScoreRejected(musicxml_obj.rejected)
+            result = {'file': path, 'status': 'ok', 'sequences': sequences}
+        elif options.get('output') == 'rows':
+            rows = gen_annotation_rows(source, cache, options['backend'], stats, all_parts,
+                                       workers=options.get('workers', 1), errors=errors, budget=budget,
+                                       incremental=options.get('incremental', False))
+            result = {'file': path, 'status': 'ok', 'rows': rows}
+        else:
+            # Files are usually spread across processes, parts are then read in this one
+            annotations = gen_annotations(source, options['time'], False, cache, options['backend'], stats,
+                                          all_parts, workers=options.get('workers', 1), errors=errors,
+                                          budget=budget, incremental=options.get('incremental', False))
+            result = {'file': path, 'status': 'ok', 'annotations': annotations}
+    except BudgetExceeded as e:
+        result = {'file': path, 'status': BUDGET_STATUSES[e.limit], 'error': str(e)}
+    except ScoreRejected as e:
+        result = {'file': path, 'status': 'rejected', 'reason': e.reason, 'detail': e.detail}
+    except Exception as e:
+        result = {'file': path, 'status': 'error', 'error': '%s: %s' % (type(e).__name__, e)}
+
+    if cache is not None:
+        result['cache'] = 'hit' if cache.hits > hits else 'miss'
+    if stats is not None:
+        result['stats'] = stats.as_dict()
+    if checksum is not None:
+        result['sha256'] = checksum
+
+    return result
+
+
+def _worker_loop(connection, initializer=None, initargs=()):
+
+    """
+    Main loop of a supervised worker process: processes the
+    files it receives until it receives None
+    """
+
+    if initializer is not None:
+        initializer(*initargs)
+
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        connection.send(process_file(task))
+
+
+def start_worker_process(initializer=None, initargs=()):
+
+    """
+    Starts a supervised worker, returns its process and connection
+
+    initializer: optional function called with initargs when the worker starts
+    """
+
+    connection, worker_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_worker_loop, args=(worker_connection, initializer, initargs),
+                                      daemon=True)
+    process.start()
+    worker_connection.close()
+
+    return process, connection
+
+
+def run_supervised(tasks, workers, timeout):
+
+    """
+    Runs process_file over tasks in worker processes, one file at a time
+    per worker, and yields the results in completion order. A worker
+    still busy with a file timeout + KILL_GRACE seconds after receiving
+    it is killed and replaced (the file gets a 'timeout' result), as is
+    a worker that dies (eg. killed by the system for lack of memory).
+
+    tasks: iterable of process_file arguments
+    workers: number of worker processes (defaults to the number of CPUs)
+    timeout: time limit of each file in seconds
+    """
+
+    tasks = iter(tasks)
+    idle = [start_worker_process() for _ in range(workers or os.cpu_count() or 1)]
+    busy = {}       # Connection of each busy worker: (process, task, deadline)
+
+    try:
+        while True:
+
+            # Hand the next files to the idle workers
+            while idle:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                process, connection = idle.pop()
+                connection.send(task)
+                busy[connection] = (process, task, time.monotonic() + timeout + KILL_GRACE)
+
+            if not busy:
+                break
+
+            # Wait for a result or the first deadline
+            wait = max(0.0, min(deadline for _, _, deadline in busy.values()) - time.monotonic())
+            for connection in multiprocessing.connection.wait(list(busy), wait):
+                process, task, _ = busy.pop(connection)
+                try:
+                    result = connection.recv()
+                except EOFError:
+                    process.join()
+                    connection.close()
+                    result = {'file': task[0], 'status': 'error',
+                              'error': 'Worker exited with code %s' % process.exitcode}
+                    process, connection = start_worker_process()
+                idle.append((process, connection))
+                yield result
+
+            # Kill the workers stuck past their deadline
+            now = time.monotonic()
+            for connection, (process, task, deadline) in list(busy.items()):
+                if now < deadline:
+                    continue
+                del busy[connection]
+                process.kill()
+                process.join()
+                connection.close()
+                idle.append(start_worker_process())
+                yield {'file': task[0], 'status': BUDGET_STATUSES['time'],
+                       'error': 'Worker killed after %.1fs' % (timeout + KILL_GRACE)}
+
+    finally:
+        for process, connection in idle:
+            connection.send(None)
+        for process, _, _ in busy.values():
+            process.kill()
+        for process, connection in idle + [(p, c) for c, (p, _, _) in busy.items()]:
+            process.join()
+            connection.close()
+
+
+def run_batch(sources, time=False, workers=None, chunksize=16, cache_path=None, cache_size=1 << 30, backend=None,
+              profile=False, all_parts=False, errors='strict', triage=True, timeout=None, max_memory=None,
+              shard=None, exclude=None, checksum=False, split_size=None, incremental=False, output='annotations'):
+
+    """
+    Generates annotations for every file found in sources and yields
+    one result per file as soon as it is finished (in completion order)
+
+    sources: directories, glob patterns, manifests or files
+    time: passed to gen_annotations
+    workers: number of worker processes (defaults to the number of CPUs,
+             1 runs everything in the current process)
+    chunksize: number of files dispatched to a worker at a time
+    cache_path: optional SQLite sequence cache shared by the workers
+    cache_size: size cap of the cache in bytes
+    backend: XML backend to parse with (see backends.get_backend)
+    profile: add the ParseStats of each file to its result (as a dict)
+    all_parts: annotate every part of the scores (only the first one otherwise)
+    errors: decoding errors policy (see MusicXML)
+    triage: skip the files rejected by triage.triage (their result has a
+            'rejected' status and the reason)
+    timeout: time limit of each file in seconds (its result then has a
+             'timeout' status), files are dispatched one at a time so the
+             worker of a file that does not stop by itself can be killed
+             (files run in the current process only stop by themselves)
+    max_memory: bytes the memory of a worker may grow by while processing
+                a file (its result then has an 'out-of-memory' status)
+    shard: (shard, number of shards) pair, only process the files of that
+           shard (see shards.shard_of)
+    exclude: set of files not to process (eg. already processed ones)
+    checksum: add the SHA-256 of the content of each file to its result
+    split_size: files of at least that many bytes are processed after the
+                others, one at a time in the current process, all the workers
+                reading ranges of its pages (see MusicXML.read_measure_ranges),
+                so a very large score does not hold up the end of the run
+    incremental: only read the measures that changed since the last
+                 incremental run (see gen_annotations)
+    output: what the result of a file holds (see process_file)
+    """
+
+    options = {'time': time, 'cache_path': cache_path, 'cache_size': cache_size, 'backend': backend,
+               'profile': profile, 'all_parts': all_parts, 'errors': errors, 'triage': triage,
+               'timeout': timeout, 'max_memory': max_memory, 'checksum': checksum, 'incremental': incremental,
+               'output': output}
+
+    files = find_files(sources)
+    if shard is not None:
+        files = [path for path in files if shard_of(path, shard[1]) == shard[0]]
+    if exclude:
+        files = [path for path in files if path not in exclude]
+
+    large = []
+    if split_size is not None and workers != 1:
+        large = [path for path in files if file_size(path) >= split_size]
+        if large:
+            large_files = set(large)
+            files = [path for path in files if path not in large_files]
+
+    tasks = ((path, options) for path in files)
+
+    if workers == 1:
+        for task in tasks:
+            yield process_file(task)
+    elif timeout is not None:
+        yield from run_supervised(tasks, workers, timeout)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for result in pool.imap_unordered(process_file, tasks, chunksize):
+                yield result
+
+    # The time limit of these is only checked by the parser (they are not run by a worker)
+    for path in large:
+        yield process_file((path, dict(options, workers=workers or os.cpu_count() or 1)))
+
+
+def main(argv=None):
+
+    """
+    Command line entry point, writes one JSON line per file
+    """
+
+    parser = argparse.ArgumentParser(description='Generate annotations for a corpus of MusicXML files')
+    parser.add_argument('sources', nargs='+', help='MusicXML files, directories, glob patterns or manifests')
+    parser.add_argument('-o', '--output', default=None, help='output file (JSON lines, defaults to stdout)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=16, help='files dispatched to a worker at a time')
+    parser.add_argument('--time', nargs='?', const='bars', default=None, choices=['bars', 'onsets'],
+                        help='pair each annotation with its bar index or its onset in whole notes')
+    parser.add_argument('--cache', default=None, help='SQLite cache of parsed sequences')
+    parser.add_argument('--cache-size', type=int, default=1 << 30, help='size cap of the cache in bytes')
+    parser.add_argument('--backend', default=None, choices=['etree', 'lxml', 'expat'],
+                        help='XML backend (defaults to lxml when installed)')
+    parser.add_argument('--all-parts', action='store_true', help='annotate every part (only the first one otherwise)')
+    parser.add_argument('--encoding-errors', default='strict', choices=['strict', 'ignore', 'replace'],
+                        help='skip badly encoded files (strict) or decode them leniently')
+    parser.add_argument('--no-triage', action='store_true',
+                        help='parse every file instead of skipping the ones rejected by a pre-scan')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='time limit of each file in seconds (its worker is killed if it does not stop)')
+    parser.add_argument('--max-memory', type=int, default=None,
+                        help='memory (in MB) a worker may grow by while processing a file')
+    parser.add_argument('--shard', type=parse_shard, default=None, metavar='I/N',
+                        help='only process shard I of N (files are split by a hash of their path)')
+    parser.add_argument('--split-size', type=int, default=None,
+                        help='files of at least that many MB are read last, by all the workers at once')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only read the measures that changed since the last incremental run '
+                             '(their outputs are kept next to the files, or in the --cache)')
+    parser.add_argument('--resume', action='store_true',
+                        help='checkpoint the progress next to the output, and skip the files it already holds')
+    parser.add_argument('--verify', action='store_true',
+                        help='when resuming, process again the files whose content changed')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time spent in each parsing stage (summed over all files) to stderr')
+    args = parser.parse_args(argv)
+
+    if args.resume and args.output is None:
+        parser.error('--resume needs an --output file')
+
+    # gen_annotations pairs annotations with bar indexes for any true value other than 'onsets'
+    time = args.time == 'bars' or args.time
+
+    # Results are written to the output along with its checkpoint when resuming
+    checkpoint = None
+    exclude = None
+    if args.resume:
+        checkpoint = Checkpoint(args.output)
+        exclude = checkpoint.done(args.verify)
+        output = None
+    else:
+        output = open(args.output, 'w') if args.output else sys.stdout
+
+    num_ok, num_failed, num_rejected, num_over_budget = 0, 0, 0, 0
+    cache_hits, cache_misses = 0, 0
+    stats = ParseStats()
+    try:
+        for result in run_batch(args.sources, time, args.workers, args.chunksize, args.cache, args.cache_size,
+                                args.backend, args.profile, args.all_parts, args.encoding_errors,
+                                not args.no_triage, args.timeout,
+                                args.max_memory << 20 if args.max_memory is not None else None,
+                                args.shard, exclude, checksum=args.resume,
+                                split_size=args.split_size << 20 if args.split_size is not None else None,
+                                incremental=args.incremental):
+            if 'stats' in result:
+                stats.merge(result.pop('stats'))
+            if checkpoint is not None:
+                checkpoint.write(result, result.pop('sha256', None))
+            else:
+                output.write(json.dumps(result, default=str) + '\n')
+            if result['status'] == 'ok':
+                num_ok += 1
+            elif result['status'] == 'rejected':
+                num_rejected += 1
+            else:
+                num_failed += 1
+                if result['status'] in BUDGET_STATUSES.values():
+                    num_over_budget += 1
+            if result.get('cache') == 'hit':
+                cache_hits += 1
+            elif result.get('cache') == 'miss':
+                cache_misses += 1
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        elif output is not sys.stdout:
+            output.close()
+
+    print('Processed %d files, %d failed (%d over budget), %d rejected'
+          % (num_ok + num_failed + num_rejected, num_failed, num_over_budget, num_rejected), file=sys.stderr)
+    if args.cache is not None:
+        print('Cache: %d hits, %d misses' % (cache_hits, cache_misses), file=sys.stderr)
+    if args.profile:
+        print(stats.report(), file=sys.stderr)
+
+    return 0 if num_failed == 0 else 1
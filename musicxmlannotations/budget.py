@@ -0,0 +1,113 @@
+"""
+Wall-clock and memory limits of the processing of a file, checked
+cooperatively by the parser (at every measure read) so a pathological
+file is abandoned instead of holding up a batch run
+"""
+
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Memory is only measured every that many checks (time is checked every time)
+MEMORY_CHECK_INTERVAL = 16
+
+# Size of the memory pages counted in /proc/self/statm
+PAGE_SIZE = resource.getpagesize() if resource is not None else 4096
+
+
+class BudgetExceeded(RuntimeError):
+
+    """
+    Raised by Budget.check once a limit is exceeded
+
+    limit: 'time' or 'memory'
+    used: seconds elapsed or bytes of memory grown by
+    allowed: the limit itself
+    """
+
+    def __init__(self, limit, used, allowed):
+        if limit == 'time':
+            message = 'Time limit exceeded (%.2fs > %.2fs)' % (used, allowed)
+        else:
+            message = 'Memory limit exceeded (%.1f MB > %.1f MB)' % (used / (1 << 20), allowed / (1 << 20))
+        super().__init__(message)
+        self.limit = limit
+        self.used = used
+        self.allowed = allowed
+
+    def __reduce__(self):
+        # Raised in worker processes too
+        return BudgetExceeded, (self.limit, self.used, self.allowed)
+
+
+def resident_memory():
+
+    """
+    Returns the resident memory of the current process in bytes (its
+    peak where the current value is not available, 0 if neither is)
+    """
+
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+
+    if resource is None:
+        return 0
+
+    # Kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Budget():
+
+    def __init__(self, seconds=None, memory=None):
+
+        """
+        Limits of the processing of a file, counted from now (see start)
+
+        seconds: wall-clock time allowed, None for no limit
+        memory: bytes the resident memory of the process may grow by,
+                None for no limit
+        """
+
+        self.seconds = seconds
+        self.memory = memory
+        self.start()
+
+    def start(self):
+
+        """
+        (Re)starts counting, for a new file
+        """
+
+        self.started = time.monotonic()
+        self.base_memory = resident_memory() if self.memory is not None else 0
+        self.checks = 0
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def check(self):
+
+        """
+        Raises BudgetExceeded if a limit is exceeded
+        """
+
+        if self.seconds is not None:
+            elapsed = time.monotonic() - self.started
+            if elapsed > self.seconds:
+                raise BudgetExceeded('time', elapsed, self.seconds)
+
+        if self.memory is not None:
+            self.checks += 1
+            if self.checks % MEMORY_CHECK_INTERVAL == 0:
+                grown = resident_memory() - self.base_memory
+                if grown > self.memory:
+                    raise BudgetExceeded('memory', grown, self.memory)
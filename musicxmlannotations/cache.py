@@ -0,0 +1,140 @@
+"""
+Persistent cache of the sequences parsed from MusicXML files,
+keyed by file content and parser version
+"""
+
+import time
+import pickle
+import sqlite3
+import hashlib
+
+# Size of the chunks read when hashing a file
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(input_file):
+
+    """
+    Returns the SHA-256 hex digest of the content of a file
+
+    input_file: path, bytes-like object or seekable binary file object
+                (hashed from its current position, which is restored)
+    """
+
+    digest = hashlib.sha256()
+    if isinstance(input_file, (bytes, bytearray, memoryview)):
+        digest.update(input_file)
+    elif hasattr(input_file, 'read'):
+        start = input_file.tell()
+        for chunk in iter(lambda: input_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        input_file.seek(start)
+    else:
+        with open(input_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class SequenceCache():
+
+    def __init__(self, path, max_bytes=1 << 30):
+
+        """
+        Opens (or creates) a single-file SQLite cache
+
+        path: path of the SQLite database
+        max_bytes: size cap of the cached values, least recently used
+                   entries are evicted above it
+        """
+
+        self.path = path
+        self.max_bytes = max_bytes
+
+        # Number of lookups answered (or not) by the cache
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS sequences ('
+            'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)'
+        )
+        self.connection.execute('CREATE INDEX IF NOT EXISTS sequences_last_access ON sequences (last_access)')
+        self.connection.commit()
+
+    def key(self, input_file, *extra):
+
+        """
+        Returns the cache key of a file: hash of its content
+        followed by any extra values (parser version, output mode)
+
+        input_file: path, bytes-like object or seekable binary file object
+                    (hashed from its current position, which is restored)
+        """
+
+        return ':'.join([file_digest(input_file)] + [str(e) for e in extra])
+
+    def get(self, key):
+
+        """
+        Returns the value stored under key, or None if not cached
+        """
+
+        row = self.connection.execute('SELECT value FROM sequences WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.connection.execute('UPDATE sequences SET last_access = ? WHERE key = ?', (time.time(), key))
+        self.connection.commit()
+
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+
+        """
+        Stores value under key and evicts least recently used entries
+        until the cache fits in max_bytes again
+        """
+
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+
+        self.connection.execute(
+            'INSERT OR REPLACE INTO sequences (key, value, size, last_access) VALUES (?, ?, ?, ?)',
+            (key, data, len(data), time.time())
+        )
+
+        # Evict least recently used entries
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM sequences').fetchone()[0]
+        while total > self.max_bytes:
+            evicted = self.connection.execute(
+                'SELECT key, size FROM sequences WHERE key != ? ORDER BY last_access LIMIT 64', (key,)
+            ).fetchall()
+            if len(evicted) == 0:
+                break
+            for evicted_key, size in evicted:
+                if total <= self.max_bytes:
+                    break
+                self.connection.execute('DELETE FROM sequences WHERE key = ?', (evicted_key,))
+                total -= size
+
+        self.connection.commit()
+
+    def stats(self):
+
+        """
+        Returns hit/miss counts of this cache object and
+        the number/size of the stored entries
+        """
+
+        entries, size = self.connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sequences').fetchone()
+
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,213 @@
+"""
+Thin client of the annotation server (see server), using only the
+standard library so it is cheap to import in the processes calling it
+"""
+
+import os
+import json
+import socket
+import argparse
+import http.client
+import urllib.parse
+
+DEFAULT_URL = 'http://127.0.0.1:8765'
+
+# Seconds a request may take (scores queued behind others included)
+DEFAULT_TIMEOUT = 300.0
+
+
+class ServerError(RuntimeError):
+
+    """
+    Raised when the server answers with an error status (eg. 503 when
+    too many requests are pending)
+
+    status: HTTP status of the response
+    """
+
+    def __init__(self, status, message):
+        super().__init__('%d: %s' % (status, message))
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    """
+    HTTP connection over a Unix domain socket
+    """
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class Client():
+
+    def __init__(self, url=DEFAULT_URL, socket_path=None, timeout=DEFAULT_TIMEOUT):
+
+        """
+        Client of the server listening at url, or on the Unix domain
+        socket socket_path (a connection is kept open between requests)
+        """
+
+        self.url = urllib.parse.urlsplit(url)
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.connection = None
+
+    def connect(self):
+        if self.socket_path is not None:
+            return UnixHTTPConnection(self.socket_path, self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def request(self, method, path, body=None, headers=None):
+
+        """
+        Returns the decoded JSON response of a request,
+        raises ServerError for an error status
+        """
+
+        headers = dict(headers or {})
+
+        # A kept-alive connection the server closed is opened again once
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = self.connect()
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                self.close()
+                if attempt == 1:
+                    raise
+
+        if response.will_close:
+            self.close()
+
+        result = json.loads(data)
+        if response.status != 200:
+            raise ServerError(response.status, result.get('error', response.reason))
+
+        return result
+
+    def post(self, endpoint, source, upload, options):
+
+        """
+        Posts a score: bytes as they are, paths by name (the server reads
+        the file) unless upload is set
+        """
+
+        options = {k: v for k, v in options.items() if v is not None}
+
+        if isinstance(source, (bytes, bytearray, memoryview)) or upload:
+            if not isinstance(source, (bytes, bytearray, memoryview)):
+                with open(source, 'rb') as f:
+                    source = f.read()
+            query = urllib.parse.urlencode({k: int(v) if isinstance(v, bool) else v for k, v in options.items()})
+            return self.request('POST', endpoint + ('?' + query if query else ''), bytes(source),
+                                {'Content-Type': 'application/octet-stream'})
+
+        body = json.dumps(dict(options, path=os.path.abspath(source))).encode('utf-8')
+        return self.request('POST', endpoint, body, {'Content-Type': 'application/json'})
+
+    def annotate(self, source, time=None, all_parts=None, errors=None, triage=None, upload=False, incremental=None):
+
+        """
+        Returns the result of a score (see batch.process_file), its
+        annotations being under 'annotations' if its status is 'ok'
+
+        source: path or bytes of a .musicxml/.mxl file
+        time, all_parts, errors, triage, incremental: see batch.run_batch
+                                                      (time is 'bars' or 'onsets',
+                                                      True standing for 'bars')
+        upload: send the content of a path instead of its name (for a
+                server that cannot read it)
+        """
+
+        if time is True:
+            time = 'bars'
+        elif time is False:
+            time = None
+
+        return self.post('/annotate', source, upload,
+                         {'time': time, 'all_parts': all_parts, 'errors': errors, 'triage': triage,
+                          'incremental': incremental})
+
+    def sequences(self, source, errors=None, triage=None, upload=False, incremental=None):
+
+        """
+        Returns the result of a score, its sequences (see
+        MusicXML.get_sequences) being under 'sequences' if its status is 'ok'
+        """
+
+        return self.post('/sequences', source, upload, {'errors': errors, 'triage': triage,
+                                                        'incremental': incremental})
+
+    def health(self):
+        return self.request('GET', '/health')
+
+    def queue(self):
+        return self.request('GET', '/queue')
+
+
+def main(argv=None):
+
+    """
+    Command line entry point, writes one JSON line per file
+    """
+
+    parser = argparse.ArgumentParser(description='Annotate MusicXML files with a running annotation server')
+    parser.add_argument('files', nargs='*', help='MusicXML files')
+    parser.add_argument('--url', default=DEFAULT_URL, help='URL of the server')
+    parser.add_argument('--socket', default=None, help='Unix domain socket of the server (instead of --url)')
+    parser.add_argument('--sequences', action='store_true', help='get the sequences instead of the annotations')
+    parser.add_argument('--time', nargs='?', const='bars', default=None, choices=['bars', 'onsets'],
+                        help='pair each annotation with its bar index or its onset in whole notes')
+    parser.add_argument('--all-parts', action='store_true', help='annotate every part (only the first one otherwise)')
+    parser.add_argument('--upload', action='store_true', help='send the content of the files instead of their paths')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only read the measures that changed since the last incremental request')
+    parser.add_argument('--health', action='store_true', help='print the status of the server')
+    parser.add_argument('--queue', action='store_true', help='print the requests pending on the server')
+    args = parser.parse_args(argv)
+
+    num_failed = 0
+    with Client(args.url, args.socket) as client:
+        if args.health:
+            print(json.dumps(client.health()))
+        if args.queue:
+            print(json.dumps(client.queue()))
+
+        for path in args.files:
+            try:
+                if args.sequences:
+                    result = client.sequences(path, upload=args.upload, incremental=args.incremental or None)
+                else:
+                    result = client.annotate(path, args.time, args.all_parts or None, upload=args.upload,
+                                             incremental=args.incremental or None)
+            except ServerError as e:
+                result = {'status': 'error', 'error': str(e)}
+            result['file'] = path
+            if result['status'] != 'ok':
+                num_failed += 1
+            print(json.dumps(result))
+
+    return 0 if num_failed == 0 else 1
@@ -0,0 +1,318 @@
+"""
+Columnar export of the annotations of a corpus: one row per annotation
+with its file id, part, staff, page, bar index, onset, token kind and
+text (see gen_annotation_rows), so they can be queried without reading
+the scores or JSON results again
+
+Rows are buffered and written in large row groups, to a Parquet file
+when pyarrow is installed or to a NumPy .npz file otherwise (kind and
+text being dictionary encoded: int32 codes into kind_values/text_values).
+The results of the files (path, status, error) are written as JSON lines
+next to it (see files_path), the file id of a row being the line of its
+file.
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from .batch import run_batch, BUDGET_STATUSES
+from .shards import parse_shard
+
+# Rows buffered before they are written as one row group
+ROW_GROUP_SIZE = 1 << 20
+
+# NumPy type of the numeric columns, in column order (followed by kind and text)
+NUMERIC_COLUMNS = (('file_id', np.int32), ('part', np.int16), ('staff', np.int16), ('page', np.int32),
+                   ('bar', np.int32), ('onset', np.float64))
+
+# Columns holding strings
+STRING_COLUMNS = ('kind', 'text')
+
+FORMATS = ('parquet', 'npz')
+
+# First bytes of a Parquet file
+PARQUET_MAGIC = b'PAR1'
+
+
+def default_format(path):
+
+    """
+    Returns the format of an export: npz for a .npz path or when pyarrow
+    is not installed, parquet otherwise
+    """
+
+    if pa is None or os.fspath(path).endswith('.npz'):
+        return 'npz'
+    return 'parquet'
+
+
+def files_path(path):
+    return os.fspath(path) + '.files.jsonl'
+
+
+class AnnotationWriter():
+
+    def __init__(self, path, format=None, row_group_size=ROW_GROUP_SIZE):
+
+        """
+        Writer of the rows of an export, written row_group_size rows at a
+        time (rows of the npz format are staged in raw files next to the
+        export until it is closed)
+
+        path: path of the export
+        format: 'parquet' or 'npz' (see default_format)
+        """
+
+        self.path = os.fspath(path)
+        self.format = format or default_format(path)
+        self.row_group_size = row_group_size
+
+        if self.format not in FORMATS:
+            raise ValueError('Unknown export format: ' + self.format)
+        if self.format == 'parquet' and pa is None:
+            raise ValueError('The parquet format needs pyarrow to be installed')
+
+        self.files = open(files_path(self.path), 'w')
+        self.num_files = 0
+        self.num_rows = 0
+
+        # Chunks of each column not written yet
+        self.chunks = {name: [] for name, _ in NUMERIC_COLUMNS}
+        self.strings = {name: [] for name in STRING_COLUMNS}
+        self.buffered = 0
+
+        if self.format == 'parquet':
+            self.schema = pa.schema([(name, pa.from_numpy_dtype(dtype)) for name, dtype in NUMERIC_COLUMNS]
+                                    + [(name, pa.string()) for name in STRING_COLUMNS])
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        else:
+            # Values of the strings, their code being their index
+            self.values = {name: {} for name in STRING_COLUMNS}
+            self.staging = tempfile.mkdtemp(prefix='.export-', dir=os.path.dirname(os.path.abspath(self.path)))
+            self.staged = {name: open(os.path.join(self.staging, name), 'wb')
+                           for name in [n for n, _ in NUMERIC_COLUMNS] + list(STRING_COLUMNS)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_file(self, result, rows=None):
+
+        """
+        Records the result of a file (see batch.process_file, without its
+        rows) and writes its rows (AnnotationRows), returns its file id
+        """
+
+        file_id = self.num_files
+        self.files.write(json.dumps(result, default=str) + '\n')
+        self.num_files += 1
+
+        if rows is not None and len(rows.text) > 0:
+            self.chunks['file_id'].append(np.full(len(rows.text), file_id, dtype=np.int32))
+            for name, dtype in NUMERIC_COLUMNS[1:]:
+                self.chunks[name].append(np.asarray(getattr(rows, name), dtype=dtype))
+            for name in STRING_COLUMNS:
+                self.strings[name] += getattr(rows, name)
+            self.buffered += len(rows.text)
+
+            if self.buffered >= self.row_group_size:
+                self.flush()
+
+        return file_id
+
+    def flush(self):
+
+        """
+        Writes the buffered rows
+        """
+
+        if self.buffered == 0:
+            return
+
+        columns = {name: np.concatenate(chunks) for name, chunks in self.chunks.items()}
+
+        if self.format == 'parquet':
+            arrays = [pa.array(columns[name]) for name, _ in NUMERIC_COLUMNS] \
+                + [pa.array(self.strings[name], pa.string()) for name in STRING_COLUMNS]
+            self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema),
+                                    row_group_size=self.buffered)
+        else:
+            for name, values in columns.items():
+                values.tofile(self.staged[name])
+            for name in STRING_COLUMNS:
+                codes = self.values[name]
+                setdefault = codes.setdefault
+                ids = [setdefault(v, len(codes)) for v in self.strings[name]]
+                np.array(ids, dtype=np.int32).tofile(self.staged[name])
+
+        self.num_rows += self.buffered
+        self.chunks = {name: [] for name in self.chunks}
+        self.strings = {name: [] for name in STRING_COLUMNS}
+        self.buffered = 0
+
+    def close(self):
+
+        """
+        Writes the remaining rows and finishes the export
+        """
+
+        if self.files.closed:
+            return
+
+        try:
+            self.flush()
+            if self.format == 'parquet':
+                self.writer.close()
+            else:
+                self.write_npz()
+        finally:
+            self.files.close()
+            if self.format == 'npz':
+                for f in self.staged.values():
+                    f.close()
+                shutil.rmtree(self.staging, ignore_errors=True)
+
+    def write_npz(self):
+
+        """
+        Gathers the staged columns into the .npz export (they are memory
+        mapped, np.savez copies them in chunks)
+        """
+
+        for f in self.staged.values():
+            f.close()
+
+        dtypes = dict(NUMERIC_COLUMNS, **{name: np.int32 for name in STRING_COLUMNS})
+        arrays = {}
+        for name, dtype in dtypes.items():
+            staged = os.path.join(self.staging, name)
+            if self.num_rows > 0:
+                arrays[name] = np.memmap(staged, dtype=dtype, mode='r', shape=(self.num_rows,))
+            else:
+                arrays[name] = np.zeros(0, dtype=dtype)
+        for name in STRING_COLUMNS:
+            arrays[name + '_values'] = np.array(list(self.values[name]), dtype=str)
+
+        # np.savez adds .npz to paths without it
+        with open(self.path, 'wb') as f:
+            np.savez(f, **arrays)
+
+
+def read_export(path):
+
+    """
+    Returns the columns of an export as a dict of NumPy arrays (the strings
+    of a .npz export being decoded), along with the results of its files
+    """
+
+    path = os.fspath(path)
+
+    with open(files_path(path), 'r') as f:
+        files = [json.loads(line) for line in f]
+
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+
+    if magic != PARQUET_MAGIC:
+        with np.load(path) as data:
+            columns = {name: data[name] for name, _ in NUMERIC_COLUMNS}
+            for name in STRING_COLUMNS:
+                columns[name] = data[name + '_values'][data[name]]
+    elif pq is None:
+        raise ValueError('Reading a parquet export needs pyarrow to be installed')
+    else:
+        table = pq.read_table(path)
+        columns = {name: table.column(name).to_numpy() for name in table.column_names}
+
+    return columns, files
+
+
+def export_annotations(sources, path, format=None, row_group_size=ROW_GROUP_SIZE, **options):
+
+    """
+    Exports the annotations of every file found in sources and yields the
+    result of each file once its rows are buffered (without its rows)
+
+    path: path of the export
+    format, row_group_size: see AnnotationWriter
+    options: passed to batch.run_batch
+    """
+
+    with AnnotationWriter(path, format, row_group_size) as writer:
+        for result in run_batch(sources, output='rows', **options):
+            rows = result.pop('rows', None)
+            writer.add_file({k: v for k, v in result.items() if k != 'stats'}, rows)
+            yield result
+
+
+def main(argv=None):
+
+    """
+    Command line entry point
+    """
+
+    parser = argparse.ArgumentParser(description='Export the annotations of a corpus of MusicXML files '
+                                                 'to a columnar file')
+    parser.add_argument('sources', nargs='+', help='MusicXML files, directories, glob patterns or manifests')
+    parser.add_argument('-o', '--output', required=True,
+                        help='output file (Parquet, or NumPy .npz when pyarrow is not installed)')
+    parser.add_argument('--format', default=None, choices=FORMATS,
+                        help='format of the output (defaults to npz for a .npz output or without pyarrow)')
+    parser.add_argument('--row-group-size', type=int, default=ROW_GROUP_SIZE, help='rows written at a time')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--chunksize', type=int, default=16, help='files dispatched to a worker at a time')
+    parser.add_argument('--cache', default=None, help='SQLite cache of parsed sequences')
+    parser.add_argument('--cache-size', type=int, default=1 << 30, help='size cap of the cache in bytes')
+    parser.add_argument('--backend', default=None, choices=['etree', 'lxml', 'expat'],
+                        help='XML backend (defaults to lxml when installed)')
+    parser.add_argument('--all-parts', action='store_true', help='export every part (only the first one otherwise)')
+    parser.add_argument('--encoding-errors', default='strict', choices=['strict', 'ignore', 'replace'],
+                        help='skip badly encoded files (strict) or decode them leniently')
+    parser.add_argument('--no-triage', action='store_true',
+                        help='parse every file instead of skipping the ones rejected by a pre-scan')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='time limit of each file in seconds (its worker is killed if it does not stop)')
+    parser.add_argument('--max-memory', type=int, default=None,
+                        help='memory (in MB) a worker may grow by while processing a file')
+    parser.add_argument('--shard', type=parse_shard, default=None, metavar='I/N',
+                        help='only process shard I of N (files are split by a hash of their path)')
+    args = parser.parse_args(argv)
+
+    if args.format == 'parquet' and pa is None:
+        parser.error('the parquet format needs pyarrow to be installed')
+
+    num_ok, num_failed, num_rejected, num_over_budget = 0, 0, 0, 0
+    for result in export_annotations(args.sources, args.output, args.format, args.row_group_size,
+                                     workers=args.workers, chunksize=args.chunksize, cache_path=args.cache,
+                                     cache_size=args.cache_size, backend=args.backend, all_parts=args.all_parts,
+                                     errors=args.encoding_errors, triage=not args.no_triage, timeout=args.timeout,
+                                     max_memory=args.max_memory << 20 if args.max_memory is not None else None,
+                                     shard=args.shard):
+        if result['status'] == 'ok':
+            num_ok += 1
+        elif result['status'] == 'rejected':
+            num_rejected += 1
+        else:
+            num_failed += 1
+            if result['status'] in BUDGET_STATUSES.values():
+                num_over_budget += 1
+
+    print('Exported %d files, %d failed (%d over budget), %d rejected'
+          % (num_ok + num_failed + num_rejected, num_failed, num_over_budget, num_rejected), file=sys.stderr)
+
+    return 0 if num_failed == 0 else 1
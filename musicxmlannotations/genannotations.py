@@ -1,51 +1,70 @@
 import sys
 import os
 import argparse
+import contextlib
+import collections
+import itertools
+from fractions import Fraction
+import numpy as np
 from .musicxml import MusicXML
+from .triage import ScoreRejected
+from .timing import bar_onsets, bar_onset_fractions
+from .tokens import NOTE, REST, FORWARD, CLEF, KEY, MULTIREST, BARLINE, NO_ADVANCE
 
+# One row per annotation of a score (see gen_annotation_rows), every field
+# being a column: NumPy arrays of the part, staff and page it was read in
+# (int16, int16, int32), the index of its bar in its part (int32), its onset
+# in whole notes since the start of the piece (float64), and lists of the
+# kind of its token (see tokens) and of its symbol
+AnnotationRows = collections.namedtuple('AnnotationRows',
+                                        ['part', 'staff', 'page', 'bar', 'onset', 'kind', 'text'])
 
-def filterForAnnotations(sequences, include_notes=False, include_rests=False):
-    annotations = list()
 
+def iter_annotation_tokens(sequences, include_notes=False, include_rests=False, start=0):
+    """
+    Yields the (token, annotation symbol) pairs of a list of token
+    sequences, barlines included (see filterForAnnotations)
+    """
     for seq in sequences:
-        s = seq.split(' + ')  # Each element is a series of simultaneous tokens
-
-        for elem in s:
-            tokens = elem.split(' ')
-            t = tokens[0]  # Take first element in chord. They will all have same length anyway
+        for idx, t in enumerate(seq, start):
+            # Take first element in chord. They will all have same length anyway
+            if idx > 0 and t.sep == NO_ADVANCE:
+                continue
 
-            if 'barline' in t:
-                annotations.append(t)
-            elif 'note' in t:
+            if t.kind == BARLINE:
+                yield t, t.symbol
+            elif t.kind == NOTE:
                 if include_notes:
-                    split = t.split('_')
-                    time = '_'.join(split[1:len(split) + 1])
-                    annotations.append(time)
+                    yield t, (t.duration or '') + ('.' if t.dot else '')
                 else:
                     continue
 
-            elif 'rest' in t:
+            elif t.kind in (REST, MULTIREST):
                 if include_rests:
-                    split = t.split('-')
-                    time = '-'.join(split[1:len(split) + 1])
-                    annotations.append(time)
+                    yield t, (t.duration or '') + ('.' if t.dot else '')
                 else:
                     continue
-                
-            elif 'clef' in t or 'key' in t:
-                continue
-            elif '+' in t:  # If bar empty
+
+            elif t.kind in (CLEF, KEY, FORWARD):
                 continue
             else:
-                annotations.append(t)
+                yield t, t.symbol
+
 
-    return annotations
+def filterForAnnotations(sequences, include_notes=False, include_rests=False, start=0):
+    """
+    Returns the annotation symbols of a list of token sequences
+    (with the duration of notes/rests if included)
+
+    start: position of the sequences in their page, if they do not start it
+    """
+    return [a for _, a in iter_annotation_tokens(sequences, include_notes, include_rests, start)]
 
 
 def get_bar_annotations(staves):
     staves_bars = list()
     for stave in staves:
-        sequences = [x for x in stave if x != '']
+        sequences = [x for x in stave if len(x) > 0]
         sequences_annotations = filterForAnnotations(sequences, include_notes=False, include_rests=False)
 
         # Group all elements in same bars together
@@ -60,55 +79,94 @@ def get_bar_annotations(staves):
 
         staves_bars.append(full)
 
-    # Merge
-    merged = list()
-    for s in staves_bars:
-        for idx, bar in enumerate(s):
-            if len(merged) > idx:
-                merged[idx] += bar
-            else:
-                merged.append(bar)
+    # Merge the bars of all staves (staves in order within each bar)
+    merged = [list(itertools.chain.from_iterable(bars))
+              for bars in itertools.zip_longest(*staves_bars, fillvalue=())]
 
     return merged
 
 
-def get_first_bar_time(sequence):
-    first_bar = [x for x in sequence if x != ''][0]
-    first_bar = first_bar.split(' + barline + ')[0]  # Get first bar
-    first_bar = filterForAnnotations([first_bar], include_notes=True, include_rests=True)
-    
-    note_dur_dict = {'half': 1/2,
-            'quarter': 1/4,
-            'eighth': 1/8,
-            'sixteenth': 1/16,
-            'thirty_second': 1/32}
-
-    counter = 0
-    for t in first_bar:
-        dot = True if '.' in t else False
-        t = t.replace('.', '')
-        if t in note_dur_dict.keys():
-            if dot:
-                counter += note_dur_dict[t] * 1.5
-            else:
-                counter += note_dur_dict[t]
+def iter_bar_annotations(input_file, backend=None, stats=None, errors='strict', budget=None):
+    """
+    Incrementally parses a score and yields (bar_index, annotations) for
+    each bar of its first part as soon as every staff has finished it,
+    annotations being what get_bar_annotations returns for that bar.
+    Memory does not depend on the length of the score (see
+    MusicXML.iter_measures).
+
+    Unlike gen_annotations, invalid XML raises one of the errors of the
+    backend once the bars before it have been yielded. A score rejected by
+    the parser raises triage.ScoreRejected once its bars have been yielded.
 
-    return counter
+    backend, stats, errors, budget: see MusicXML
+    """
+    musicxml_obj = MusicXML(input_file=input_file, backend=backend, stats=stats, errors=errors, budget=budget)
+
+    # Annotations of the bar being read and of the bars finished on each staff
+    bars = None
+    finished = None
+    bar_index = 0
+
+    for starts, staves in musicxml_obj.iter_measures():
+        if bars is None:
+            bars = [[] for _ in staves]
+            finished = [collections.deque() for _ in staves]
+
+        for s, tokens in enumerate(staves):
+            for a in filterForAnnotations([tokens], start=starts[s]):
+                if a == 'barline':
+                    finished[s].append(bars[s])
+                    bars[s] = []
+                else:
+                    bars[s].append(a)
 
+        # Staves in order within each bar
+        while all(finished):
+            yield bar_index, [a for f in finished for a in f.popleft()]
+            bar_index += 1
 
-def calculateAnnotationBars(staves, sequence):
+    # Bars only some staves have
+    while finished is not None and any(finished):
+        yield bar_index, [a for f in finished if f for a in f.popleft()]
+        bar_index += 1
+
+    if musicxml_obj.rejected is not None:
+        raise ScoreRejected(musicxml_obj.rejected)
+
+
+def split_staves(sequences):
+    """
+    Returns the sequences of each staff of a part, given the
+    sequences of each page (as returned by MusicXML.get_sequences)
+    """
+    num_staves = len(sequences[0]) if len(sequences) > 0 else 0
+
+    return [[x[s] for x in sequences] for s in range(num_staves)]
+
+
+def get_first_bar_time(sequence, divisions=1):
     """
-    Returns list of pairs of (annotation, bar_idx)
+    Returns the length of the first bar of a staff in whole notes, from
+    the onset and length (in divisions) of its notes and rests
+
+    divisions: divisions per quarter note of the first bar (MusicXML.bars[0].divisions)
     """
-    # Get time of first bar in top stave
-    first_bar_time = get_first_bar_time(staves[0])
+    first_bar = [x for x in sequence if len(x) > 0][0]
+
+    end = 0
+    for t in first_bar:  # Get first bar
+        if t.kind == BARLINE:
+            break
+        if t.kind in (NOTE, REST):
+            end = max(end, t.onset + t.length)
 
-    time_sig_dict = {
-        'C/': 1,
-        '4/8': 4/8,
-        '3/8': 3/8,
-    }
+    return Fraction(end, 4 * divisions)
 
+
+def calculateAnnotationBars(staves, sequence):
+    """
+    Returns list of pairs of (bar_idx, annotation)
+    """
     annotation_times = list()
     for idx, bar in enumerate(sequence):
         for elem in bar:
@@ -118,68 +176,224 @@ def calculateAnnotationBars(staves, sequence):
     return annotation_times
 
 
-def calculateAnnotationTimes(staves, sequence):
+def calculateAnnotationTimes(bars, sequence, onsets=None):
     """
-    Returns list of pairs of (annotation, beats since piece start)
+    Returns list of pairs of (onset, annotation), the onset of an
+    annotation being the onset of its bar in whole notes since the piece
+    start, as an exact Fraction (not a float)
+
+    bars: MusicXML.bars of the parsed score (one per bar of sequence)
+    sequence: annotations of each bar (see get_bar_annotations)
+    onsets: onset of each bar of sequence as Fractions of whole notes, eg.
+            as returned by merge_part_annotations (computed from bars when
+            None, bars is unused otherwise)
     """
-    # Get time of first bar in top stave
-    first_bar_time = get_first_bar_time(staves[0])
-
-    time_sig_dict = {
-        'C/': 1,
-        '4/8': 4/8,
-        '3/8': 3/8,
-    }
+    if onsets is None:
+        onsets = bar_onset_fractions(bars)
 
-    add_next = 0
-    time_sig = 0
-    running_time = 0
     annotation_times = list()
     for idx, bar in enumerate(sequence):
-        running_time += time_sig
+        for elem in bar:
+            if not elem.startswith('timeSignature-'):
+                annotation_times.append((onsets[idx], elem))
 
-        running_time += add_next
-        add_next = 0
+    return annotation_times
 
-        for elem in bar:
-            if 'timeSignature' in elem:
-                bar_time_sig_end = elem.split('-')[1]
-                time_sig = time_sig_dict[bar_time_sig_end]
 
-                if idx == 0:
-                    add_next = first_bar_time - time_sig
-            else:
-                annotation_times.append((running_time, elem))
+def merge_part_annotations(part_annotations, part_bars):
+    """
+    Merges the bar annotations of several parts, aligning the bars of
+    the parts on their onsets (parts can have a different number of
+    bars, eg. a multirest written in one part only)
 
-    return annotation_times
+    Returns the merged bars and the onset of each of them
+
+    part_annotations: get_bar_annotations of each part
+    part_bars: MusicXML.part_bars
+    """
+    part_onsets = [bar_onset_fractions(bars) for bars in part_bars]
+
+    onsets = sorted(set(itertools.chain.from_iterable(
+        o[:len(a)] for a, o in zip(part_annotations, part_onsets))))
+    index = {onset: i for i, onset in enumerate(onsets)}
+
+    merged = [[] for _ in onsets]
+    for annotations, bar_onsets in zip(part_annotations, part_onsets):
+        for bar, onset in zip(annotations, bar_onsets):
+            merged[index[onset]] += bar
+
+    return merged, onsets
 
 
-def gen_annotations(input_file, time, verbose):
-    musicxml_obj = MusicXML(input_file=input_file)
+def read_part_sequences(musicxml_obj, all_parts=False, workers=None, incremental=False):
+    """
+    Returns the token sequences (see MusicXML.get_sequences) and the bars
+    (see MusicXML.bars) of each part read, every part if all_parts is set
+    or the first one otherwise
+
+    Raises triage.ScoreRejected if the first part is rejected by the parser
+    (percussion/TAB clef, weird key or time signature) when it is the only
+    part read (the other parts can be annotated whatever it holds)
 
-    try:
-        sequences = musicxml_obj.get_sequences()
-    except UnicodeDecodeError: # Ignore bad MusicXML
-        raise Exception('Corrupted file')
+    all_parts, workers, incremental: see gen_annotations
+    """
+    if all_parts:
+        part_sequences = musicxml_obj.get_part_sequences(tokens=True, workers=workers)
+        part_bars = musicxml_obj.part_bars
+    else:
+        if incremental:
+            part_sequences = [musicxml_obj.get_sequences_incremental(tokens=True)]
+        else:
+            part_sequences = [musicxml_obj.get_sequences(tokens=True, workers=workers or 1)]
+        part_bars = [musicxml_obj.bars]
 
-    staves = [[x[0] for x in sequences]] + [[x[1] for x in sequences]]
+    if musicxml_obj.rejected is not None:
+        raise ScoreRejected(musicxml_obj.rejected)
 
-    # Check staves have same length
-    if len(staves[0]) * len(staves) != sum([len(s) for s in staves]):
-        raise Exception('Decoded staves have different lengths')
+    return part_sequences, part_bars
 
-    merged = get_bar_annotations(staves)
+
+def gen_annotations(input_file, time, verbose, cache=None, backend=None, stats=None, all_parts=False,
+                    workers=None, errors='strict', budget=None, incremental=False):
+    """
+    time: pair each annotation with its bar index (True)
+          or its onset in whole notes as a Fraction ('onsets')
+    cache: optional SequenceCache
+    backend: XML backend to parse with (see backends.get_backend)
+    stats: optional ParseStats recording the time spent in each stage
+    all_parts: merge the annotations of every part of the score
+               (only the first part otherwise)
+    workers: number of processes reading the parts when all_parts is set
+             (see MusicXML.get_part_sequences), or the pages of the first
+             part otherwise (see MusicXML.get_sequences, which only reads
+             them concurrently when workers is given)
+    errors: decoding errors policy (see MusicXML)
+    budget: optional budget.Budget limiting the time/memory spent on the file,
+            budget.BudgetExceeded is raised once it is exceeded
+    incremental: only read the measures of the first part that changed since
+                 the last incremental call on the file, reusing the output of
+                 the others (see MusicXML.get_sequences_incremental), ignored
+                 when all_parts is set
+
+    Raises triage.ScoreRejected for a score the parser rejects (see read_part_sequences),
+    and for a file that is not valid MusicXML when errors is 'strict' (reason
+    triage.REJECT_MALFORMED, or REJECT_UNREADABLE for an invalid .mxl). The
+    lenient policies read what they can: a file still invalid once decoded
+    has no annotations.
+    """
+    def stage(name):
+        return stats.stage(name) if stats is not None else contextlib.nullcontext()
+
+    musicxml_obj = MusicXML(input_file=input_file, cache=cache, backend=backend, stats=stats, errors=errors,
+                            budget=budget)
+
+    with stage('get_sequences'):
+        part_sequences, part_bars = read_part_sequences(musicxml_obj, all_parts, workers, incremental)
+
+    part_staves = [split_staves(sequences) for sequences in part_sequences]
+
+    # Check staves (of each part) have same length
+    for s in part_staves:
+        if any(len(staff) != len(s[0]) for staff in s):
+            raise Exception('Decoded staves have different lengths')
+
+    # Every staff of every part read
+    staves = [staff for s in part_staves for staff in s]
+
+    # Bars of a part are merged by index, bars of different parts by onset
+    onsets = None
+    with stage('get_bar_annotations'):
+        if len(part_staves) == 1:
+            merged = get_bar_annotations(staves)
+        else:
+            merged, onsets = merge_part_annotations([get_bar_annotations(s) for s in part_staves], part_bars)
     if verbose:
         print('Merged annotations:\n', merged)
 
-    if time:
-        merged = calculateAnnotationBars(staves, merged)
+    if time == 'onsets':
+        with stage('annotation_times'):
+            merged = calculateAnnotationTimes(musicxml_obj.bars, merged, onsets)
+        if verbose:
+            print('Times:\n', merged)
+    elif time:
+        with stage('annotation_times'):
+            merged = calculateAnnotationBars(staves, merged)
         if verbose:
             print('Times:\n', merged)
     
     return merged
 
 
+def part_annotation_rows(part, sequences, bars):
+    """
+    Returns the AnnotationRows of a part, the annotations of each staff
+    being in order (staves one after the other)
+
+    sequences: token sequences of the part (see MusicXML.get_sequences)
+    bars: MusicXML.bars of the part
+    """
+    staves, pages, bar_indexes, token_onsets, kinds, texts = [], [], [], [], [], []
+
+    for s, staff in enumerate(split_staves(sequences)):
+        bar = 0
+        for page, seq in enumerate(staff):
+            for t, a in iter_annotation_tokens([seq]):
+                if t.kind == BARLINE:
+                    bar += 1
+                    continue
+                staves.append(s)
+                pages.append(page)
+                bar_indexes.append(bar)
+                token_onsets.append(t.onset)
+                kinds.append(t.kind)
+                texts.append(a)
+
+    bar_indexes = np.array(bar_indexes, dtype=np.int32)
+
+    # Tokens after the last barline are placed from the end of the last bar
+    onsets, denominator = bar_onsets(bars)
+    divisions = np.array([b.divisions for b in bars] + [bars[-1].divisions if bars else 1], dtype=np.int64)
+    index = np.minimum(bar_indexes, len(bars))
+    onset = onsets[index] / denominator \
+        + np.array(token_onsets, dtype=np.float64) / (4 * np.maximum(divisions[index], 1))
+
+    return AnnotationRows(np.full(len(texts), part, dtype=np.int16), np.array(staves, dtype=np.int16),
+                          np.array(pages, dtype=np.int32), bar_indexes, onset, kinds, texts)
+
+
+def gen_annotation_rows(input_file, cache=None, backend=None, stats=None, all_parts=False, workers=None,
+                        errors='strict', budget=None, incremental=False):
+    """
+    Returns the annotations of a score as AnnotationRows (one row per
+    annotation, time signatures included), the rows of each part being
+    in order. Unlike gen_annotations the bars of the staves and parts are
+    not merged, the bar index and onset of each row place it.
+
+    cache, backend, stats, all_parts, workers, errors, budget, incremental: see gen_annotations
+    """
+    def stage(name):
+        return stats.stage(name) if stats is not None else contextlib.nullcontext()
+
+    musicxml_obj = MusicXML(input_file=input_file, cache=cache, backend=backend, stats=stats, errors=errors,
+                            budget=budget)
+
+    with stage('get_sequences'):
+        part_sequences, part_bars = read_part_sequences(musicxml_obj, all_parts, workers, incremental)
+
+    with stage('annotation_rows'):
+        parts = [part_annotation_rows(p, sequences, bars)
+                 for p, (sequences, bars) in enumerate(zip(part_sequences, part_bars))]
+
+    if len(parts) == 1:
+        return parts[0]
+    if len(parts) == 0:
+        return part_annotation_rows(0, [], [])
+
+    return AnnotationRows(*[np.concatenate([getattr(rows, name) for rows in parts])
+                            for name in AnnotationRows._fields[:5]],
+                          [k for rows in parts for k in rows.kind], [a for rows in parts for a in rows.text])
+
+
 def main(input_file, time, verbose):
     """
     input_dir: <input directory with MusicXMLS>
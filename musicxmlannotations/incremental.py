@@ -0,0 +1,111 @@
+"""
+Outputs of the measures of a score kept between reads, so an edited
+score only has the measures that changed read again (see
+MusicXML.get_sequences_incremental)
+
+The output of a measure (the fields of its tokens, its bar and the parser
+state it leaves) is keyed by a fingerprint of everything it depends on:
+the hash of the measure's XML, the parser state carried into it (clef,
+key, time signature, ...), its number of staves, which staves of its
+page already hold tokens and whether it starts the score. The outputs
+are stored as a pickle sidecar file next to the score (or in a
+SequenceCache).
+"""
+
+import os
+import pickle
+import hashlib
+
+# Version of the stored outputs format, bump it whenever it changes
+MEASURES_VERSION = 1
+
+
+def measures_path(input_file):
+
+    """
+    Returns the path of the sidecar file of the measure outputs of a score
+    """
+
+    return os.fspath(input_file) + '.measures.pkl'
+
+
+def measures_cache_key(input_file, *extra):
+
+    """
+    Returns the cache key of the measure outputs of a score: its path
+    (they are looked up after its content changed) followed by any extra
+    values (parser version, decoding errors policy)
+    """
+
+    return ':'.join(['measures', os.path.abspath(input_file)] + [str(e) for e in extra])
+
+
+def measure_digests(input_file, offsets):
+
+    """
+    Returns the content of a file and the hash of each of its measures
+
+    offsets: (start, end) byte offsets of the measures (see index.scan_measures)
+    """
+
+    with open(input_file, 'rb') as f:
+        data = f.read()
+
+    return data, [hashlib.sha1(data[start:end]).digest() for start, end in offsets]
+
+
+def make_store(outputs, parser_version, errors):
+
+    """
+    Returns the stored form of the measure outputs of a score
+    """
+
+    return {'version': MEASURES_VERSION, 'parser_version': parser_version, 'errors': errors, 'outputs': outputs}
+
+
+def store_outputs(store, parser_version, errors):
+
+    """
+    Returns the measure outputs of a stored form (see make_store), an
+    empty dict if there is none or it was made by another parser version
+    or with another decoding errors policy
+    """
+
+    if store is None or store.get('version') != MEASURES_VERSION or store['parser_version'] != parser_version \
+            or store['errors'] != errors:
+        return {}
+
+    return store['outputs']
+
+
+def load_measures(path):
+
+    """
+    Returns the stored measure outputs at path, or None if they are missing
+    or cannot be read
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+
+
+def save_measures(path, store):
+
+    """
+    Writes stored measure outputs to path (atomically, as they may be read
+    concurrently), outputs that cannot be written are simply not persisted
+    """
+
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(store, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
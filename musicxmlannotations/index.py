@@ -0,0 +1,234 @@
+"""
+Measure offset index of a MusicXML file: byte range of each measure of
+its first part, with the parser state (clef, key, time signature, ...)
+carried into it and the page it belongs to, so pages and measures can
+be parsed without reading what comes before them
+
+The index is built by MusicXML.build_index and persisted as a JSON
+sidecar file next to the score (or in a SequenceCache)
+"""
+
+import os
+import json
+import codecs
+from xml.parsers import expat
+
+from .sources import is_path, detect_encoding, ZIP_MAGIC, HEAD_SIZE
+from .backends import Node
+
+# Version of the index format, bump it whenever it changes
+INDEX_VERSION = 2
+
+# Fields of each measure entry of an index
+MEASURE_FIELDS = ('start', 'end', 'page', 'skip', 'clef', 'key', 'time', 'beat', 'beat_type', 'divisions', 'rejected')
+
+# Size of the chunks fed to the scanner
+CHUNK_SIZE = 1 << 16
+
+# Children of a measure kept in its skeleton (see scan_measures), besides the first one
+SKELETON_TAGS = ('print', 'attributes')
+
+
+def index_path(input_file):
+
+    """
+    Returns the path of the sidecar index file of a score
+    """
+
+    return os.fspath(input_file) + '.index.json'
+
+
+def file_stamp(input_file):
+
+    """
+    Returns the (size, modification time) of a file, an index
+    is only used while the stamp of its file is unchanged
+    """
+
+    st = os.stat(input_file)
+
+    return [st.st_size, st.st_mtime_ns]
+
+
+def check_indexable(input_file):
+
+    """
+    Returns the encoding of a score that can be indexed (a plain file with
+    an ASCII compatible encoding, so a byte range of it can be decoded on
+    its own), raises ValueError otherwise
+    """
+
+    if not is_path(input_file):
+        raise ValueError('Only MusicXML files given by path can be indexed')
+
+    with open(input_file, 'rb') as f:
+        head = f.read(HEAD_SIZE)
+
+    if head.startswith(ZIP_MAGIC):
+        raise ValueError('Compressed MusicXML files cannot be indexed')
+
+    encoding = detect_encoding(head)
+    if codecs.lookup(encoding).name in ('utf-16', 'utf-32'):
+        raise ValueError('MusicXML files encoded as ' + encoding + ' cannot be indexed')
+
+    return encoding
+
+
+def scan_measures(input_file):
+
+    """
+    Scans a file with expat and returns the (start, end) byte offsets of
+    every child element (measure) of its first <part>, along with the root
+    element of the score holding only its header (<defaults>, <part-list>,
+    ...) and its first part (without children) and a skeleton of each
+    measure: a backends.Node holding only its first child and its <print>
+    and <attributes> elements, which are all the pages and the parser
+    state carried between measures depend on (see MusicXML.scan_measure).
+    Only the nodes of the header and skeletons are built.
+
+    The root is None for an empty document.
+    """
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+
+    offsets = []
+    measures = []
+    root = None
+    stack = []      # Node of each open element
+    text = []       # Character data of the innermost open node, before its first child
+    skipped = 0     # Depth in the element left out being scanned (its handlers are swapped)
+    state = {'part': False, 'done': False, 'start': 0, 'children': 0}
+
+    def start_element(tag, attrib):
+        nonlocal root, skipped
+        depth = len(stack)
+        parent = stack[-1] if stack else None
+        node = None
+
+        if depth == 0:
+            node = root = Node(tag, attrib)
+        elif depth == 1:
+            if tag == 'part':
+                state['part'] = not state['done']
+                if state['part']:
+                    node = Node(tag, attrib)
+            else:
+                node = Node(tag, attrib)
+        elif depth == 2 and state['part']:
+            state['start'] = parser.CurrentByteIndex
+            state['children'] = 0
+            node = Node(tag, attrib)
+            measures.append(node)
+            parent = None
+        elif depth == 3 and state['part']:
+            if state['children'] == 0 or tag in SKELETON_TAGS:
+                node = Node(tag, attrib)
+            state['children'] += 1
+        else:
+            node = Node(tag, attrib)
+
+        if node is None:
+            # Most elements (notes, directions, ...), scanned without building anything
+            text.clear()
+            skipped = 1
+            parser.StartElementHandler = skip_start_element
+            parser.EndElementHandler = skip_end_element
+            parser.CharacterDataHandler = None
+            return
+
+        if parent is not None:
+            if text:
+                parent.text = ''.join(text)
+            parent.children.append(node)
+        text.clear()
+        stack.append(node)
+
+    def end_element(tag):
+        node = stack.pop()
+        depth = len(stack)
+
+        # Text before the first child only (ElementTree's .text)
+        if text and not node.children:
+            node.text = ''.join(text)
+        text.clear()
+
+        if depth == 2 and state['part']:
+            # Offset of the end tag (or of the start tag of an empty element)
+            offsets.append([state['start'], parser.CurrentByteIndex])
+        elif depth == 1 and state['part']:
+            state['part'] = False
+            state['done'] = True
+
+    def character_data(data):
+        if stack and not stack[-1].children:
+            text.append(data)
+
+    def skip_start_element(tag, attrib):
+        nonlocal skipped
+        skipped += 1
+
+    def skip_end_element(tag):
+        nonlocal skipped
+        skipped -= 1
+        if skipped == 0:
+            parser.StartElementHandler = start_element
+            parser.EndElementHandler = end_element
+            parser.CharacterDataHandler = character_data
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+
+    with open(input_file, 'rb') as f:
+        while not state['done']:
+            chunk = f.read(CHUNK_SIZE)
+            parser.Parse(chunk, len(chunk) == 0)
+            if len(chunk) == 0:
+                break
+
+        # Move the end offsets past the '>' of the tags they point at
+        for offset in offsets:
+            f.seek(offset[1])
+            tail = f.read(CHUNK_SIZE)
+            offset[1] += tail.index(b'>') + 1
+
+    return offsets, root, measures
+
+
+def load_index(path, input_file):
+
+    """
+    Returns the index stored at path, or None if it is missing or
+    out of date (different index version or file stamp)
+    """
+
+    try:
+        with open(path, 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if index.get('version') != INDEX_VERSION or index.get('stamp') != file_stamp(input_file):
+        return None
+
+    return index
+
+
+def save_index(path, index):
+
+    """
+    Writes an index to path (atomically, as it may be read concurrently),
+    an index that cannot be written is simply not persisted
+    """
+
+    tmp_path = path + '.%d.tmp' % os.getpid()
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
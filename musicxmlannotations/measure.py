@@ -1,9 +1,45 @@
 # Wrapper class for parse tree of measure element
 import re
 
+from .tokens import Token, NOTE, REST, FORWARD, CLEF, KEY, TIME, MULTIREST, DIRECTION, ADVANCE
+from .triage import check_clef, parse_fifths, parse_time
+
+# Key of each number of sharps/flats (> 0 is sharp, < 0 is flat)
+KEY_NAMES = {7: 'C#M', 6: 'F#M', 5: 'BM', 4: 'EM',
+             3: 'AM', 2: 'DM', 1: 'GM', 0: 'CM',
+             -1: 'FM', -2: 'BbM', -3: 'EbM', -4: 'AbM',
+             -5: 'DbM', -6: 'GbM', -7: 'CbM'}
+
+# Symbol of each accidental
+ACCIDENTALS = {'sharp': '#', 'flat': 'b', 'natural': 'N', 'double-sharp': '##', 'flat-flat': 'bb'}
+
+# Name of the note types that are not used as is
+TYPE_NAMES = {'16th': 'sixteenth', '32nd': 'thirty_second', '64th': 'sixty_fourth', '128th': 'hundred_twenty_eighth'}
+
+# Note type of a measure rest for each beat type (not used, measure rests are whole notes)
+REST_MEASURE_TYPES = {
+    '1': 'whole', '2': 'half', '4': 'quarter', '8': 'eighth', '12': 'eighth.', '16': 'sixteenth',
+    '32': 'thirthy_second', '48': 'thirthy_second.',
+}
+
+# Words/dynamics kept as direction symbols
+DIRECTION_PATTERN = re.compile("[A-Za-z.-]+")
+
+
 class Measure:
 
-    def __init__(self, measure, num_staves, beats, beat_type):
+    # The same object is reused for every measure (see reset)
+    __slots__ = ('measure', 'num_staves', 'beats', 'beat_type', 'divisions')
+
+    def __init__(self, measure=None, num_staves=1, beats=4, beat_type=4, divisions=1):
+
+        self.reset(measure, num_staves, beats, beat_type, divisions)
+
+    def reset(self, measure, num_staves, beats, beat_type, divisions=1):
+
+        """
+        Starts parsing a new measure
+        """
 
         # Store measure .xml along with number of staves and time signature info
         self.measure = measure
@@ -11,170 +47,177 @@ class Measure:
         self.beats = beats
         self.beat_type = beat_type
 
+        # Divisions per quarter note (unit of <duration> elements)
+        self.divisions = divisions
+
 
     def parse_attributes(self, attributes):
-        
+
         '''
-        Reads through all attributes of a measure 
+        Reads through all attributes of a measure
         (this contains key info, time info, etc.)
 
         attributes: the parse tree representing the attributes
+
+        Raises triage.ScoreRejected for percussion/TAB clefs and weird keys
+        or time signatures (the file should be skipped).
         '''
 
-        sequence = ''
+        sequence = []
         skip = 0
 
         # Iterate through all attributes
         for attribute in attributes:
 
-            if attribute.tag == 'key':
-                # Sharps are positive, flats neg
-                try:
-                    sequence += 'keySignature-' + self.num_sharps_flats_to_key(int(attribute[0].text)) + ' '
-                except ValueError:
-                    # Really weird key change, just skip the file
-                    return 'percussion', skip, self.beats, self.beat_type
-                    
-            elif attribute.tag == 'time':
-                # Top and bottom num
-                try:
-                    self.beats = int(attribute[0].text)
-                    self.beat_type = int(attribute[1].text)
-                except ValueError: 
-                    # Weird error where attribute 0 text is '2+2+3', just skip the file
-                    return 'percussion', skip, self.beats, self.beat_type
-                
-                #print('NEW TIME:',self.beats,self.beat_type)
-
-                if 'symbol' in attribute.attrib:
-                    if attribute.attrib['symbol'] == 'cut':     # Cut time
-                        sequence += 'timeSignature-C/' + ' '
-                    elif attribute.attrib['symbol'] == 'common': # Common time
-                        sequence += 'timeSignature-C' + ' '
-                    else:           # Default time
-                        sequence += 'timeSignature-' + attribute[0].text + '/' + attribute[1].text + ' '
-                else:   # Default time sig
-                    sequence += 'timeSignature-' + attribute[0].text + '/' + attribute[1].text + ' '
-
-            elif attribute.tag == 'clef' and ('number' not in attribute.attrib or attribute.attrib['number'] == '1'):
-                # Clef and line (add this first)
-                sequence = 'clef-' + attribute[0].text + attribute[1].text + ' ' + sequence
-
-            elif attribute.tag == 'measure-style':
+            if attribute.tag == 'measure-style':
                 # Look for multi-rest/repeats
                 s, skip = self.parse_measure_style(attribute)
                 sequence += s
+                continue
+
+            handler = ATTRIBUTE_HANDLERS.get(attribute.tag)
+            if handler is not None:
+                handler(self, attribute, sequence)
 
         # Add + symbol between if multiple attributes
-        seq_split = sequence.split()
-        if len(seq_split) > 1:
-            sequence = ' + '.join(seq_split) + ' '
-            #print('SEQUENCE:', sequence)
+        for t in sequence[1:]:
+            t.sep = ADVANCE
 
-        sequence = [sequence for i in range(self.num_staves)]
         return sequence, skip, self.beats, self.beat_type
-    
+
+    def _attribute_key(self, attribute, sequence):
+        # Sharps are positive, flats neg
+        fifths = parse_fifths(attribute[0].text)
+        sequence.append(Token(KEY, 'keySignature-' + self.num_sharps_flats_to_key(fifths)))
+
+    def _attribute_time(self, attribute, sequence):
+        # Top and bottom num (weird times where attribute 0 text is '2+2+3' are rejected)
+        self.beats, self.beat_type = parse_time(attribute[0].text, attribute[1].text)
+
+        symbol = attribute.get('symbol')
+        if symbol == 'cut':         # Cut time
+            sequence.append(Token(TIME, 'timeSignature-C/'))
+        elif symbol == 'common':    # Common time
+            sequence.append(Token(TIME, 'timeSignature-C'))
+        else:                       # Default time sig
+            sequence.append(Token(TIME, 'timeSignature-' + attribute[0].text + '/' + attribute[1].text))
+
+    def _attribute_clef(self, attribute, sequence):
+        # Clef and line of the first staff (add this first)
+        if attribute.get('number', '1') == '1':
+            check_clef(attribute[0].text)
+            sequence.insert(0, Token(CLEF, 'clef-' + attribute[0].text + attribute[1].text))
+
+    def _attribute_divisions(self, attribute, sequence):
+        self.divisions = int(attribute.text)
+
     def parse_note(self, note):
 
         '''
-        Reads through a note of a measure 
+        Reads through a note of a measure
         (this contains staff, voice, articulation, pitch info, etc.)
 
         note: the parse tree representing the note
         '''
 
-        sequence = ['' for x in range(self.num_staves)]
-        cur_rest = False        # for differentiating note vs rest
-
         # Get staff, voice, dot of note, or is part of chord
-        staff, voice, has_dot, is_chord, dur, is_grace, stem_down, articulation = 0, 1, False, False, 0, False, True, ''
+        staff, voice, has_dot, is_chord, dur, is_grace, stem_down = 0, 1, False, False, 0, False, True
+
+        # Pitch/rest/notations elements, type and accidental of the note
+        pitch_elem, rest, note_type, notations, alter = None, None, None, None, ''
+
+        # Single pass over the elements of the note (most frequent first), the
+        # symbol is composed afterwards as the dot and accidental come after
+        # the type and pitch they modify
         for e in note:
-            if e.tag == 'staff':    # Staff number of note
-                voice = int(e.text) - 1
-            if e.tag == 'voice':    # Voice number of note
+            tag = e.tag
+            if tag == 'pitch':
+                pitch_elem = e
+            elif tag == 'duration':     # Duration of note
+                dur = int(e.text)
+            elif tag == 'voice':        # Voice number of note
                 voice = int(e.text)
-            if e.tag == 'dot':      # Dot modifier for note duration
-                has_dot = True
-            if e.tag == 'chord':    # Note is part of a chord
+            elif tag == 'type':
+                note_type = e.text
+            elif tag == 'staff':        # Staff number of note
+                voice = int(e.text) - 1
+            elif tag == 'stem':         # Direction of stem (not used)
+                stem_down = e.text != 'up'
+            elif tag == 'rest':
+                rest = e
+            elif tag == 'chord':        # Note is part of a chord
                 is_chord = True
-            if e.tag == 'duration': # Duration of note
-                dur = int(e.text)
-            if e.tag == 'grace':    # Note is a gracenote
-                is_grace=True
-            if e.tag == 'stem':     # Direction of stem (not used)
-                stem_down = False if e.text == 'up' else True
+            elif tag == 'dot':          # Dot modifier for note duration
+                has_dot = True
+            elif tag == 'accidental':
+                alter = ACCIDENTALS.get(e.text, alter)
+            elif tag == 'notations':
+                notations = e
+            elif tag == 'grace':        # Note is a gracenote
+                is_grace = True
 
         # Check that note is printed, skip if not
-        if 'print-object' in note.attrib and note.attrib['print-object'] == 'no':
-            return 'forward', True, voice, dur, is_grace, articulation
+        if note.get('print-object') == 'no':
+            # (written as a bare 'f' in the string format)
+            return Token(FORWARD, 'f', end='', staff=voice), True, voice, dur, is_grace, ''
+
+        articulation = ''
+        if notations is not None:     # Unused
+            articulation = self.parse_notations(notations, stem_down)
 
         # Information about the note's pitch and octave
         pitch = ''
-        alter = ''
         octave = ''
 
-        # Check for accidentals beforehand due to the indexing in parse tree
-        for elem in note:
-            if elem.tag == 'accidental':  
-                if elem.text == 'sharp':
-                    alter = '#'
-                elif elem.text == 'flat':
-                    alter = 'b'
-                elif elem.text == 'natural':
-                    alter = 'N'
-                elif elem.text == 'double-sharp':
-                    alter = '##'
-                elif elem.text == 'flat-flat':
-                    alter = 'bb'
-
-        # Iterate through all elements in note obj
-        for elem in note:
-
-            # Check for the pitch
-            if elem.tag == 'pitch':
-                for e in elem:
-                    if e.tag == 'step':         # Pitch
-                        pitch = e.text
-                    elif e.tag == 'alter':      # Not used
-                        pass
-                    elif e.tag == 'octave':     # Octave number
-                        octave = e.text
-                # Create 
-                sequence[staff] += 'note-' + pitch + alter + octave
-
-            # Check for a rest note
-            if elem.tag == 'rest':
-                # Check if measure rest or has a type
-                if 'measure' in elem.attrib and elem.attrib['measure'] == 'yes':
-                    # Convert rest-measure to note depending on time signature
-                    sequence[staff] += self.rest_measure_to_note() + ' '
-                else:
-                    sequence[staff] += 'rest' 
-                cur_rest = True
-
-            # Check duration of the note
-            elif elem.tag == 'type':
-                # Length of note
-                dot = '. ' if has_dot else ' '
-                duration = 'sixteenth' if elem.text == '16th' else \
-                           'thirty_second' if elem.text == '32nd' else \
-                           'sixty_fourth' if elem.text == '64th' else \
-                           'hundred_twenty_eighth' if elem.text == '128th' else \
-                            elem.text
-                if cur_rest:
-                    sequence[staff] += '-' + duration + dot#'-v' + str(voice) + ' '
-                    cur_rest = False
-                else:
-                    sequence[staff] += '_' + duration + dot#'-v' + str(voice) + ' '
-
-            elif elem.tag == 'chord':   # Unused
-                pass
-
-            elif elem.tag == 'notations':   # Unused
-                articulation = self.parse_notations(elem, stem_down)
-
-
-        return sequence, is_chord, voice, dur, is_grace, articulation
+        # Symbol of the note, split in its pitch (or rest) and duration parts
+        kind = NOTE
+        symbol = ''
+        duration_symbol = ''
+        end = ''
+        duration = None
+        dot = False
+
+        if pitch_elem is not None:
+            for e in pitch_elem:
+                if e.tag == 'step':         # Pitch
+                    pitch = e.text
+                elif e.tag == 'octave':     # Octave number
+                    octave = e.text
+            symbol = 'note-' + pitch + alter + octave
+
+        # Check for a rest note
+        if rest is not None:
+            kind = REST
+            # Check if measure rest or has a type
+            if rest.get('measure') == 'yes':
+                # Convert rest-measure to note depending on time signature
+                duration = self.rest_measure_to_note()
+                symbol = 'rest-' + duration
+                end = ' '
+            else:
+                symbol = 'rest'
+
+        # Check duration of the note
+        if note_type is not None:
+            # Length of note
+            type_duration = TYPE_NAMES.get(note_type, note_type)
+            duration_symbol = ('-' if rest is not None else '_') + type_duration + ('.' if has_dot else '')
+            if duration is None:
+                duration = type_duration
+            else:
+                # Measure rest written with a type, keep both
+                duration_symbol = end + duration_symbol
+            dot = has_dot
+            end = ' '
+
+        # Note without pitch, rest or type
+        if symbol == '' and duration_symbol == '':
+            return None, is_chord, voice, dur, is_grace, articulation
+
+        token = Token(kind, symbol + duration_symbol, end=end, staff=voice, pitch=pitch + alter + octave or None,
+                      duration=duration, dot=dot)
+
+        return token, is_chord, voice, dur, is_grace, articulation
 
     def parse_direction(self, direction):
 
@@ -185,31 +228,25 @@ class Measure:
         note: the parse tree representing the note
         """
 
-        sequence = ['' for x in range(self.num_staves)]
+        sequence = [[] for x in range(self.num_staves)]
 
-        # Get staff of note
+        # Get staff of direction and its words/dynamics
         staff = 0
-        for e in direction:
-            if e.tag == 'staff':
-                staff = int(e.text) - 1
-
-        pattern = re.compile("[A-Za-z.-]+")
-        # Iterate through all elements in direction obj
+        texts = []
         for elem in direction:
-        
             if elem.tag == 'direction-type':
                 for sub in elem:
                     if sub.tag == 'dynamics' and len(sub.text) > 2:
-                        e = ' '.join(sub[0].tag.split())
-                        e = e.replace(' ', '-')
-                        if pattern.fullmatch(e):
-                            sequence[staff] += e + '-dynamic' + ' '
-                    if sub.tag == 'words' and sub.text is not None and len(sub.text) > 2:
-                        e = ' '.join(sub.text.split())
-                        e = e.replace(' ', '-')
-                        if pattern.fullmatch(e):
-                            sequence[staff] += e + '-dynamic' + ' '
+                        texts.append(sub[0].tag)
+                    elif sub.tag == 'words' and sub.text is not None and len(sub.text) > 2:
+                        texts.append(sub.text)
+            elif elem.tag == 'staff':
+                staff = int(elem.text) - 1
 
+        for text in texts:
+            e = '-'.join(text.split())
+            if DIRECTION_PATTERN.fullmatch(e):
+                sequence[staff].append(Token(DIRECTION, e + '-dynamic', staff=staff))
 
         return sequence
 
@@ -240,7 +277,7 @@ class Measure:
             elif n.tag == 'slur':
                 pass
                 #sequence += 'slur-' +  n.attrib['type'] + ' '
-        
+
             elif n.tag == 'articulations':
                 # Go through all articulations
                 for articulation in n:
@@ -264,14 +301,14 @@ class Measure:
         style: the parse tree representing the style
         '''
 
-        sequence = ''
+        sequence = []
         skip = 0
 
         # Iterate through all elements in notation obj
         for s in style:
 
             if s.tag == 'multiple-rest':
-                sequence += 'multirest-' + s.text + ' '
+                sequence.append(Token(MULTIREST, 'multirest-' + s.text))
                 skip = int(s.text)
 
         return sequence, skip
@@ -284,12 +321,7 @@ class Measure:
         num: indicates num sharps/flat (> 0 is sharp, < 0 is flat)
         """
 
-        mapping = {7: 'C#M', 6: 'F#M', 5: 'BM', 4: 'EM',
-                   3: 'AM', 2: 'DM', 1: 'GM', 0: 'CM',
-                   -1: 'FM', -2: 'BbM', -3: 'EbM', -4: 'AbM',
-                   -5: 'DbM', -6: 'GbM', -7: 'CbM'}
-
-        return mapping[num]
+        return KEY_NAMES[num]
 
     def rest_measure_to_note(self):
 
@@ -298,10 +330,15 @@ class Measure:
         based on time signature
         """
 
-        type_map = {
-            '1': 'whole', '2': 'half', '4': 'quarter', '8': 'eighth', '12': 'eighth.', '16': 'sixteenth', 
-            '32': 'thirthy_second', '48': 'thirthy_second.',
-        }
+        #note_type = REST_MEASURE_TYPES[str(self.beat_type)]
+        return 'whole'
+
 
-        #note_type = type_map[str(self.beat_type)]
-        return 'rest-whole'
\ No newline at end of file
+# Handler of each child of an <attributes> element, adding its tokens to the sequence
+# (measure-style is handled by parse_attributes, as it also returns the measures to skip)
+ATTRIBUTE_HANDLERS = {
+    'key': Measure._attribute_key,
+    'time': Measure._attribute_time,
+    'clef': Measure._attribute_clef,
+    'divisions': Measure._attribute_divisions,
+}
@@ -3,23 +3,105 @@ Contains class that converts MusicXML to a sequence
 by parsing it
 """
 
+import io
+import os
 import sys
+import time
+import bisect
+import multiprocessing
 import xml.etree.ElementTree as ET 
+from xml.parsers import expat
+from concurrent.futures import ProcessPoolExecutor
 
 from .measure import Measure
+from .backends import get_backend
+from .sources import open_source, source_name, can_reread, is_path, SOURCE_ERRORS
+from .tokens import Token, serialize, FORWARD, CLEF, KEY, TIME, BARLINE, NO_ADVANCE, ADVANCE, SPACED_ADVANCE
+from .timing import Bar
+from .stats import ParseStats
+from .vocab import encode_sequences
+from .triage import ScoreRejected, REJECT_MALFORMED, REJECT_UNREADABLE
+from .index import INDEX_VERSION, index_path, file_stamp, check_indexable, scan_measures, load_index, save_index
+from .incremental import measures_path, measures_cache_key, measure_digests, make_store, store_outputs, \
+    load_measures, save_measures
 
 import functools
 
+# Version of the sequences produced by the parser, bump it whenever the
+# output changes so cached sequences are not reused
+PARSER_VERSION = 4
+
+# Budget of a whole score parse is checked every that many XML events
+BUDGET_EVENT_INTERVAL = 1 << 12
+
+# Parts of the score being read by get_part_sequences, inherited by the
+# forked worker processes instead of being sent to them
+_shared_parts = None
+
+# Index of the score whose measure ranges are being read by get_sequences
+# (inherited by the forked worker processes, as _shared_parts)
+_shared_index = None
+
+# Measure ranges a score read by several workers is split into, per worker
+# (ranges hold whole pages so they are not all the same size)
+RANGES_PER_WORKER = 4
+
+# Most new measures parsed at once by get_sequences_incremental
+INCREMENTAL_READ_AHEAD = 256
+
+# Position of each note name on the staff (for sorting)
+NOTE_NUMS = {
+    'Cb': 0,
+    'C': 1,
+    'C#': 2,
+    'Db': 2,
+    'D': 3,
+    'D#': 4,
+    'Eb': 4,
+    'E': 5,
+    'E#': 6,
+    'Fb': 6,
+    'F': 7,
+    'F#': 8,
+    'Gb': 8,
+    'G': 9,
+    'G#': 10,
+    'Ab': 10,
+    'A': 11,
+    'A#': 12,
+    'Bb': 12,
+    'B': 13,
+    'B#': 14,
+}
+
 class MusicXML():
 
-    def __init__(self, input_file):
+    def __init__(self, input_file, cache=None, backend=None, stats=None, errors='strict', budget=None):
 
         """
         Stores MusicXML file passed in 
+
+        input_file: path of a .musicxml/.xml or compressed .mxl file, bytes
+                    or memoryview of either, or binary file object (read
+                    from its current position, once unless it is seekable)
+        cache: optional SequenceCache holding previously parsed sequences
+        backend: XML backend to parse with ('etree', 'lxml' or 'expat'),
+                 defaults to lxml when installed
+        stats: optional ParseStats recording time/calls of each parsing stage
+        errors: decoding errors policy, 'strict' (badly encoded files are
+                invalid, they produce no sequences), 'ignore' or 'replace'
+        budget: optional budget.Budget, checked at every measure read (and
+                while a whole score is parsed), parsing raises
+                budget.BudgetExceeded once it is exceeded
         """
 
         # Input/output file path (.musicxml and .semantic)
         self.input_file = input_file
+        self.cache = cache
+        self.backend = get_backend(backend)
+        self.stats = stats
+        self.errors = errors
+        self.budget = budget
         
         # Set default values for key, clef, time signature
         self.key = ''
@@ -27,399 +109,1073 @@ class MusicXML():
         self.time = ''
         self.beat = 4
         self.beat_type = 4
+        self.divisions = 1
+
+        # Reason (see triage.REJECT_*) the rest of the part is not read, once
+        # a percussion/TAB clef or a weird key/time signature is found (left
+        # set once the sequences are returned, for callers to reject the score)
+        self.rejected = None
+
+        # Length/time signature of each bar read (one per barline)
+        self.bars = []
 
         # Track whether current page being labeled is polyphonic or not
         self.polyphonic_page = True
 
-        # Read the width and cutoffs for each page of the .musicxml file
-        self.get_width()
+        # Page width and cutoff, read from <defaults> by get_width() once the
+        # file is parsed (no parsing is done in the constructor)
+        self.width = None
+        self.width_cutoff = None
+
+        # Measure parser state, reused for every measure
+        self.measure_parser = Measure()
 
-    def get_width(self):
+        # Measure offset index, loaded by get_index()
+        self.index = None
+
+    def get_width(self, root=None):
         """
         Reads width/cutoffs on left/right of XML
+
+        root: parsed <score-partwise> element, if the caller already has the
+              parse tree (otherwise the file is parsed here)
         """
 
         margins = 0
 
-        with open(self.input_file, 'r', errors='ignore') as input_file:
-            
-            # Check for valid parse tree in .musicxml file
-            try:
-                tree = ET.parse(input_file)
-                root = tree.getroot()
-            except:
-                return
-
-            # Index in parse tree with information about page width
-            defaults_idx = -1
-
-            # Look for "defaults" tag which contains page width information
-            for i, child in enumerate(root):
-                if child.tag == 'defaults':
-                    defaults_idx = i
-                    break
-
-            # Check for bad MusicXML
-            if defaults_idx == -1:
-                raise KeyError('MusicXML file:', self.input_file,' missing <score-partwise> or <part>')
-
-            # .MusicXML defines margins separately for odd even pages,
-            #  assume they are the same
-            margin_found = False            
-
-            # Get number of staves in the MusicXML
-            for i,e in enumerate(root[defaults_idx]):
-                if e.tag == 'page-layout':
-                    for c in e:
-                        if c.tag == 'page-width':
-                            self.width = float(c.text)
-                        elif c.tag == 'page-margins' and not margin_found:
-                            for k in c:
-                                if k.tag == 'left-margin':
-                                    margins += float(k.text)
-                                elif k.tag == 'right-margin':
-                                    margins += float(k.text)
-                            margin_found = True
+        if root is None:
+            with open_source(self.input_file, self.errors) as input_file:
+
+                # Check for valid parse tree in .musicxml file
+                try:
+                    tree = ET.parse(input_file)
+                    root = tree.getroot()
+                except:
+                    return
+
+        # Index in parse tree with information about page width
+        defaults_idx = -1
+
+        # Look for "defaults" tag which contains page width information
+        for i, child in enumerate(root):
+            if child.tag == 'defaults':
+                defaults_idx = i
+                break
+
+        # Check for bad MusicXML
+        if defaults_idx == -1:
+            raise KeyError('MusicXML file:', source_name(self.input_file),' missing <score-partwise> or <part>')
+
+        # .MusicXML defines margins separately for odd even pages,
+        #  assume they are the same
+        margin_found = False            
+
+        # Get number of staves in the MusicXML
+        for i,e in enumerate(root[defaults_idx]):
+            if e.tag == 'page-layout':
+                for c in e:
+                    if c.tag == 'page-width':
+                        self.width = float(c.text)
+                    elif c.tag == 'page-margins' and not margin_found:
+                        for k in c:
+                            if k.tag == 'left-margin':
+                                margins += float(k.text)
+                            elif k.tag == 'right-margin':
+                                margins += float(k.text)
+                        margin_found = True
 
         # Based on width and margins read, set the width per page, for calculating
         # when to proceed to next page (sample) while generating labels
         self.width_cutoff = self.width - margins + 1
                 
-    def get_sequences(self):
+    def check_errors_policy(self, error):
+
+        """
+        Raises triage.ScoreRejected (malformed, or unreadable for an invalid
+        compressed file) for an error reading the score under the strict
+        decoding errors policy, the lenient policies read what they can
+        (invalid MusicXML produces no sequences)
+        """
+
+        if self.errors == 'strict':
+            reason = REJECT_UNREADABLE if isinstance(error, SOURCE_ERRORS) else REJECT_MALFORMED
+            raise ScoreRejected(reason, str(error)) from error
+
+    def get_sequences(self, tokens=False, workers=1):
 
         """
         Parses MusicXML file and returns sequences corresponding
-        to the first staff of the first part of the score
-        (list of symbols for each page)
+        to the first part of the score (list of symbols of each
+        staff for each page)
+
+        tokens: return the Token objects of each staff instead of strings
+        workers: number of processes reading the measures (None for the
+                 number of CPUs), more than 1 reads contiguous ranges of
+                 pages concurrently (see read_measure_ranges), for large
+                 scores given by path
+
+        Raises triage.ScoreRejected if the file is not valid MusicXML under
+        the strict decoding errors policy (see check_errors_policy)
+        """
+
+        # Look for sequences of a file with the same content (streams are read only once)
+        cache = self.cache if can_reread(self.input_file) else None
+        if cache is not None:
+            key = cache.key(self.input_file, PARSER_VERSION, self.errors, 'tokens' if tokens else 'strings')
+            cached = cache.get(key)
+            if cached is not None:
+                sequences, self.bars, self.rejected = cached
+                if self.stats is not None:
+                    self.stats.count('cache_hits')
+                return sequences
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        # Invalid MusicXML is rejected, or produces no sequences when decoded leniently
+        try:
+            if workers > 1 and can_fork() and is_path(self.input_file):
+                sequences = self.read_measure_ranges(tokens, workers)
+            else:
+                sequences = list(self.iter_sequences(tokens))
+        except self.backend.errors + SOURCE_ERRORS as e:
+            self.check_errors_policy(e)
+            sequences = []
+
+        if cache is not None:
+            cache.put(key, (sequences, self.bars, self.rejected))
+
+        return sequences
+
+    def get_sequences_incremental(self, tokens=False, path=None):
+
+        """
+        Parses MusicXML file and returns the same sequences as get_sequences,
+        only reading the measures of the first part whose output was not kept
+        by the previous call on the file (see incremental.py): the measures
+        that changed, and those whose carried state (clef, key, time
+        signature, ...) or position in their page changed. The pages are
+        assembled from the output of every measure, which are kept for the
+        next call (in the cache if the object has one, otherwise in a sidecar
+        file next to the score). self.measures_read and self.measures_reused
+        count the measures read and reused.
+
+        Scores that cannot be indexed (see index.check_indexable) or are not
+        valid MusicXML are read by get_sequences.
+
+        tokens: return the Token objects of each staff instead of strings
+        path: path of the sidecar file (defaults to incremental.measures_path)
+        """
+
+        self.measures_read = 0
+        self.measures_reused = 0
+
+        # Pages only depend on the skeletons of the measures, which are all read
+        try:
+            encoding = check_indexable(self.input_file)
+            offsets, measures = self.scan_first_part()
+        except (ValueError, KeyError, expat.ExpatError):
+            return self.get_sequences(tokens)
+
+        data, digests = measure_digests(self.input_file, offsets)
+        positions = {id(m): i for i, m in enumerate(measures)}
+
+        # Outputs kept by the previous call
+        if self.cache is not None:
+            key = measures_cache_key(self.input_file, PARSER_VERSION, self.errors)
+            previous = store_outputs(self.cache.get(key), PARSER_VERSION, self.errors)
+        else:
+            path = measures_path(self.input_file) if path is None else path
+            previous = store_outputs(load_measures(path), PARSER_VERSION, self.errors)
+
+        # Outputs of the measures of this call (by fingerprint)
+        outputs = {}
+
+        # Measures parsed ahead of being read: a new measure is parsed along
+        # with the new ones following it (their outputs cannot have been kept)
+        known = {fingerprint[0] for fingerprint in previous}
+        parsed = {}
+
+        def read(skeleton, num_staves, new_page, cur_staves, new_score):
+            i = positions[id(skeleton)]
+            fingerprint = (digests[i], self.clef, self.key, self.time, self.beat, self.beat_type, self.divisions,
+                           self.rejected, num_staves, tuple(len(s) > 0 for s in cur_staves), new_score)
+
+            output = outputs.get(fingerprint) or previous.get(fingerprint)
+            if output is None:
+                if i not in parsed:
+                    j = i + 1
+                    while j < len(measures) and j - i < INCREMENTAL_READ_AHEAD and digests[j] not in known:
+                        j += 1
+                    parsed.clear()
+                    part = self.parse_fragment(data[offsets[i][0]:offsets[j - 1][1]], encoding)
+                    parsed.update(zip(range(i, j), part))
+                measure = parsed.pop(i)
+
+                num_bars = len(self.bars)
+                measure_staves, skip = self.read_measure(measure, num_staves, new_page, cur_staves, new_score)
+                output = ([[t.fields() for t in s] for s in measure_staves], skip,
+                          self.bars[-1] if len(self.bars) > num_bars else None,
+                          (self.clef, self.key, self.time, self.beat, self.beat_type, self.divisions, self.rejected))
+                self.measures_read += 1
+            else:
+                staves_fields, skip, bar, state = output
+                measure_staves = [[Token(*fields) for fields in s] for s in staves_fields]
+                self.clef, self.key, self.time, self.beat, self.beat_type, self.divisions, self.rejected = state
+                if bar is not None:
+                    self.bars.append(bar)
+                self.measures_reused += 1
+            outputs[fingerprint] = output
+
+            return measure_staves, skip
+
+        # Invalid MusicXML is rejected, or produces no sequences when decoded leniently
+        try:
+            sequences = list(self.iter_part_sequences(iter(measures), tokens, read=read))
+        except self.backend.errors + SOURCE_ERRORS as e:
+            self.check_errors_policy(e)
+            sequences = []
+
+        if self.stats is not None:
+            self.stats.count('measures_read', self.measures_read)
+            self.stats.count('measures_reused', self.measures_reused)
+
+        store = make_store(outputs, PARSER_VERSION, self.errors)
+        if self.cache is not None:
+            self.cache.put(key, store)
+        else:
+            save_measures(path, store)
+
+        return sequences
+
+    def get_arrays(self, vocab):
+
+        """
+        Parses MusicXML file and returns the sequences of the first part
+        as arrays of token ids (a vocab.StaffArrays for each staff, with
+        the offsets of its pages and bars)
+
+        vocab: vocab.Vocabulary (new symbols are added to it unless it is frozen)
+        """
+
+        return encode_sequences(self.get_sequences(tokens=True), vocab)
+
+    def get_part_sequences(self, tokens=False, workers=None):
+
+        """
+        Parses MusicXML file and returns the sequences of every part
+        of the score (for each part, what get_sequences returns for the
+        first one). The bars of each part are stored in self.part_bars,
+        self.bars holds those of the first part.
+
+        The document is parsed once, then the parts are read concurrently
+        by forked worker processes, which share the parse tree instead of
+        receiving a copy of it.
+
+        tokens: return the Token objects of each staff instead of strings
+        workers: number of worker processes (defaults to the number of CPUs,
+                 1 reads the parts in the current process)
+
+        Raises triage.ScoreRejected if the file is not valid MusicXML under
+        the strict decoding errors policy (see check_errors_policy)
+        """
+
+        # Look for sequences of a file with the same content (streams are read only once)
+        cache = self.cache if can_reread(self.input_file) else None
+        if cache is not None:
+            key = cache.key(self.input_file, PARSER_VERSION, self.errors, 'parts', 'tokens' if tokens else 'strings')
+            cached = cache.get(key)
+            if cached is not None:
+                part_sequences, self.part_bars = cached
+                self.bars = self.part_bars[0] if self.part_bars else []
+                if self.stats is not None:
+                    self.stats.count('cache_hits')
+                return part_sequences
+
+        # Invalid MusicXML is rejected, or produces no sequences when decoded leniently
+        try:
+            root = self.parse_tree()
+        except self.backend.errors + SOURCE_ERRORS as e:
+            self.check_errors_policy(e)
+            root = None
+
+        part_sequences = []
+        self.part_bars = []
+        if root is not None:
+            for sequences, bars in self.read_parts(root, tokens, workers):
+                part_sequences.append(sequences)
+                self.part_bars.append(bars)
+        self.bars = self.part_bars[0] if self.part_bars else []
+
+        if cache is not None:
+            cache.put(key, (part_sequences, self.part_bars))
+
+        return part_sequences
+
+    def parse_tree(self):
+
+        """
+        Parses the whole MusicXML file and returns its root element
+        (None for an empty document)
+
+        Raises one of self.backend.errors if the file is not valid XML.
+        """
+
+        root = None
+
+        with open_source(self.input_file, self.errors) as input_file:
+
+            events = self.backend.iterparse(input_file)
+            if self.stats is not None:
+                events = self.stats.timed_iter('xml_parse', events)
+
+            budget = self.budget
+            for i, (event, elem) in enumerate(events):
+                if root is None:
+                    root = elem
+                if budget is not None and i % BUDGET_EVENT_INTERVAL == 0:
+                    budget.check()
+
+        return root
+
+    def read_parts(self, root, tokens=False, workers=None):
+
         """
+        Returns the (sequences, bars) of each part of a parsed score
+
+        root: parsed <score-partwise> element
+        tokens: return the Token objects of each staff instead of strings
+        workers: number of worker processes (see get_part_sequences)
+        """
+
+        global _shared_parts
+
+        parts = [child for child in root if child.tag == 'part']
+
+        # Check for bad MusicXML
+        if len(parts) == 0 or all(child.tag != 'part-list' for child in root):
+            raise KeyError('MusicXML file:', source_name(self.input_file),' missing <part-list> or <part>')
+
+        # Read the width and cutoffs for each page
+        if self.stats is not None:
+            with self.stats.stage('get_width'):
+                self.get_width(root)
+        else:
+            self.get_width(root)
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(parts))
+
+        # Workers need fork to share the parse tree, otherwise read the parts here
+        if workers <= 1 or not can_fork():
+            return [read_part(part, source_name(self.input_file), self.width, self.width_cutoff, tokens, self.stats,
+                              self.budget)
+                    for part in parts]
+
+        tasks = [(i, source_name(self.input_file), self.width, self.width_cutoff, tokens, self.stats is not None,
+                  self.budget)
+                 for i in range(len(parts))]
+
+        _shared_parts = parts
+        try:
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as executor:
+                results = list(executor.map(_read_shared_part, tasks))
+        finally:
+            _shared_parts = None
+
+        for _, _, stats in results:
+            if stats is not None:
+                self.stats.merge(stats)
+
+        return [(sequences, bars) for sequences, bars, _ in results]
+
+    def get_measure_ranges(self, num_ranges):
+
+        """
+        Returns up to num_ranges contiguous (a, b) ranges of the measures of
+        the first part (see get_measures) covering all of them, each starting
+        a page and holding about as many bytes of the file, using the measure
+        offset index (see get_index)
+        """
+
+        measures = self.get_index()['measures']
+        if len(measures) == 0:
+            return []
+
+        first, last = measures[0][0], measures[-1][1]
+        size = (last - first) / num_ranges
+
+        # A range starts at the first page starting past its share of the bytes
+        starts = [0]
+        for i in range(1, len(measures)):
+            if measures[i][2] != measures[i - 1][2] and measures[i][0] - first >= len(starts) * size:
+                starts.append(i)
+
+        return list(zip(starts, starts[1:] + [len(measures)]))
+
+    def read_measure_ranges(self, tokens=False, workers=None):
+
+        """
+        Returns the sequences of the first part, its pages being read
+        concurrently by forked worker processes, each reading contiguous
+        ranges of measures from the byte offsets of the measure offset index
+        (see get_measures). The index records the parser state carried into
+        each measure and the page it belongs to, and is built by a cheap
+        first pass reading only the attributes of the measures (see
+        build_index). The sequences and self.bars are the same as read
+        serially (see iter_sequences).
+
+        Scores that cannot be indexed (see index.check_indexable) or whose
+        index cannot be built (eg. invalid XML) are read serially.
+
+        tokens: return the Token objects of each staff instead of strings
+        workers: number of worker processes (defaults to the number of CPUs)
+        """
+
+        global _shared_index
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        try:
+            index = self.get_index()
+        except (ValueError, KeyError, expat.ExpatError):
+            return list(self.iter_sequences(tokens))
 
-        # Stores all symbolic sequences for the .musicxml
+        ranges = self.get_measure_ranges(workers * RANGES_PER_WORKER)
+        if len(ranges) <= 1:
+            return list(self.iter_sequences(tokens))
+
+        tasks = [(source_name(self.input_file), self.backend.name, self.errors, a, b, tokens,
+                  self.stats is not None, self.budget)
+                 for a, b in ranges]
+
+        _shared_index = index
+        try:
+            with ProcessPoolExecutor(min(workers, len(ranges)), mp_context=multiprocessing.get_context('fork')) \
+                    as executor:
+                results = list(executor.map(_read_shared_range, tasks))
+        finally:
+            _shared_index = None
+
+        # Ranges start pages, their sequences and bars follow each other
         sequences = []
+        self.bars = []
+        for range_sequences, bars, rejected, stats in results:
+            sequences += range_sequences
+            self.bars += bars
+            if self.rejected is None:
+                self.rejected = rejected
+            if stats is not None:
+                self.stats.merge(stats)
 
-        new_score = True
+        return sequences
 
-        with open(self.input_file, 'r') as input_file:
+    def scan_first_part(self):
 
-            # Get parse tree
-            try:
-                tree = ET.parse(input_file)
-                root = tree.getroot()
-            except:
-                return sequences
+        """
+        Scans the MusicXML file (see index.scan_measures), reads the page
+        width and returns the byte offsets and skeletons of the measures
+        of the first part
 
-            # Indexing for part list
-            part_list_idx = -1
-            part_idx = -1
+        Raises ValueError if the file cannot be indexed (see build_index).
+        """
 
-            # Find <part-list> and <part> element indexes
-            for i, child in enumerate(root):
-                if child.tag == 'part-list':
-                    part_list_idx = i
-                elif child.tag == 'part':
-                    # Choose 1st part only to generate sequence
-                    part_idx = i if part_idx == -1 else part_idx
+        offsets, root, measures = scan_measures(self.input_file)
 
-            # Check for bad MusicXML
-            if part_list_idx == -1 or part_idx == -1:
-                raise KeyError('MusicXML file:', self.input_file,' missing <part-list> or <part>')
+        # Check for bad MusicXML (as iter_first_part)
+        if root is None or all(child.tag != 'part' for child in root):
+            raise KeyError('MusicXML file:', source_name(self.input_file),' missing <part-list> or <part>')
+        self.get_width(root)
+        if all(child.tag != 'part-list' for child in root):
+            raise KeyError('MusicXML file:', source_name(self.input_file),' missing <part-list> or <part>')
 
-            # Get number of staves in the MusicXML
-            num_staves = 1
-            try:
-                for e in root[part_idx][0][0]:
-                    if e.tag == 'staff-layout':
-                        num_staves = int(e.attrib['number'])
-            except IndexError:
-                return ['']
-            staves = ['' for x in range(num_staves)]    # Holds sequence of each staff
-
-            # Read each measure
-            r_iter = iter(root[part_idx])
-            cur_width = 0.0     # Sum of width of measures currently read
-            page_num = 1        # Current page number (for naming)
-            new_page = False    # Tracks if just beginning a new page due to "print" element
-
-            # Iterate through all measures 
-            for i, measure in enumerate(r_iter):
-
-                # Increment current width by the measure's width
+        return offsets, measures
+
+    def build_index(self):
+
+        """
+        Scans the MusicXML file and returns its measure offset index:
+        byte range, page and carried parser state of each measure of the
+        first part, along with the page width and number of staves and pages
+        (see index.py)
+
+        Raises ValueError if the file cannot be indexed (compressed file,
+        file object, UTF-16/32 encoding) and one of self.backend.errors if it
+        is not valid XML.
+        """
+
+        encoding = check_indexable(self.input_file)
+        stamp = file_stamp(self.input_file)
+
+        # Pages and parser state only depend on the width, layout and attributes
+        # of the measures, which is all their skeletons hold (see scan_measures)
+        offsets, measures = self.scan_first_part()
+
+        entries = []
+        num_staves = 0
+        num_pages = 0
+        for page in self.iter_part_sequences(iter(measures), tokens=True, index=entries, read=self.scan_measure):
+            if num_pages == 0:
+                num_staves = len(page)
+            num_pages += 1
+
+        # Measures past the end of a part read only partially are not indexed
+        if len(entries) > len(offsets):
+            raise ValueError('Measure offsets do not match the measures of ' + source_name(self.input_file))
+        for entry, (start, end) in zip(entries, offsets):
+            entry[0], entry[1] = start, end
+
+        return {
+            'version': INDEX_VERSION,
+            'parser_version': PARSER_VERSION,
+            'stamp': stamp,
+            'encoding': encoding,
+            'errors': self.errors,
+            'width': self.width,
+            'width_cutoff': self.width_cutoff,
+            'num_staves': num_staves,
+            'num_pages': num_pages,
+            'measures': entries,
+        }
+
+    def get_index(self, path=None):
+
+        """
+        Returns the measure offset index of the file, stored in the cache if
+        the object has one, otherwise in a sidecar file next to the score.
+        The index is built (see build_index) if it is missing or out of date.
+
+        path: path of the sidecar file (defaults to index.index_path)
+        """
+
+        if self.index is not None:
+            return self.index
+
+        # Fail early for sources that cannot be indexed
+        check_indexable(self.input_file)
+
+        if self.cache is not None:
+            key = self.cache.key(self.input_file, PARSER_VERSION, self.errors, 'index', INDEX_VERSION)
+            index = self.cache.get(key)
+            if index is None:
+                index = self.build_index()
+                self.cache.put(key, index)
+
+        else:
+            path = index_path(self.input_file) if path is None else path
+            index = load_index(path, self.input_file)
+            if index is None or index['parser_version'] != PARSER_VERSION or index['errors'] != self.errors:
+                index = self.build_index()
+                save_index(path, index)
+
+        self.index = index
+
+        return index
+
+    def get_measures(self, a, b, tokens=False):
+
+        """
+        Parses only measures a to b (excluded) of the first part, using the
+        measure offset index (see get_index), and returns their sequences
+        (list of symbols of each staff for each page) as if measure a started
+        a page. self.bars holds the bars of the measures.
+
+        a, b: measure indexes (as in a slice of the measures of the part)
+        tokens: return the Token objects of each staff instead of strings
+        """
+
+        index = self.get_index()
+        measures = index['measures']
+
+        a, b, _ = slice(a, b).indices(len(measures))
+        if a >= b:
+            self.bars = []
+            return []
+
+        # Read only the bytes of the measures
+        with open(self.input_file, 'rb') as input_file:
+            input_file.seek(measures[a][0])
+            data = input_file.read(measures[b - 1][1] - measures[a][0])
+
+        part = self.parse_fragment(data, index['encoding'])
+
+        # Restore the state carried into measure a
+        self.width = index['width']
+        self.width_cutoff = index['width_cutoff']
+        self.clef, self.key, self.time, self.beat, self.beat_type, self.divisions, self.rejected = measures[a][4:11]
+
+        # The first measure of the part is read as usual (it sets the number of staves)
+        resume = None
+        if a > 0:
+            resume = {'num_staves': index['num_staves'], 'skip': measures[a][3]}
+
+        return list(self.iter_part_sequences(iter(part), tokens, resume))
+
+    def parse_fragment(self, data, encoding):
+
+        """
+        Parses the bytes of consecutive measures of the file and returns
+        a part element holding them
+
+        encoding: encoding of the file (see index.check_indexable)
+        """
+
+        # Wrap them in a part (re-encoded as UTF-8, as the fragment has no XML declaration)
+        fragment = ('<part>' + data.decode(encoding, self.errors) + '</part>').encode('utf-8')
+
+        part = None
+        for event, elem in self.backend.iterparse(io.BytesIO(fragment)):
+            if part is None:
+                part = elem
+
+        return part
+
+    def get_page(self, n, tokens=False):
+
+        """
+        Parses only page n of the first part, using the measure offset index
+        (see get_index), and returns its sequence (what get_sequences()[n]
+        would be)
+
+        n: page index
+        tokens: return the Token objects of each staff instead of strings
+        """
+
+        index = self.get_index()
+
+        if n < 0:
+            n += index['num_pages']
+        if not 0 <= n < index['num_pages']:
+            raise IndexError('Page out of range')
+
+        # Measures of the page (contiguous)
+        pages = [m[2] for m in index['measures']]
+        a = bisect.bisect_left(pages, n)
+        b = bisect.bisect_right(pages, n)
+
+        # Only the first page can be empty (when the first measure starts a system)
+        if a == b:
+            self.bars = []
+            staves = [[] for _ in range(index['num_staves'])]
+            return staves if tokens else [serialize(s) for s in staves]
+
+        # Starting from the first measure of the score, the previous pages are read too
+        return self.get_measures(a, b, tokens)[-1]
+
+    def iter_sequences(self, tokens=False):
+
+        """
+        Incrementally parses MusicXML file and yields the sequences of the
+        first part of the score one page at a time (list of symbols for each
+        staff), as soon as the width cutoff or a system-layout print element
+        closes the page. Each measure is freed once it has been read, so
+        memory depends on the size of a page rather than the whole score.
+
+        tokens: yield the Token objects of each staff instead of strings
+
+        Raises one of self.backend.errors if the file is not valid XML.
+        """
+
+        with open_source(self.input_file, self.errors) as input_file:
+            yield from self.iter_part_sequences(self.iter_first_part(input_file), tokens)
+
+    def iter_measures(self):
+
+        """
+        Incrementally parses MusicXML file and yields the tokens of each
+        measure of the first part as soon as it is read: (starts, staves),
+        staves holding the tokens of each staff and starts the position of
+        the first one in its page (as in iter_sequences, where a measure's
+        tokens depend on their position in the page)
+        """
+
+        with open_source(self.input_file, self.errors) as input_file:
+            yield from self.iter_part_sequences(self.iter_first_part(input_file), tokens=True, by_measure=True)
+
+    def iter_first_part(self, input_file):
+
+        """
+        Incrementally parses the MusicXML file and yields the measures of
+        its first part as soon as they are complete (removed from the
+        parse tree, which only keeps the measure being read). Reads the
+        page width once the header is complete.
+
+        input_file: file object opened for the backend
+        """
+
+        stats = self.stats
+
+        events = self.backend.iterparse(input_file)
+        if stats is not None:
+            events = stats.timed_iter('xml_parse', events)
+
+        # Open elements, from <score-partwise> down to the current one
+        stack = []
+
+        part = None         # <part> element being read (1st part only)
+
+        for event, elem in events:
+
+            if event == 'start':
+                stack.append(elem)
+
+                # Header (<defaults>, <part-list>) is complete once the first part starts
+                if elem.tag == 'part' and len(stack) == 2 and part is None:
+                    root = stack[0]
+
+                    # Read the width and cutoffs for each page
+                    if stats is not None:
+                        with stats.stage('get_width'):
+                            self.get_width(root)
+                    else:
+                        self.get_width(root)
+
+                    # Check for bad MusicXML
+                    if all(child.tag != 'part-list' for child in root):
+                        raise KeyError('MusicXML file:', source_name(self.input_file),' missing <part-list> or <part>')
+
+                    # Header is no longer needed
+                    for child in list(root):
+                        if child is not elem:
+                            root.remove(child)
+
+                    part = elem
+                continue
+
+            stack.pop()
+
+            # Only the first part is used to generate sequences
+            if elem is part:
+                break
+
+            # Only complete measures of the first part are read
+            if part is None or len(stack) != 2:
+                continue
+            part.remove(elem)
+
+            yield elem
+
+        # Check for bad MusicXML
+        if part is None:
+            raise KeyError('MusicXML file:', source_name(self.input_file),' missing <part-list> or <part>')
+
+    def iter_part_sequences(self, measures, tokens=False, resume=None, index=None, by_measure=False, read=None):
+
+        """
+        Reads the measures of a part and yields its sequences one page at a
+        time (list of symbols for each staff), the page width must be read
+        beforehand (see get_width)
+
+        measures: iterable of the <measure> elements of the part
+        tokens: yield the Token objects of each staff instead of strings
+        resume: dict with the num_staves and skip (multirest measures left)
+                to read measures from the middle of a part, the first one
+                then starts a page (the clef, key, ... must be set beforehand)
+        index: optional list, the page and parser state carried into each
+               measure are appended to it (see index.MEASURE_FIELDS)
+        by_measure: yield (starts, staves) for each measure read instead of
+                    the pages, staves holding the tokens of each staff and
+                    starts the position of the first one in its page
+        read: function reading each measure instead of read_measure (same
+              arguments and return value), eg. scan_measure to only read
+              the parser state carried by each measure
+        """
+
+        new_score = True
+        self.bars = []
+        stats = self.stats
+        budget = self.budget
+
+        num_staves = 1
+        staves = []         # Holds tokens of each staff
+        skip = 0            # Remaining measures to skip for multirest
+        cur_width = 0.0     # Sum of width of measures currently read
+        page_num = 1        # Current page number (for naming)
+        new_page = False    # Tracks if just beginning a new page due to "print" element
+
+        # Reading from the middle of the part, at the start of a page
+        page_start = resume is not None
+        if page_start:
+            num_staves = resume['num_staves']
+            skip = resume['skip']
+            staves = [[] for x in range(num_staves)]
+            new_score = False
+
+        for measure in measures:
+
+            if budget is not None:
+                budget.check()
+
+            # Page and parser state at the start of the measure (byte offsets are added by build_index)
+            if index is not None:
+                entry = [None, None, page_num - 1, skip, self.clef, self.key, self.time,
+                         self.beat, self.beat_type, self.divisions, self.rejected]
+                index.append(entry)
+
+            # Skips any measures as needed
+            if skip > 0:
+                skip -= 1
+                if stats is not None:
+                    stats.count('multirest_skipped_measures')
+                continue
+
+            if new_score:
+                # Get number of staves in the MusicXML
+                try:
+                    for e in measure[0]:
+                        if e.tag == 'staff-layout':
+                            num_staves = int(e.attrib['number'])
+                except IndexError:
+                    if not by_measure:
+                        yield [] if tokens else ''
+                    return
+                staves = [[] for x in range(num_staves)]
+
+            # Increment current width by the measure's width
+            if page_start:
+                cur_width = int(float(measure.attrib['width']))
+            else:
                 cur_width += float(measure.attrib['width'])
 
-                # Check if need to create a new page (ie. new sample)
-                child_elems = [e for e in measure]
-                child_tags = [e.tag for e in child_elems]
-                if 'print' in child_tags:
-                    print_children = [e.tag for e in list(iter(child_elems[child_tags.index('print')]))]
-                    if 'system-layout' in print_children: 
-                        new_page = True
-                if cur_width > self.width_cutoff or new_page:
-                    # Save the current sequence to be saved
-                    sequences.append(staves)
-                    staves = ['' for x in range(num_staves)]
-                    cur_width = int(float(measure.attrib['width']))
-                    page_num += 1
-
-                    # Reset polyphonic page and print if necessary
-                    if self.polyphonic_page:
-                        pass
-                        #print(self.input_file.split('\\')[-1].split('.semantic')[0] + '-' + str(page_num-1))
-                    self.polyphonic_page = False
-
-                # Gets the symbolic sequence of each staff in measure of first part
+            # Check if need to create a new page (ie. new sample)
+            child_elems = [e for e in measure]
+            child_tags = [e.tag for e in child_elems]
+            if 'print' in child_tags:
+                print_children = [e.tag for e in list(iter(child_elems[child_tags.index('print')]))]
+                if 'system-layout' in print_children: 
+                    new_page = True
+            if page_start:
+                page_start = False
+            elif cur_width > self.width_cutoff or new_page:
+                # Yield the current sequence, the page is complete
+                if stats is not None:
+                    stats.count('pages')
+                if not by_measure:
+                    yield staves if tokens else [serialize(s) for s in staves]
+                staves = [[] for x in range(num_staves)]
+                cur_width = int(float(measure.attrib['width']))
+                page_num += 1
+
+                # Reset polyphonic page and print if necessary
+                if self.polyphonic_page:
+                    pass
+                    #print(self.input_file.split('\\')[-1].split('.semantic')[0] + '-' + str(page_num-1))
+                self.polyphonic_page = False
+
+            if index is not None:
+                entry[2] = page_num - 1
+
+            # Gets the symbolic sequence of each staff in measure of first part
+            if read is not None:
+                measure_staves, skip = read(measure, num_staves, new_page, staves, new_score)
+            elif stats is not None:
+                start = time.perf_counter()
+                measure_staves, skip = self.read_measure(measure, num_staves, new_page, staves, new_score)
+                stats.add('read_measure', time.perf_counter() - start)
+                stats.count('measures')
+            else:
                 measure_staves, skip = self.read_measure(measure, num_staves, new_page, staves, new_score)
-                new_score = False
+            new_score = False
 
-                # Updates current symbolic sequence of each staff with current measure's symbols
-                for j in range(num_staves):
-                    staves[j] += measure_staves[j]
+            if by_measure:
+                yield [len(s) for s in staves], measure_staves
 
-                # Skips any measures as needed
-                for j in range(skip-1):
-                    next(r_iter)
+            # Updates current tokens of each staff with current measure's tokens
+            for j in range(num_staves):
+                staves[j] += measure_staves[j]
 
-                new_page = False
+            # Skips any measures as needed
+            skip = max(skip - 1, 0)
 
-        # Add any remaining measures to list of sequences
-        if cur_width > 0:
-            sequences.append(staves)
-            staves = ['' for x in range(num_staves)]
-            cur_width = int(float(measure.attrib['width']))
+            new_page = False
 
-        return sequences
+        # Part without measures
+        if new_score:
+            if not by_measure:
+                yield [] if tokens else ''
+            return
 
+        # Add any remaining measures to list of sequences
+        if cur_width > 0 and not by_measure:
+            if stats is not None:
+                stats.count('pages')
+            yield staves if tokens else [serialize(s) for s in staves]
 
     def read_measure(self, measure, num_staves, new_page, cur_staves, new_score):
 
         """
-        Reads a measure and returns a sequence of symbols
+        Reads a measure and returns the tokens of each staff
 
         measure: .xml element of the current measure being read
         num_staves: number of staves in the measure
         new_page: indiciates if starting a new page
-        cur_staves: rest of sequence so far from previous measures
+        cur_staves: tokens of each staff so far from previous measures (of the page)
         new_score: indicates if first measure of the score
         """
 
-        # Create a measure object
-        m = Measure(measure, num_staves, self.beat, self.beat_type)
+        # Start parsing the measure
+        m = self.measure_parser
+        m.reset(measure, num_staves, self.beat, self.beat_type, self.divisions)
 
-        # Tracking variables for the current sequence of each staff/voices for polyphonic music
-        staves = ['' for _ in range(num_staves)]
+        # Tokens of each staff and number of measures to skip (multirest)
+        staves = [[] for _ in range(num_staves)]
         skip = 0
-        voice_lines = dict()        # Symbolic representations of each voice
-        voice_durations = dict()    # Length (in time) of each symbol of each voice
-
-        forward_dur = []    # used for weird use of a 2nd voice
-        cur_voice = -1      # tracks current voice
 
-        # Track the clef, key, time signature that each sequence should start with
-        start_clef = self.clef
-        start_key = self.key
-        start_time = self.time
+        # Position in the measure (in divisions), onset of the last note
+        # (shared by the notes of a chord) and length of the measure content
+        position = 0
+        note_onset = 0
+        measure_duration = 0
 
         # Skip percussion/guitar tabs
-        if 'percussion' in self.clef or 'TAB' in self.clef:
+        if self.rejected is not None:
             return staves, 0
 
-        # Grace note tracking
-        is_grace = False
-        prev_grace = False
+        stats = self.stats
         # Iterate through all elements in measure
         for elem in measure:
 
-            # Stores symbolic sequence representing the current element being read
-            cur_elem = ['' for _ in range(num_staves)]
+            if stats is not None:
+                start = time.perf_counter()
 
-            is_chord = False    # Used for determining to advance (+ symbol)
+            # Tokens representing the current element being read (same for all staves)
+            cur_elem = []
 
             if elem.tag == 'attributes':
                 # Parse the attributes element
                 # (Skip is number of measures to skip for multirest)
-                cur_elem, skip, self.beat, self.beat_type = m.parse_attributes(elem)
+                try:
+                    cur_elem, skip, self.beat, self.beat_type = m.parse_attributes(elem)
+                except ScoreRejected as e:
+                    # Skip percussion/guitar music
+                    self.rejected = e.reason
+                    return [[] for _ in range(num_staves)], 0
+                self.divisions = m.divisions
 
-                # Skip percussion/guitar music
-                if 'percussion' in cur_elem[0] or 'TAB' in cur_elem[0] or \
-                    'percussion' in cur_elem or 'TAB' in cur_elem:
-                    self.clef = 'percussion'
-                    return ['' for _ in range(num_staves)], 0
+                for t in cur_elem:
+                    t.onset = position
 
                 # Add to all staves
                 for i in range(num_staves):
-                    if (cur_staves[i] != '' or staves[i] != '') and not is_chord and cur_elem[i] != '':
-                        staves[i] += '+ ' + cur_elem[i]
-                    else:
-                        staves[i] += cur_elem[i]
+                    for j, t in enumerate(cur_elem):
+                        sep = t.sep
+                        if j == 0:
+                            sep = ADVANCE if cur_staves[i] or staves[i] else NO_ADVANCE
+                        staves[i].append(t.copy(sep, i))
 
             elif elem.tag == 'note':
 
-                # Parse note element and get the symbolic representation of it
-                cur_elem, is_chord, voice, duration, is_grace, _ = m.parse_note(elem)
-
-                # Check if new voice started
-                if cur_voice != voice and cur_voice != -1:
-
-                    # Add any remaining forwards to previous voice
-                    if len(forward_dur) != 0 and cur_voice in voice_lines:
-                        voice_lines[cur_voice].append('forward')
-                        voice_durations[cur_voice].append(forward_dur[-1])
-                        del forward_dur[-1]
-
-                cur_voice = voice
-
-                # No print object case, include a duration, but don't generate symbol
-                if cur_elem == 'forward':
+                # Parse note element and get the token of it
+                token, is_chord, voice, duration, is_grace, _ = m.parse_note(elem)
 
-                    if len(forward_dur) == 1:
-                        forward_dur[0] += duration
-                    else:
-                        forward_dur.append(duration)
-
-                else:
-                    # Update voicing stuff (for multi voice aka polyphony)
-                    if voice not in voice_lines:
-                        voice_lines[voice] = []
-                        voice_durations[voice] = []
-                        if len(forward_dur) != 0:       # Handle weird case when voice added in middle of a measure
-                            voice_lines[voice].append('+ ')
-                            voice_lines[voice].append('forward')
-                            voice_durations[voice].append(0)
-                            voice_durations[voice].append(forward_dur[-1])
-                            del forward_dur[-1]
-                    
-                    # If not a chord, append a '+' and 0 duration for it
-                    if ((cur_staves[0] != '' or staves[0] != '') and not is_chord and cur_elem[0] != '') and not is_grace and not prev_grace:
-                        voice_lines[voice].append('+ ')
-                        voice_durations[voice].append(0)
-                        voice_lines[voice].append(cur_elem[0])
-                        voice_durations[voice].append(duration)
-                    else:
-                        # Different behavior if first note of sequence
-                        if staves[0] != '':
-                            voice_lines[voice].append(cur_elem[0])
-                            voice_durations[voice].append(0)
-                        else:
-                            voice_lines[voice].append('+ ')
-                            voice_durations[voice].append(0)
-                            voice_lines[voice].append(cur_elem[0])
-                            voice_durations[voice].append(duration)
+                # Notes of a chord start together (unprinted notes are always advanced)
+                is_forward = token is not None and token.kind == FORWARD
+                if not is_chord or is_forward:
+                    note_onset = position
+                    position += duration
+                    measure_duration = max(measure_duration, position)
 
                 # Add to stave
-                if (cur_staves[voice] != '' or staves[voice] != '') and not is_chord and cur_elem[0] != '':
-                    staves[voice] += '+ ' + cur_elem[0]
-                else:
-                    staves[voice] += cur_elem[0]
-                        
+                if token is not None:
+                    token.onset = note_onset
+                    token.length = 0 if is_grace else duration
+                    token.sep = ADVANCE if (cur_staves[voice] or staves[voice]) and not is_chord else NO_ADVANCE
+                    staves[voice].append(token)
+                    cur_elem = [token]
+
             elif elem.tag == 'direction':       # Parse direction element
-                cur_elem = m.parse_direction(elem)
+                direction = m.parse_direction(elem)
+
+                # Add to each staff
+                for i in range(num_staves):
+                    for j, t in enumerate(direction[i]):
+                        t.onset = position
+                        if j == 0 and (cur_staves[i] or staves[i]):
+                            t.sep = SPACED_ADVANCE
+                        staves[i].append(t)
+                cur_elem = direction[0]
 
             elif elem.tag == 'forward':         # Parse forward element (used for multi voice music)
-                forward_dur.append(int(elem[0].text))
+                position += int(elem[0].text)
+                measure_duration = max(measure_duration, position)
 
             elif elem.tag == 'backup':          # Switching voice indication
-
-                # Add any remaining forwards to previous voice
-                if len(forward_dur) != 0 and cur_voice in voice_lines:
-                    voice_lines[cur_voice].append('forward')
-                    voice_durations[cur_voice].append(forward_dur[-1])
-                    del forward_dur[-1]
-
-                if len(forward_dur) != 0:
-                    forward_dur = []
-
-                cur_voice = -1
-
-            # Add whatever was read to the staves
-            if elem.tag != 'attributes' and elem.tag != 'note':
-                for i in range(num_staves):
-                    if 'multirest' in cur_elem[0]:
-                        pass
-                    if cur_elem != 'forward':
-                        if (cur_staves[i] != '' or staves[i] != '') and not is_chord and cur_elem[i] != '':
-                            staves[i] += ' + ' + cur_elem[i]
-                        else:
-                            staves[i] += cur_elem[i] 
+                position -= int(elem[0].text)
 
             # Store current key/time/clef signature if found
-            for word in cur_elem[0].split():
-
-                # Check for key
-                if 'key' in word:
-                    
-                    # If not a chord, append a '+' and 0 duration for it
-                    if ((cur_staves[0] != '' or staves[0] != '') and not is_chord and cur_elem[0] != '') \
-                        and self.key != '':
-                        for v in voice_lines.keys():
-                            voice_durations[v].append(0)
-                            voice_durations[v].append(0)
-                            voice_lines[v].append(' + ')
-                            voice_lines[v].append(word + ' ')
-                            
-                    self.key = word
-                    start_key = self.key
-
-                # Check for clef
-                if 'clef' in word:
-                    
-                    # If not a chord, append a '+' and 0 duration for it
-                    if ((cur_staves[0] != '' or staves[0] != '') and not is_chord and cur_elem[0] != '') \
-                        and self.clef != '':
-                        for v in voice_lines.keys():
-                            voice_durations[v].append(0)
-                            voice_durations[v].append(0)
-                            voice_lines[v].append(' + ')
-                            voice_lines[v].append(word + ' ')
-     
-                    self.clef = word
-                    start_clef = self.clef
-
-                # Check for time signature symbol
-                if 'time' in word:
-                    
-                    # If not a chord, append a '+' and 0 duration for it
-                    if ((cur_staves[0] != '' or staves[0] != '') and not is_chord and cur_elem[0] != '') \
-                        and self.time != '':
-                        for v in voice_lines.keys():
-                            voice_durations[v].append(0)
-                            voice_durations[v].append(0)
-                            voice_lines[v].append(' + ')
-                            voice_lines[v].append(word + ' ')
-        
-                    self.time = word
-                    start_time = self.time
+            for t in cur_elem:
+                if t.kind == KEY:
+                    self.key = t.symbol
+                elif t.kind == CLEF:
+                    self.clef = t.symbol
+                elif t.kind == TIME:
+                    self.time = t.symbol
+
+            # Time spent on each element tag (including the Measure.parse_* call)
+            if stats is not None:
+                stats.add('element:' + elem.tag, time.perf_counter() - start)
 
             # Skip rest of measure if multirest
             if skip > 0:
                 break
 
-            # Update grace note tracking
-            prev_grace = is_grace
+        # Record the length of the bar (multirests stand for several measures)
+        self.bars.append(Bar(self.beat, self.beat_type, self.divisions, measure_duration, max(skip, 1)))
 
-        # Add measure separator to just one voice
-        if len(voice_lines) > 0:
-            key = sorted(voice_lines.keys())[0]
-            voice_lines[key].append(' + ')
-            voice_lines[key].append('barline ')
-            voice_durations[key].append(0)
-            voice_durations[key].append(0)
+        # Add measure separator to each staff
+        for i in range(num_staves):
+            staves[i].append(Token(BARLINE, 'barline', SPACED_ADVANCE, staff=i, onset=measure_duration))
 
-        # Add any remaining forwards to last voice if not extra
-        if len(forward_dur) != 0 and len(voice_lines) > 0:
-            keys = sorted(voice_lines.keys())
-            max_sum = sum(voice_durations[keys[0]])
+        return staves, skip
 
-            # Only add if not an extra forward for diff staff possibly
-            if (sum(voice_durations[keys[-1]]) + forward_dur[-1]) <= max_sum:
-                voice_lines[keys[-1]].append('forward')
-                voice_durations[keys[-1]].append(forward_dur[-1])
-                del forward_dur[-1]
+    def scan_measure(self, measure, num_staves, new_page=False, cur_staves=None, new_score=False):
 
-        # Add measure separator to each staff
-        for i in range(num_staves):
-            staves[i] = staves[i] + ' + barline '
+        """
+        Reads only the attributes of a measure, updating the parser state
+        (clef, key, time signature, ...) as read_measure does, and returns
+        empty staves and the number of measures to skip (multirest)
+
+        measure: .xml element of the current measure being read
+        num_staves: number of staves in the measure
+        new_page, cur_staves, new_score: unused (see read_measure)
+        """
+
+        m = self.measure_parser
+        m.reset(measure, num_staves, self.beat, self.beat_type, self.divisions)
+
+        staves = [[] for _ in range(num_staves)]
+        skip = 0
+
+        if self.rejected is not None:
+            return staves, 0
+
+        for elem in measure:
+
+            if elem.tag != 'attributes':
+                continue
+
+            try:
+                cur_elem, skip, self.beat, self.beat_type = m.parse_attributes(elem)
+            except ScoreRejected as e:
+                self.rejected = e.reason
+                return staves, 0
+            self.divisions = m.divisions
+
+            for t in cur_elem:
+                if t.kind == KEY:
+                    self.key = t.symbol
+                elif t.kind == CLEF:
+                    self.clef = t.symbol
+                elif t.kind == TIME:
+                    self.time = t.symbol
+
+            if skip > 0:
+                break
 
         return staves, skip
 
-        
     def compare_symbols(self, a, b):
 
         """
@@ -466,35 +1222,78 @@ class MusicXML():
         Converts note to num for purpose of sorting
         """
 
-        note_dict = {
-            'Cb': 0,
-            'C': 1,
-            'C#': 2,
-            'Db': 2,
-            'D': 3,
-            'D#': 4,
-            'Eb': 4,
-            'E': 5,
-            'E#': 6,
-            'Fb': 6,
-            'F': 7,
-            'F#': 8,
-            'Gb': 8,
-            'G': 9,
-            'G#': 10,
-            'Ab': 10,
-            'A': 11,
-            'A#': 12,
-            'Bb': 12,
-            'B': 13,
-            'B#': 14,
-        }
-
         try:
-            return note_dict[note]
+            return NOTE_NUMS[note]
         except KeyError:
             try:
-                return note_dict[note[:-1]]
+                return NOTE_NUMS[note[:-1]]
             except KeyError:
                 print('Error with note dict?',note)
-                return 0
\ No newline at end of file
+                return 0
+
+
+def read_part(part, input_file, width, width_cutoff, tokens=False, stats=None, budget=None):
+
+    """
+    Reads a parsed <part> element with a fresh parser state (clef, key,
+    time signature, ...) and returns its sequences and bars
+
+    part: parsed <part> element
+    input_file: name of the score (for error messages)
+    width, width_cutoff: page width and cutoff of the score (see MusicXML.get_width)
+    tokens: return the Token objects of each staff instead of strings
+    stats: optional ParseStats
+    budget: optional budget.Budget
+    """
+
+    reader = MusicXML(input_file, stats=stats, budget=budget)
+    reader.width = width
+    reader.width_cutoff = width_cutoff
+
+    sequences = list(reader.iter_part_sequences(iter(part), tokens))
+
+    return sequences, reader.bars
+
+
+def can_fork():
+
+    """
+    Returns whether worker processes sharing the memory of the current one
+    can be started (fork is needed, and workers of a multiprocessing pool
+    cannot start processes)
+    """
+
+    return 'fork' in multiprocessing.get_all_start_methods() and not multiprocessing.current_process().daemon
+
+
+def _read_shared_part(args):
+
+    """
+    Reads a part of _shared_parts in a worker process, returns its
+    sequences, bars and statistics (as a dict, None if not profiled)
+    """
+
+    index, input_file, width, width_cutoff, tokens, profile, budget = args
+
+    stats = ParseStats() if profile else None
+    sequences, bars = read_part(_shared_parts[index], input_file, width, width_cutoff, tokens, stats, budget)
+
+    return sequences, bars, stats.as_dict() if stats is not None else None
+
+
+def _read_shared_range(args):
+
+    """
+    Reads measures a to b of the score indexed by _shared_index in a worker
+    process, returns their sequences, bars, rejection reason and statistics
+    (as a dict, None if not profiled)
+    """
+
+    input_file, backend, errors, a, b, tokens, profile, budget = args
+
+    stats = ParseStats() if profile else None
+    reader = MusicXML(input_file, backend=backend, stats=stats, errors=errors, budget=budget)
+    reader.index = _shared_index
+    sequences = reader.get_measures(a, b, tokens)
+
+    return sequences, reader.bars, reader.rejected, stats.as_dict() if stats is not None else None
@@ -0,0 +1,615 @@
+"""
+Inverted index of the annotations of a corpus, so scores can be searched
+(eg. for 'cresc.-dynamic NEAR/3 timeSignature-*') without parsing them again
+
+The index maps every annotation symbol to its postings: the (file, bar)
+pairs it appears in, bars being the ones of get_bar_annotations. A
+posting is stored as an int64 key, the id of its file shifted left by
+BAR_BITS plus the index of its bar, so the postings of a symbol are a
+sorted array.
+
+An index is a directory holding a manifest (index.json: the indexed files,
+their content hash and the segments) and immutable segments. Each commit
+of new files writes a segment: the sorted list of its symbols (JSON), the
+offsets of their postings and the postings (.npy, memory-mapped when the
+index is opened). A file indexed again gets a new id, the postings of its
+previous id are ignored until the segments are merged.
+
+Queries (see parse_query):
+    cresc.-dynamic              bars holding the symbol
+    timeSignature-*             bars holding any symbol with that prefix
+    a AND b, a b                bars of a and of b, in files holding both
+    a OR b                      bars of a or b
+    a NOT b, a AND NOT b        bars of a, in files not holding b
+    a NEAR/3 b                  bars of a and b at most 3 bars apart
+    ( ... )                     grouping, "..." quotes a symbol
+"""
+
+import os
+import re
+import sys
+import json
+import bisect
+import argparse
+
+import numpy as np
+
+from .batch import run_batch, BUDGET_STATUSES
+from .cache import file_digest
+from .shards import parse_shard
+
+# Version of the index format, bump it whenever it changes
+INDEX_VERSION = 1
+
+MANIFEST = 'index.json'
+
+# Bits of a posting key holding the bar index
+BAR_BITS = 32
+
+# Postings buffered before a segment is written
+SEGMENT_POSTINGS = 1 << 22
+
+# Segments above which a commit merges them all
+MAX_SEGMENTS = 16
+
+QUERY_TOKEN = re.compile(r'\(|\)|"[^"]*"|[^\s()]+')
+NEAR = re.compile(r'NEAR/(\d+)$')
+
+
+def posting_doc(keys):
+    return keys >> BAR_BITS
+
+
+def posting_bar(keys):
+    return keys & ((1 << BAR_BITS) - 1)
+
+
+def write_segment(directory, name, postings):
+
+    """
+    Writes a segment: its symbols in sorted order, the offsets of their
+    postings (followed by the end of the last one) and the postings
+
+    postings: dict of the sorted posting keys of each symbol
+    """
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(postings[t]) for t in terms], out=offsets[1:])
+
+    keys = np.lib.format.open_memmap(os.path.join(directory, name + '.postings.npy'), mode='w+',
+                                     dtype=np.int64, shape=(int(offsets[-1]),))
+    for t, start, end in zip(terms, offsets[:-1], offsets[1:]):
+        keys[start:end] = postings[t]
+    keys.flush()
+    del keys
+
+    np.save(os.path.join(directory, name + '.offsets.npy'), offsets)
+    with open(os.path.join(directory, name + '.terms.json'), 'w') as f:
+        json.dump(terms, f)
+
+
+def remove_segment(directory, name):
+    for ext in ('.postings.npy', '.offsets.npy', '.terms.json'):
+        try:
+            os.remove(os.path.join(directory, name + ext))
+        except OSError:
+            pass
+
+
+class Segment():
+
+    """
+    Segment written by write_segment, its postings are memory-mapped
+    """
+
+    def __init__(self, directory, name):
+        self.name = name
+
+        with open(os.path.join(directory, name + '.terms.json'), 'r') as f:
+            self.terms = json.load(f)
+        self.ids = {t: i for i, t in enumerate(self.terms)}
+        self.offsets = np.load(os.path.join(directory, name + '.offsets.npy'))
+
+        # An empty array cannot be memory-mapped
+        if self.offsets[-1] > 0:
+            self.keys = np.load(os.path.join(directory, name + '.postings.npy'), mmap_mode='r')
+        else:
+            self.keys = np.zeros(0, dtype=np.int64)
+
+    def postings(self, term):
+
+        """
+        Returns the posting keys of a symbol (a view of the memory map)
+        """
+
+        i = self.ids.get(term)
+        if i is None:
+            return self.keys[:0]
+        return self.keys[self.offsets[i]:self.offsets[i + 1]]
+
+    def prefixed(self, prefix):
+
+        """
+        Returns the symbols starting with prefix
+        """
+
+        start = bisect.bisect_left(self.terms, prefix)
+        end = start
+        while end < len(self.terms) and self.terms[end].startswith(prefix):
+            end += 1
+
+        return self.terms[start:end]
+
+
+def parse_query(text):
+
+    """
+    Returns the tree of a query (see the module documentation) made of
+    ('term', symbol), ('prefix', prefix), ('or', a, b), ('and', a, b),
+    ('not', a, b) for a AND NOT b and ('near', a, b, distance) tuples,
+    raises ValueError if it is invalid
+
+    NEAR binds tighter than AND (and NOT), then OR.
+    """
+
+    tokens = QUERY_TOKEN.findall(text)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        node = parse_and()
+        while peek() == 'OR':
+            take()
+            node = ('or', node, parse_and())
+        return node
+
+    def parse_and():
+        node = parse_near()
+        while peek() is not None and peek() not in (')', 'OR'):
+            if peek() == 'AND':
+                take()
+            if peek() == 'NOT':
+                take()
+                node = ('not', node, parse_near())
+            else:
+                node = ('and', node, parse_near())
+        return node
+
+    def parse_near():
+        node = parse_primary()
+        while peek() is not None and NEAR.match(peek()):
+            distance = int(NEAR.match(take()).group(1))
+            node = ('near', node, parse_primary(), distance)
+        return node
+
+    def parse_primary():
+        token = peek()
+        if token is None:
+            raise ValueError('Unexpected end of query: ' + repr(text))
+        if token in (')', 'AND', 'OR', 'NOT') or NEAR.match(token):
+            raise ValueError('Unexpected %r in query: %r' % (token, text))
+        take()
+        if token == '(':
+            node = parse_or()
+            if peek() != ')':
+                raise ValueError('Missing ) in query: ' + repr(text))
+            take()
+            return node
+        if token.startswith('"'):
+            return ('term', token[1:-1])
+        if token.endswith('*'):
+            return ('prefix', token[:-1])
+        return ('term', token)
+
+    node = parse_or()
+    if peek() is not None:
+        raise ValueError('Unexpected %r in query: %r' % (peek(), text))
+
+    return node
+
+
+def in_docs(keys, docs):
+
+    """
+    Returns the mask of the keys whose file is in docs (a sorted array)
+    """
+
+    return np.isin(posting_doc(keys), docs)
+
+
+def near(a, b, distance):
+
+    """
+    Returns the mask of the keys of a that have a key of b in the same
+    file at most distance bars away (a and b being sorted)
+    """
+
+    if len(b) == 0:
+        return np.zeros(len(a), dtype=bool)
+
+    # A key of a bar below distance goes back to the end of the bars of the
+    # previous file, above any real bar, so the first key found is in the file or after
+    i = np.minimum(np.searchsorted(b, a - distance), len(b) - 1)
+    found = b[i]
+
+    return (found >= a - distance) & (found <= a + distance) & (posting_doc(found) == posting_doc(a))
+
+
+class AnnotationIndex():
+
+    def __init__(self, directory):
+
+        """
+        Opens the index in directory, creating it if needed
+
+        Files added are only searched once committed (see commit).
+        """
+
+        self.directory = os.fspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+        manifest = os.path.join(self.directory, MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != INDEX_VERSION:
+                raise ValueError('Unsupported index version: ' + str(data.get('version')))
+        else:
+            data = {'version': INDEX_VERSION, 'docs': [], 'segments': [], 'next_segment': 0}
+
+        # (path, sha256) of each file id, None for removed files (and the previous ids of files indexed again)
+        self.docs = [tuple(d) if d is not None else None for d in data['docs']]
+        self.next_segment = data['next_segment']
+        self.segments = [Segment(self.directory, name) for name in data['segments']]
+
+        # Latest id of each path
+        self.paths = {d[0]: i for i, d in enumerate(self.docs) if d is not None}
+
+        self.buffer = {}
+        self.buffered = 0
+        self.live = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.commit()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    def digest(self, path):
+
+        """
+        Returns the content hash a file was indexed with (None if unknown)
+        """
+
+        return self.docs[self.paths[path]][1]
+
+    def add(self, path, bars, sha256=None):
+
+        """
+        Adds the bar annotations of a file (as returned by gen_annotations
+        without times: the annotations of each bar), replacing the ones
+        it was indexed with before, returns its file id
+
+        sha256: content hash of the file (see done)
+        """
+
+        # The previous id of the file is left out, even once the index is opened again
+        previous = self.paths.get(path)
+        if previous is not None:
+            self.docs[previous] = None
+
+        doc = len(self.docs)
+        self.docs.append((path, sha256))
+        self.paths[path] = doc
+        self.live = None
+
+        base = doc << BAR_BITS
+        buffer = self.buffer
+        for bar, annotations in enumerate(bars):
+            for symbol in set(annotations):
+                postings = buffer.get(symbol)
+                if postings is None:
+                    buffer[symbol] = postings = []
+                postings.append(base + bar)
+            self.buffered += len(annotations)
+
+        if self.buffered >= SEGMENT_POSTINGS:
+            self.flush()
+
+        return doc
+
+    def remove(self, path):
+
+        """
+        Removes a file from the index (once committed)
+        """
+
+        doc = self.paths.pop(path, None)
+        if doc is not None:
+            self.docs[doc] = None
+            self.live = None
+
+    def done(self, verify=False):
+
+        """
+        Returns the set of files already indexed
+
+        verify: leave out the files whose content changed since
+                (their content is hashed again)
+        """
+
+        if not verify:
+            return set(self.paths)
+
+        done = set()
+        for path, doc in self.paths.items():
+            try:
+                if file_digest(path) == self.docs[doc][1]:
+                    done.add(path)
+            except OSError:
+                pass
+
+        return done
+
+    def flush(self):
+
+        """
+        Writes the buffered postings as a new segment (not committed yet)
+        """
+
+        if len(self.buffer) == 0:
+            return
+
+        name = 'seg-%06d' % self.next_segment
+        self.next_segment += 1
+        write_segment(self.directory, name, {t: np.array(p, dtype=np.int64) for t, p in self.buffer.items()})
+        self.segments.append(Segment(self.directory, name))
+
+        self.buffer = {}
+        self.buffered = 0
+
+    def commit(self):
+
+        """
+        Writes the buffered postings and the manifest (atomically), the
+        segments are merged once there are more than MAX_SEGMENTS
+        """
+
+        self.flush()
+        if len(self.segments) > MAX_SEGMENTS:
+            self.merge()
+        else:
+            self.write_manifest()
+
+    def write_manifest(self):
+        data = {'version': INDEX_VERSION, 'docs': self.docs, 'segments': [s.name for s in self.segments],
+                'next_segment': self.next_segment}
+
+        path = os.path.join(self.directory, MANIFEST)
+        tmp_path = path + '.%d.tmp' % os.getpid()
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def merge(self):
+
+        """
+        Merges the segments into one holding only the postings of the
+        files currently indexed (committing the index)
+        """
+
+        self.flush()
+
+        live = self.live_docs()
+        terms = sorted(set(t for s in self.segments for t in s.terms))
+        postings = {}
+        for t in terms:
+            keys = self.postings(t, live)
+            if len(keys) > 0:
+                postings[t] = keys
+
+        old = self.segments
+        name = 'seg-%06d' % self.next_segment
+        self.next_segment += 1
+        write_segment(self.directory, name, postings)
+        self.segments = [Segment(self.directory, name)]
+        self.write_manifest()
+
+        for s in old:
+            remove_segment(self.directory, s.name)
+
+    def live_docs(self):
+
+        """
+        Returns the mask of the file ids currently indexed
+        """
+
+        if self.live is None:
+            self.live = np.zeros(len(self.docs), dtype=bool)
+            self.live[list(self.paths.values())] = True
+
+        return self.live
+
+    def postings(self, term, live=None):
+
+        """
+        Returns the sorted posting keys of a symbol, over the files
+        currently indexed (segments hold increasing file ids, so their
+        postings are simply concatenated)
+        """
+
+        keys = np.concatenate([s.postings(term) for s in self.segments] + [np.zeros(0, dtype=np.int64)])
+        if live is None:
+            live = self.live_docs()
+
+        return keys[live[posting_doc(keys)]]
+
+    def prefix_postings(self, prefix):
+
+        """
+        Returns the sorted posting keys of the symbols starting with prefix
+        """
+
+        terms = set(t for s in self.segments for t in s.prefixed(prefix))
+
+        return np.unique(np.concatenate([self.postings(t) for t in terms] + [np.zeros(0, dtype=np.int64)]))
+
+    def evaluate(self, node):
+
+        """
+        Returns the sorted posting keys of a query tree (see parse_query)
+        """
+
+        op = node[0]
+
+        if op == 'term':
+            return self.postings(node[1])
+        if op == 'prefix':
+            return self.prefix_postings(node[1])
+
+        a, b = self.evaluate(node[1]), self.evaluate(node[2])
+
+        if op == 'or':
+            return np.union1d(a, b)
+        if op == 'and':
+            docs = np.intersect1d(posting_doc(a), posting_doc(b))
+            return np.union1d(a[in_docs(a, docs)], b[in_docs(b, docs)])
+        if op == 'not':
+            return a[~in_docs(a, np.unique(posting_doc(b)))]
+        if op == 'near':
+            return np.union1d(a[near(a, b, node[3])], b[near(b, a, node[3])])
+
+        raise ValueError('Unknown query operator: ' + repr(op))
+
+    def search(self, query):
+
+        """
+        Returns the (path, bar indexes) of each file matching a query (a
+        string, see parse_query, or a query tree), in file id order
+        """
+
+        if isinstance(query, str):
+            query = parse_query(query)
+
+        keys = self.evaluate(query)
+
+        docs, starts = np.unique(posting_doc(keys), return_index=True)
+        bars = np.split(posting_bar(keys), starts[1:])
+
+        return [(self.docs[doc][0], b.tolist()) for doc, b in zip(docs.tolist(), bars)]
+
+
+def index_corpus(index, sources, verify=False, **options):
+
+    """
+    Adds the files found in sources that are not indexed yet (or whose
+    content changed, if verify is set) to an index and yields the result
+    of each file (without its annotations), committing at the end. Files
+    that fail are removed from the index.
+
+    options: passed to batch.run_batch
+    """
+
+    exclude = index.done(verify)
+
+    try:
+        for result in run_batch(sources, False, exclude=exclude, checksum=True, **options):
+            annotations = result.pop('annotations', None)
+            if annotations is not None:
+                index.add(result['file'], annotations, result.pop('sha256', None))
+            else:
+                index.remove(result['file'])
+                result.pop('sha256', None)
+            yield result
+    finally:
+        index.commit()
+
+
+def main(argv=None):
+
+    """
+    Command line entry point
+    """
+
+    parser = argparse.ArgumentParser(description='Index the annotations of a corpus of MusicXML files and search it')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='index the files not indexed yet')
+    add.add_argument('index', help='index directory')
+    add.add_argument('sources', nargs='+', help='MusicXML files, directories, glob patterns or manifests')
+    add.add_argument('--verify', action='store_true', help='index again the files whose content changed')
+    add.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    add.add_argument('--chunksize', type=int, default=16, help='files dispatched to a worker at a time')
+    add.add_argument('--cache', default=None, help='SQLite cache of parsed sequences')
+    add.add_argument('--cache-size', type=int, default=1 << 30, help='size cap of the cache in bytes')
+    add.add_argument('--backend', default=None, choices=['etree', 'lxml', 'expat'],
+                     help='XML backend (defaults to lxml when installed)')
+    add.add_argument('--all-parts', action='store_true', help='index every part (only the first one otherwise)')
+    add.add_argument('--encoding-errors', default='strict', choices=['strict', 'ignore', 'replace'],
+                     help='skip badly encoded files (strict) or decode them leniently')
+    add.add_argument('--no-triage', action='store_true',
+                     help='parse every file instead of skipping the ones rejected by a pre-scan')
+    add.add_argument('--timeout', type=float, default=None,
+                     help='time limit of each file in seconds (its worker is killed if it does not stop)')
+    add.add_argument('--shard', type=parse_shard, default=None, metavar='I/N',
+                     help='only process shard I of N (files are split by a hash of their path)')
+
+    query = commands.add_parser('query', help='print the files and bars matching a query (JSON lines)')
+    query.add_argument('index', help='index directory')
+    query.add_argument('query', help='query, eg. \'cresc.-dynamic NEAR/3 timeSignature-*\'')
+
+    merge = commands.add_parser('merge', help='merge the segments of an index')
+    merge.add_argument('index', help='index directory')
+
+    args = parser.parse_args(argv)
+
+    index = AnnotationIndex(args.index)
+
+    if args.command == 'query':
+        try:
+            matches = index.search(args.query)
+        except ValueError as e:
+            parser.error(str(e))
+        for path, bars in matches:
+            print(json.dumps({'file': path, 'bars': bars}))
+        return 0
+
+    if args.command == 'merge':
+        index.merge()
+        return 0
+
+    num_ok, num_failed, num_rejected, num_over_budget = 0, 0, 0, 0
+    for result in index_corpus(index, args.sources, args.verify, workers=args.workers, chunksize=args.chunksize,
+                               cache_path=args.cache, cache_size=args.cache_size, backend=args.backend,
+                               all_parts=args.all_parts, errors=args.encoding_errors, triage=not args.no_triage,
+                               timeout=args.timeout, shard=args.shard):
+        if result['status'] == 'ok':
+            num_ok += 1
+        elif result['status'] == 'rejected':
+            num_rejected += 1
+        else:
+            num_failed += 1
+            if result['status'] in BUDGET_STATUSES.values():
+                num_over_budget += 1
+            print(json.dumps(result), file=sys.stderr)
+
+    print('Indexed %d files, %d failed (%d over budget), %d rejected (%d files in the index)'
+          % (num_ok + num_failed + num_rejected, num_failed, num_over_budget, num_rejected, len(index)),
+          file=sys.stderr)
+
+    return 0 if num_failed == 0 else 1
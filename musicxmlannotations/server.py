@@ -0,0 +1,418 @@
+"""
+Long-lived annotation server: a pool of worker processes is started
+once (modules imported, sequence cache opened) and scores are sent to
+it over HTTP, on localhost or a Unix domain socket, so a small score
+does not pay for starting an interpreter and importing the package
+
+Endpoints:
+    POST /annotate   annotations of a score (see gen_annotations)
+    POST /sequences  sequences of the first part of a score (see MusicXML.get_sequences)
+    GET  /health     status of the server
+    GET  /queue      number of requests being processed or waiting for a worker
+
+A score is posted either as the bytes of a .musicxml/.mxl file, with the
+options in the query string (eg. /annotate?time=bars&all_parts=1), or as
+a JSON object holding the path of the file (read by the server) and the
+options (eg. {"path": "score.mxl", "time": "bars"}, Content-Type
+application/json). Scores given by path can be read incrementally
+({"incremental": true}, see gen_annotations) as they are edited. The
+response is the JSON result of the file (see batch.process_file),
+whatever its status.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import argparse
+import threading
+import socketserver
+import http.server
+import urllib.parse
+
+from .backends import get_backend
+from .sources import source_name
+from .batch import get_cache, start_worker_process, KILL_GRACE, BUDGET_STATUSES
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Requests accepted at once (processed or waiting for a worker) per worker,
+# the others are answered 503 (Service Unavailable)
+PENDING_PER_WORKER = 4
+
+# Largest score accepted in a request body (413 above it)
+MAX_REQUEST_SIZE = 64 << 20
+
+# Outputs of the POST endpoints (see batch.process_file)
+OUTPUTS = {'/annotate': 'annotations', '/sequences': 'sequences'}
+
+
+class RequestError(ValueError):
+
+    """
+    Invalid request, answered with its HTTP status
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# Values of the time option of a request (see gen_annotations)
+TIMES = ('bars', 'onsets')
+
+
+def parse_time(value):
+    if value not in TIMES:
+        raise RequestError(400, 'Unknown time: %s (expected one of %s)' % (value, ', '.join(TIMES)))
+    return value
+
+
+# Options a request may set, parsed from the query string
+REQUEST_OPTIONS = {
+    'time': parse_time,
+    'all_parts': lambda v: v.lower() in ('1', 'true', 'yes'),
+    'triage': lambda v: v.lower() in ('1', 'true', 'yes'),
+    'incremental': lambda v: v.lower() in ('1', 'true', 'yes'),
+    'errors': lambda v: v,
+}
+
+
+def _warm_worker(options):
+
+    """
+    Initializer of the worker processes: opens what every file needs
+    """
+
+    get_backend(options['backend'])
+    if options['cache_path'] is not None:
+        get_cache(options['cache_path'], options['cache_size'])
+
+
+class AnnotationService():
+
+    def __init__(self, workers=None, max_pending=None, cache_path=None, cache_size=1 << 30, backend=None,
+                 timeout=None, max_memory=None):
+
+        """
+        Starts the worker processes requests are processed in, one file
+        at a time per worker
+
+        workers: number of worker processes (defaults to the number of CPUs)
+        max_pending: requests accepted at once, defaults to
+                     PENDING_PER_WORKER per worker
+        cache_path: optional SQLite sequence cache shared by the workers
+        cache_size: size cap of the cache in bytes
+        backend: XML backend to parse with (see backends.get_backend)
+        timeout: time limit of each file in seconds, a request still
+                 running timeout + KILL_GRACE seconds after reaching its
+                 worker gets a 'timeout' result, its worker being killed
+                 and replaced before the request is released
+        max_memory: bytes the memory of a worker may grow by while processing
+                    a file (its result then has an 'out-of-memory' status)
+        """
+
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or PENDING_PER_WORKER * self.workers
+        self.timeout = timeout
+
+        # Options of every file, requests only set the ones of REQUEST_OPTIONS
+        self.options = {'time': False, 'cache_path': cache_path, 'cache_size': cache_size, 'backend': backend,
+                        'all_parts': False, 'errors': 'strict', 'triage': True, 'timeout': timeout,
+                        'max_memory': max_memory}
+
+        self.lock = threading.Lock()
+
+        # Idle workers (process, connection), a request takes one for the
+        # time it is processed, every worker started is kept to stop them
+        self.idle = queue.Queue()
+        self.processes = set()
+        for _ in range(self.workers):
+            self.idle.put(self.start_worker())
+
+        self.pending = 0
+        self.served = 0
+        self.rejected = 0
+        self.started = time.monotonic()
+
+    def start_worker(self):
+        process, connection = start_worker_process(_warm_worker, (self.options,))
+        with self.lock:
+            self.processes.add(process)
+        return process, connection
+
+    def stop_worker(self, process, connection):
+        process.kill()
+        process.join()
+        connection.close()
+        with self.lock:
+            self.processes.discard(process)
+
+    def close(self):
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            process.kill()
+            process.join()
+
+    def acquire(self):
+
+        """
+        Counts a new request, returns False if max_pending are already pending
+        """
+
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self.pending += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.pending -= 1
+            self.served += 1
+
+    def process(self, source, options):
+
+        """
+        Returns the result of a file (path or bytes) processed in a worker
+
+        options: options of REQUEST_OPTIONS and the output (see OUTPUTS)
+        """
+
+        task = (source, dict(self.options, **options))
+        process, connection = self.idle.get()
+
+        try:
+            connection.send(task)
+            if connection.poll(self.timeout + KILL_GRACE if self.timeout is not None else None):
+                return connection.recv()
+
+            # Stuck outside the measure loop, where the budget is not checked
+            self.stop_worker(process, connection)
+            process, connection = self.start_worker()
+            return {'file': source_name(source), 'status': BUDGET_STATUSES['time'],
+                    'error': 'Worker killed after %.1fs' % (self.timeout + KILL_GRACE)}
+
+        except (EOFError, OSError):
+            # The worker died (eg. killed by the system for lack of memory)
+            self.stop_worker(process, connection)
+            exitcode = process.exitcode
+            process, connection = self.start_worker()
+            return {'file': source_name(source), 'status': 'error',
+                    'error': 'Worker exited with code %s' % exitcode}
+
+        finally:
+            self.idle.put((process, connection))
+
+    def health(self):
+        return {'status': 'ok', 'workers': self.workers, 'pid': os.getpid(),
+                'uptime': time.monotonic() - self.started}
+
+    def queue(self):
+
+        """
+        Returns the requests being processed or waiting for a worker
+        """
+
+        with self.lock:
+            return {'pending': self.pending, 'waiting': max(0, self.pending - self.workers),
+                    'max_pending': self.max_pending, 'workers': self.workers,
+                    'served': self.served, 'rejected': self.rejected}
+
+
+def parse_request(path, query, content_type, body):
+
+    """
+    Returns the source (path or bytes) and options of a POST request,
+    raises RequestError if it is invalid
+    """
+
+    if path not in OUTPUTS:
+        raise RequestError(404, 'Unknown endpoint: ' + path)
+
+    options = {'output': OUTPUTS[path]}
+    values = {k: v[-1] for k, v in urllib.parse.parse_qs(query).items()}
+
+    if content_type.split(';')[0].strip() == 'application/json':
+        try:
+            request = json.loads(body)
+            source = request.pop('path')
+        except (ValueError, KeyError, AttributeError, TypeError):
+            raise RequestError(400, 'JSON requests must be an object with a "path"')
+        if not isinstance(source, str):
+            raise RequestError(400, 'The "path" must be a string')
+        values.update((k, str(v) if not isinstance(v, bool) else str(int(v))) for k, v in request.items())
+    else:
+        if len(body) == 0:
+            raise RequestError(400, 'Empty request')
+        source = body
+
+    for name, value in values.items():
+        if name not in REQUEST_OPTIONS:
+            raise RequestError(400, 'Unknown option: ' + name)
+        options[name] = REQUEST_OPTIONS[name](value)
+
+    if options.get('errors', 'strict') not in ('strict', 'ignore', 'replace'):
+        raise RequestError(400, 'Unknown errors policy: ' + options['errors'])
+
+    return source, options
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    # Set by make_server
+    service = None
+    quiet = False
+
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, data):
+        body = (json.dumps(data, default=str) + '\n').encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/health':
+            self.send_json(200, self.service.health())
+        elif path == '/queue':
+            self.send_json(200, self.service.queue())
+        else:
+            self.send_json(404, {'error': 'Unknown endpoint: ' + path})
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_REQUEST_SIZE:
+            # The body is not read, the connection cannot be reused
+            self.close_connection = True
+            self.send_json(413 if length > 0 else 400, {'error': 'Invalid Content-Length'})
+            return
+        body = self.rfile.read(length)
+
+        try:
+            source, options = parse_request(url.path, url.query, self.headers.get('Content-Type', ''), body)
+        except RequestError as e:
+            self.send_json(e.status, {'error': str(e)})
+            return
+
+        if not self.service.acquire():
+            self.send_json(503, {'error': 'Too many pending requests'})
+            return
+        try:
+            result = self.service.process(source, options)
+        finally:
+            self.service.release()
+
+        self.send_json(200, result)
+
+    def address_string(self):
+        # Unix domain sockets have no client address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def server_bind(self):
+        # A socket left by a server that did not stop cleanly
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, quiet=False):
+
+    """
+    Returns the HTTP server of service (not started, see serve_forever),
+    listening on host:port or on the Unix domain socket socket_path
+    """
+
+    handler = type('ServiceRequestHandler', (RequestHandler,), {'service': service, 'quiet': quiet})
+
+    if socket_path is not None:
+        return UnixHTTPServer(socket_path, handler)
+
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
+
+
+def main(argv=None):
+
+    """
+    Command line entry point, serves until interrupted
+    """
+
+    parser = argparse.ArgumentParser(description='Serve annotations of MusicXML files from warm worker processes')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on')
+    parser.add_argument('--socket', default=None, help='listen on this Unix domain socket instead')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='requests accepted at once (defaults to %d per worker)' % PENDING_PER_WORKER)
+    parser.add_argument('--cache', default=None, help='SQLite cache of parsed sequences')
+    parser.add_argument('--cache-size', type=int, default=1 << 30, help='size cap of the cache in bytes')
+    parser.add_argument('--backend', default=None, choices=['etree', 'lxml', 'expat'],
+                        help='XML backend (defaults to lxml when installed)')
+    parser.add_argument('--timeout', type=float, default=None, help='time limit of each file in seconds')
+    parser.add_argument('--max-memory', type=int, default=None,
+                        help='memory (in MB) a worker may grow by while processing a file')
+    parser.add_argument('--quiet', action='store_true', help='do not log requests')
+    args = parser.parse_args(argv)
+
+    service = AnnotationService(args.workers, args.max_pending, args.cache, args.cache_size, args.backend,
+                                args.timeout, args.max_memory << 20 if args.max_memory is not None else None)
+    try:
+        server = make_server(service, args.host, args.port, args.socket, args.quiet)
+    except BaseException:
+        service.close()
+        raise
+
+    signal.signal(signal.SIGTERM, _terminate)
+
+    print('Serving on %s with %d workers' % (args.socket or '%s:%d' % server.server_address[:2], service.workers),
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+    return 0
@@ -0,0 +1,243 @@
+"""
+Sharded, resumable processing of a corpus: the files are split into
+shards by a hash of their path (so each machine can process its own
+shard without any coordination), the progress of a run is checkpointed
+next to its output so a restarted run resumes where it stopped, and
+the outputs of the shards are merged at the end
+
+The checkpoint of an output file (see checkpoint_path) has one JSON line
+per processed file: its path, content hash, status and the byte offset
+and length of its result in the output
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+
+from .cache import file_digest
+
+# The checkpoint and output files are synced to disk every that many files
+SYNC_INTERVAL = 256
+
+
+def shard_of(path, num_shards):
+
+    """
+    Returns the shard (0 to num_shards - 1) of a file, from a hash of its
+    path (stable across machines and runs, unlike the built-in hash)
+    """
+
+    digest = hashlib.sha1(os.fsencode(path)).digest()
+
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+
+def parse_shard(text):
+
+    """
+    Returns the (shard, number of shards) of an 'I/N' string (0 <= I < N)
+    """
+
+    try:
+        shard, num_shards = (int(x) for x in text.split('/'))
+    except ValueError:
+        raise ValueError('Shard must be written I/N, got ' + repr(text))
+
+    if not 0 <= shard < num_shards:
+        raise ValueError('Shard %d is not between 0 and %d' % (shard, num_shards - 1))
+
+    return shard, num_shards
+
+
+def checkpoint_path(output):
+    return os.fspath(output) + '.checkpoint.jsonl'
+
+
+def truncate(path, size):
+
+    """
+    Truncates a file to size bytes (if it is longer)
+    """
+
+    if os.path.getsize(path) > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+
+def read_checkpoint(path, output_size=None):
+
+    """
+    Returns the entries of a checkpoint (the last one of each file, in the
+    order they were written) and the length of its valid part (a run that
+    stopped while writing leaves a partial last line)
+
+    output_size: size of the output, entries from the first one pointing
+                 past it are invalid (the checkpoint may have reached the
+                 disk before the output when the machine stopped)
+    """
+
+    entries = {}
+    valid = 0
+
+    if not os.path.exists(path):
+        return entries, valid
+
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b'\n'):
+                break
+            if output_size is not None and entry['offset'] + entry['length'] > output_size:
+                break
+            entries.pop(entry['file'], None)
+            entries[entry['file']] = entry
+            valid += len(line)
+
+    return entries, valid
+
+
+class Checkpoint():
+
+    def __init__(self, output):
+
+        """
+        Opens the checkpoint of an output file (JSON lines), both are
+        brought back to the last file fully recorded, to be appended to
+
+        output: path of the output file
+        """
+
+        self.output_path = os.fspath(output)
+        self.path = checkpoint_path(output)
+        output_size = os.path.getsize(self.output_path) if os.path.exists(self.output_path) else 0
+        self.entries, valid = read_checkpoint(self.path, output_size)
+
+        # Results written after the last valid entry (or partially) are dropped,
+        # along with the entries of results missing from the output
+        end = max((e['offset'] + e['length'] for e in self.entries.values()), default=0)
+        if os.path.exists(self.path):
+            truncate(self.path, valid)
+        if os.path.exists(self.output_path):
+            truncate(self.output_path, end)
+
+        self.output = open(self.output_path, 'ab')
+        self.file = open(self.path, 'ab')
+        self.unsynced = 0
+
+    def done(self, verify=False):
+
+        """
+        Returns the set of files already processed
+
+        verify: leave out the files whose content changed since
+                (their content is hashed again)
+        """
+
+        if not verify:
+            return set(self.entries)
+
+        done = set()
+        for path, entry in self.entries.items():
+            try:
+                if file_digest(path) == entry['sha256']:
+                    done.add(path)
+            except OSError:
+                pass
+
+        return done
+
+    def write(self, result, sha256=None):
+
+        """
+        Appends the result of a file (a JSON serializable dict with the
+        'file' and 'status' keys) to the output and records it
+        """
+
+        line = (json.dumps(result, default=str) + '\n').encode('utf-8')
+        offset = self.output.tell()
+        self.output.write(line)
+        self.output.flush()
+
+        entry = {'file': result['file'], 'sha256': sha256, 'status': result['status'],
+                 'offset': offset, 'length': len(line)}
+        self.file.write((json.dumps(entry) + '\n').encode('utf-8'))
+        self.file.flush()
+        self.entries[entry['file']] = entry
+
+        # Both files are only synced every SYNC_INTERVAL files (the output first),
+        # entries left pointing past the output by a crash are dropped when reopened
+        self.unsynced += 1
+        if self.unsynced >= SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.output.fileno())
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.output.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def merge_outputs(outputs, merged):
+
+    """
+    Writes the results of several outputs (eg. one per shard) to a single
+    file. Outputs with a checkpoint only contribute the last result of
+    each file they recorded, those without one are copied as they are.
+
+    outputs: paths of the output files
+    merged: path of the merged file
+    Returns the number of results written.
+    """
+
+    count = 0
+
+    with open(merged, 'wb') as out:
+        for output in outputs:
+
+            entries, _ = read_checkpoint(checkpoint_path(output), os.path.getsize(output))
+
+            with open(output, 'rb') as f:
+                if len(entries) == 0 and not os.path.exists(checkpoint_path(output)):
+                    for line in f:
+                        out.write(line)
+                        count += 1
+                    continue
+
+                for entry in sorted(entries.values(), key=lambda e: e['offset']):
+                    f.seek(entry['offset'])
+                    out.write(f.read(entry['length']))
+                    count += 1
+
+    return count
+
+
+def main(argv=None):
+
+    """
+    Command line entry point merging the outputs of the shards of a run
+    """
+
+    parser = argparse.ArgumentParser(description='Merge the outputs of the shards of a batch run')
+    parser.add_argument('outputs', nargs='+', help='output files of the shards (JSON lines)')
+    parser.add_argument('-o', '--output', required=True, help='merged output file')
+    args = parser.parse_args(argv)
+
+    count = merge_outputs(args.outputs, args.output)
+    print('Merged %d results from %d outputs' % (count, len(args.outputs)), file=sys.stderr)
+
+    return 0
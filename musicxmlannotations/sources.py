@@ -0,0 +1,203 @@
+"""
+Opens the documents MusicXML can be read from: paths of plain
+(.musicxml, .xml) or compressed (.mxl) files, bytes/memoryviews
+holding either, or binary file objects
+
+Documents are always read as bytes, so the XML parser applies their
+encoding declaration
+"""
+
+import io
+import os
+import re
+import mmap
+import codecs
+import zipfile
+import contextlib
+import xml.etree.ElementTree as ET
+
+# Manifest of a compressed MusicXML file, listing its root file
+MXL_CONTAINER = 'META-INF/container.xml'
+
+# First bytes of a zip archive
+ZIP_MAGIC = b'PK\x03\x04'
+
+# Errors raised when opening an invalid document
+SOURCE_ERRORS = (zipfile.BadZipFile,)
+
+# Plain files from this size on are memory-mapped instead of read
+MMAP_THRESHOLD = 1 << 20
+
+# Decoding errors policies: 'strict' hands the bytes to the parser as they
+# are (badly encoded documents are invalid), the others decode them leniently
+ERRORS_POLICIES = ('strict', 'ignore', 'replace')
+
+# Byte order marks and the encoding they stand for
+BOMS = [(codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+        (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16')]
+
+# Encoding of an XML declaration
+ENCODING_PATTERN = re.compile(r'''(<\?xml[^>]*?encoding\s*=\s*["'])([A-Za-z][A-Za-z0-9._-]*)(["'])''')
+
+# Bytes read to find the encoding of a document
+HEAD_SIZE = 1024
+
+
+def is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def is_buffer(source):
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+
+def source_name(source):
+
+    """
+    Returns a printable name of source (for error messages)
+    """
+
+    if is_path(source):
+        return os.fspath(source)
+    if is_buffer(source):
+        return '<%d bytes>' % len(source)
+
+    return str(getattr(source, 'name', '<stream>'))
+
+
+def can_reread(source):
+
+    """
+    Returns whether source can be read more than once
+    (paths, buffers and seekable file objects)
+    """
+
+    return is_path(source) or is_buffer(source) or source.seekable()
+
+
+def mxl_root_file(archive):
+
+    """
+    Returns the name of the MusicXML document of a compressed
+    MusicXML archive: the first root file of its container manifest,
+    or its only .xml/.musicxml file if the manifest is missing
+
+    archive: zipfile.ZipFile
+    """
+
+    names = archive.namelist()
+
+    if MXL_CONTAINER in names:
+        container = ET.fromstring(archive.read(MXL_CONTAINER))
+        for elem in container.iter():
+            if elem.tag.rsplit('}', 1)[-1] == 'rootfile' and elem.get('full-path'):
+                return elem.get('full-path')
+
+    documents = [n for n in names if n.lower().endswith(('.xml', '.musicxml')) and not n.startswith('META-INF/')]
+    if len(documents) == 1:
+        return documents[0]
+
+    raise zipfile.BadZipFile('Compressed MusicXML without a root file')
+
+
+def detect_encoding(head):
+
+    """
+    Returns the encoding of a document from its first bytes: its byte
+    order mark, or else its XML declaration (UTF-8 if it has neither)
+    """
+
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+
+    match = ENCODING_PATTERN.search(head.decode('latin-1'))
+    if match is not None:
+        try:
+            return codecs.lookup(match.group(2)).name
+        except LookupError:
+            pass
+
+    return 'utf-8'
+
+
+class LenientReader():
+
+    """
+    Binary file object decoding a document with a lenient errors policy
+    and re-encoding it as UTF-8 (with its XML declaration changed to match)
+    """
+
+    def __init__(self, f, errors):
+        self.f = f
+        self.errors = errors
+        self.pending = b''
+
+        head = f.read(HEAD_SIZE)
+        self.decoder = codecs.getincrementaldecoder(detect_encoding(head))(errors)
+
+        text = ENCODING_PATTERN.sub(r'\g<1>UTF-8\g<3>', self.decoder.decode(head), count=1)
+        self.pending = text.encode('utf-8')
+        self.done = len(head) == 0
+
+    def read(self, size=-1):
+        while not self.done and (size < 0 or len(self.pending) < size):
+            chunk = self.f.read(size if size > 0 else io.DEFAULT_BUFFER_SIZE)
+            self.done = len(chunk) == 0
+            self.pending += self.decoder.decode(chunk, self.done).encode('utf-8')
+
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+
+        return data
+
+
+@contextlib.contextmanager
+def open_source(source, errors='strict'):
+
+    """
+    Opens the MusicXML document of source, decompressing it on the fly
+    if it is compressed (.mxl), and yields it as a binary file object
+    (large plain files are memory-mapped)
+
+    source: path, bytes-like object or binary file object (read from its
+            current position)
+    errors: decoding errors policy (see ERRORS_POLICIES)
+
+    Raises zipfile.BadZipFile for an invalid compressed file.
+    """
+
+    if errors not in ERRORS_POLICIES:
+        raise ValueError('Unknown decoding errors policy: ' + str(errors))
+
+    with contextlib.ExitStack() as stack:
+
+        if is_path(source):
+            f = stack.enter_context(open(source, 'rb'))
+        elif is_buffer(source):
+            f = io.BytesIO(source)
+        elif isinstance(source, io.TextIOBase):
+            raise TypeError('MusicXML file object must be opened in binary mode')
+        elif not source.seekable():
+            # Zip archives are read from their end, so the start of the stream is not enough
+            f = io.BytesIO(source.read())
+        else:
+            f = source
+
+        start = f.tell()
+        magic = f.read(len(ZIP_MAGIC))
+        f.seek(start)
+
+        if magic == ZIP_MAGIC:
+            # Compressed MusicXML, stream the root file out of the archive
+            archive = stack.enter_context(zipfile.ZipFile(f))
+            f = stack.enter_context(archive.open(mxl_root_file(archive)))
+
+        elif is_path(source) and os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            f = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+        if errors != 'strict':
+            f = LenientReader(f, errors)
+
+        yield f
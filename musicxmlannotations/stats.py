@@ -0,0 +1,107 @@
+"""
+Opt-in instrumentation of the parsing/annotation stages
+(wall time and number of calls of each stage, plus counters)
+"""
+
+import time
+import collections
+import contextlib
+
+
+class ParseStats():
+
+    def __init__(self):
+
+        """
+        Creates empty statistics, pass the object to MusicXML or
+        gen_annotations to record into it
+        """
+
+        # Wall time (in seconds) and number of calls of each stage
+        self.times = collections.defaultdict(float)
+        self.calls = collections.Counter()
+
+        # Counts of things read (measures, pages, skipped multirest measures, ...)
+        self.counts = collections.Counter()
+
+    def add(self, stage, seconds):
+
+        """
+        Records one call of a stage that took seconds
+        """
+
+        self.times[stage] += seconds
+        self.calls[stage] += 1
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    @contextlib.contextmanager
+    def stage(self, name):
+
+        """
+        Context manager recording the wall time of its block as a call of stage name
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def timed_iter(self, name, iterable):
+
+        """
+        Iterates over iterable, recording the time spent producing
+        each item (eg. XML parsing of the events) as stage name
+        """
+
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - start)
+                return
+            self.add(name, time.perf_counter() - start)
+            yield item
+
+    def merge(self, other):
+
+        """
+        Adds the statistics of other (ParseStats or as_dict() output) to these
+        """
+
+        if isinstance(other, ParseStats):
+            other = other.as_dict()
+
+        for stage, values in other['stages'].items():
+            self.times[stage] += values['seconds']
+            self.calls[stage] += values['calls']
+        self.counts.update(other['counts'])
+
+    def as_dict(self):
+
+        """
+        Returns the statistics as plain dicts (JSON/pickle friendly)
+        """
+
+        return {
+            'stages': {s: {'seconds': self.times[s], 'calls': self.calls[s]} for s in self.times},
+            'counts': dict(self.counts),
+        }
+
+    def report(self):
+
+        """
+        Returns a readable table of the statistics, slowest stages first
+        """
+
+        lines = ['%-32s %12s %10s' % ('stage', 'seconds', 'calls')]
+        for stage in sorted(self.times, key=lambda s: -self.times[s]):
+            lines.append('%-32s %12.4f %10d' % (stage, self.times[stage], self.calls[stage]))
+        for name in sorted(self.counts):
+            lines.append('%-32s %23d' % (name, self.counts[name]))
+
+        return '\n'.join(lines)
@@ -0,0 +1,60 @@
+"""
+Computes exact onset times of the bars of a score
+from the lengths recorded by the parser
+"""
+
+import collections
+from fractions import Fraction
+
+import numpy as np
+
+# Length of a bar as read by the parser
+#   beats, beat_type: time signature of the bar
+#   divisions: divisions per quarter note
+#   duration: length of the bar's content in divisions (0 if no content was read)
+#   measures: number of measures the bar stands for (> 1 for multirests)
+Bar = collections.namedtuple('Bar', ['beats', 'beat_type', 'divisions', 'duration', 'measures'])
+
+
+def bar_onsets(bars):
+
+    """
+    Returns the onset of each bar, followed by the end of the last one,
+    in whole notes, as an array of numerators over a common denominator
+    (the times are exact, onset i is Fraction(onsets[i], denominator))
+
+    Bars with content take their length from the durations read, so
+    pickups and incomplete bars are handled. Bars without content
+    (eg. multirests) take the length of their time signature.
+
+    bars: list of Bar
+    """
+
+    if len(bars) == 0:
+        return np.zeros(1, dtype=np.int64), 1
+
+    beats, beat_type, divisions, duration, measures = np.array(bars, dtype=np.int64).T
+
+    # Length of each bar as a fraction num/den of a whole note
+    has_duration = (duration > 0) & (divisions > 0)
+    num = np.where(has_duration, duration, beats * measures)
+    den = np.where(has_duration, 4 * divisions, beat_type)
+
+    # Bring every length to a common denominator and accumulate
+    denominator = int(np.lcm.reduce(den))
+    lengths = num * (denominator // den)
+    onsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    return onsets, denominator
+
+
+def bar_onset_fractions(bars):
+
+    """
+    Returns the onset of each bar, followed by the end of the
+    last one, as Fractions of a whole note
+    """
+
+    onsets, denominator = bar_onsets(bars)
+
+    return [Fraction(int(o), denominator) for o in onsets]
@@ -0,0 +1,96 @@
+"""
+Structured tokens produced by the parser for each staff,
+along with the serializer to the space/plus-delimited string format
+"""
+
+# Kinds of token
+NOTE = 'note'
+REST = 'rest'
+FORWARD = 'forward'         # Note that is not printed (print-object="no")
+CLEF = 'clef'
+KEY = 'key'
+TIME = 'time'
+MULTIREST = 'multirest'
+DIRECTION = 'direction'
+BARLINE = 'barline'
+
+# Separators written in front of a token in the string format
+# (no separator means the token sounds together with the previous one, ie. a chord)
+NO_ADVANCE = ''
+ADVANCE = '+ '              # Notes and attributes
+SPACED_ADVANCE = ' + '      # Directions and barlines
+
+
+class Token:
+
+    """
+    Single symbol of a staff
+
+    kind: kind of token (NOTE, REST, CLEF, ...)
+    symbol: symbol as written in the string format (eg. 'note-C#4_quarter.')
+    sep: separator written in front of the symbol
+    end: text written after the symbol (a space, except for malformed notes)
+    staff: index of the staff the token belongs to
+    pitch: pitch and octave of a note (eg. 'C#4')
+    duration: duration type of a note or rest (eg. 'quarter', 'sixteenth')
+    dot: whether the note or rest is dotted
+    onset: position of the token in its measure, in divisions (notes of a
+           chord share their onset, barlines are at the end of the measure)
+    length: sounding duration of a note or rest, in divisions (0 for grace
+            notes and for the other kinds of token)
+    """
+
+    __slots__ = ('kind', 'symbol', 'sep', 'end', 'staff', 'pitch', 'duration', 'dot', 'onset', 'length')
+
+    def __init__(self, kind, symbol, sep=NO_ADVANCE, end=' ', staff=0, pitch=None, duration=None, dot=False,
+                 onset=0, length=0):
+        self.kind = kind
+        self.symbol = symbol
+        self.sep = sep
+        self.end = end
+        self.staff = staff
+        self.pitch = pitch
+        self.duration = duration
+        self.dot = dot
+        self.onset = onset
+        self.length = length
+
+    def copy(self, sep, staff):
+
+        """
+        Returns the same token with another separator/staff
+        """
+
+        return Token(self.kind, self.symbol, sep, self.end, staff, self.pitch, self.duration, self.dot,
+                     self.onset, self.length)
+
+    def fields(self):
+
+        """
+        Returns the values of the fields of the token, in the order
+        of the arguments of Token (lighter to store than the token)
+        """
+
+        return (self.kind, self.symbol, self.sep, self.end, self.staff, self.pitch, self.duration, self.dot,
+                self.onset, self.length)
+
+    def __eq__(self, other):
+        if not isinstance(other, Token):
+            return NotImplemented
+        return all(getattr(self, s) == getattr(other, s) for s in Token.__slots__)
+
+    def __str__(self):
+        return self.sep + self.symbol + self.end
+
+    def __repr__(self):
+        return 'Token(%r, %r)' % (self.kind, str(self))
+
+
+def serialize(tokens):
+
+    """
+    Converts the tokens of a staff to the string format
+    (eg. 'clef-G2 + keySignature-CM + note-C4_quarter note-E4_quarter + barline ')
+    """
+
+    return ''.join([t.sep + t.symbol + t.end for t in tokens])
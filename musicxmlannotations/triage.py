@@ -0,0 +1,227 @@
+"""
+Cheap pre-scan deciding whether a score can be annotated before it is
+parsed: its header and the first attributes of its first part are read
+with expat (no tree is built) and the scan stops as soon as they are
+known, so rejecting a file costs a few kilobytes of reading
+
+The reasons a score is rejected are shared with the parser, which stops
+reading a part when it finds the same problems further in a score
+(recording the reason in MusicXML.rejected), gen_annotations then raises
+ScoreRejected
+"""
+
+import collections
+from xml.parsers import expat
+
+from .sources import open_source, SOURCE_ERRORS
+
+# Reasons a score is rejected
+REJECT_UNREADABLE = 'unreadable'                # Invalid compressed file
+REJECT_MALFORMED = 'malformed'                  # Not well-formed XML (in the part scanned)
+REJECT_MISSING_DEFAULTS = 'missing-defaults'    # No <defaults> (page layout) before the first part
+REJECT_MISSING_PART_LIST = 'missing-part-list'  # No <part-list> before the first part
+REJECT_MISSING_PART = 'missing-part'            # No <part> (or not a partwise score)
+REJECT_PERCUSSION = 'percussion'                # Percussion clef
+REJECT_TAB = 'tab'                              # Guitar tablature clef
+REJECT_COMPOUND_TIME = 'compound-time'          # Time signature that is not a number of beats (eg. 2+2+3)
+REJECT_INVALID_KEY = 'invalid-key'              # Key signature that is not a number of sharps/flats
+
+# Outcome of the triage of a score: reason is None if it is kept
+#   reason: one of the REJECT_* reasons
+#   detail: text the reason was found in (eg. '2+2+3'), or None
+TriageResult = collections.namedtuple('TriageResult', ['reason', 'detail'])
+
+# Score that is kept
+KEEP = TriageResult(None, None)
+
+# Size of the chunks fed to the scanner (the header usually fits in one)
+CHUNK_SIZE = 1 << 14
+
+
+class ScoreRejected(ValueError):
+
+    """
+    Raised by the parser when a score cannot be annotated
+
+    reason: one of the REJECT_* reasons
+    detail: text the reason was found in, or None
+    """
+
+    def __init__(self, reason, detail=None):
+        super().__init__(reason if detail is None else '%s (%s)' % (reason, detail))
+        self.reason = reason
+        self.detail = detail
+
+
+def check_clef(sign):
+
+    """
+    Raises ScoreRejected for a clef sign (of the first staff) that cannot be annotated
+    """
+
+    if sign is None:
+        return
+    if 'percussion' in sign:
+        raise ScoreRejected(REJECT_PERCUSSION, sign)
+    if 'TAB' in sign:
+        raise ScoreRejected(REJECT_TAB, sign)
+
+
+def parse_fifths(text):
+
+    """
+    Returns the number of sharps (> 0) or flats (< 0) of a key signature,
+    raises ScoreRejected if it is not a valid one
+    """
+
+    try:
+        fifths = int(text)
+    except (TypeError, ValueError):
+        raise ScoreRejected(REJECT_INVALID_KEY, text)
+
+    if not -7 <= fifths <= 7:
+        raise ScoreRejected(REJECT_INVALID_KEY, text)
+
+    return fifths
+
+
+def parse_time(beats, beat_type):
+
+    """
+    Returns the (beats, beat type) of a time signature,
+    raises ScoreRejected if they are not plain numbers
+    """
+
+    try:
+        return int(beats), int(beat_type)
+    except (TypeError, ValueError):
+        raise ScoreRejected(REJECT_COMPOUND_TIME, '%s/%s' % (beats, beat_type))
+
+
+class _Done(Exception):
+    # Stops the scan once the decision is made
+    pass
+
+
+def triage(source, errors='strict', all_parts=False):
+
+    """
+    Returns the TriageResult of a score, reading as little of it as possible
+
+    The header must hold <defaults> and <part-list> before the first part,
+    then the clefs, key and time signature of the first <attributes> of
+    the first part are checked (a percussion clef met later is still
+    handled by the parser).
+
+    source: path, bytes-like object or binary file object (see sources.open_source,
+            file objects are consumed)
+    errors: decoding errors policy (see sources.ERRORS_POLICIES)
+    all_parts: only check the header, as the other parts of a score
+               can be annotated whatever its first part holds
+    """
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+
+    # Elements opened, header elements met, first attributes read so far
+    stack = []
+    header = set()
+    attributes = {'clefs': [], 'key': None, 'time': None}
+    state = {'part': False, 'attributes': False, 'text': None, 'clef': None}
+
+    def start_element(tag, attrib):
+        depth = len(stack)
+        stack.append(tag)
+
+        if depth == 1:
+            if tag != 'part':
+                header.add(tag)
+                return
+            if 'defaults' not in header:
+                raise ScoreRejected(REJECT_MISSING_DEFAULTS)
+            if 'part-list' not in header:
+                raise ScoreRejected(REJECT_MISSING_PART_LIST)
+            state['part'] = True
+            if all_parts:
+                raise _Done()
+
+        elif state['attributes']:
+            if tag == 'clef':
+                state['clef'] = {'number': attrib.get('number', '1')}
+                attributes['clefs'].append(state['clef'])
+            elif tag == 'key':
+                attributes['key'] = {}
+            elif tag == 'time':
+                attributes['time'] = {}
+            state['text'] = []
+
+        elif depth == 3 and state['part'] and tag == 'attributes':
+            state['attributes'] = True
+
+    def end_element(tag):
+        stack.pop()
+        depth = len(stack)
+
+        if state['attributes']:
+            if depth == 3:
+                raise _Done()
+
+            text = ''.join(state['text'] or ())
+            state['text'] = None
+            parent = stack[-1]
+
+            if parent == 'clef' and tag == 'sign':
+                state['clef']['sign'] = text
+            elif parent == 'key' and tag == 'fifths' and 'fifths' not in attributes['key']:
+                attributes['key']['fifths'] = text
+            elif parent == 'time' and tag in ('beats', 'beat-type') and tag not in attributes['time']:
+                attributes['time'][tag] = text
+
+        # End of the first part (or of the score) without attributes
+        elif depth == 1 and state['part']:
+            raise _Done()
+
+    def character_data(data):
+        if state['text'] is not None:
+            state['text'].append(data)
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+
+    try:
+        with open_source(source, errors) as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                parser.Parse(chunk, len(chunk) == 0)
+                if len(chunk) == 0:
+                    break
+    except _Done:
+        pass
+    except ScoreRejected as e:
+        return TriageResult(e.reason, e.detail)
+    except expat.ExpatError as e:
+        return TriageResult(REJECT_MALFORMED, str(e))
+    except SOURCE_ERRORS as e:
+        return TriageResult(REJECT_UNREADABLE, str(e))
+
+    if not state['part']:
+        if 'defaults' not in header:
+            return TriageResult(REJECT_MISSING_DEFAULTS, None)
+        if 'part-list' not in header:
+            return TriageResult(REJECT_MISSING_PART_LIST, None)
+        return TriageResult(REJECT_MISSING_PART, None)
+
+    # Same checks as the parser on the first attributes
+    try:
+        for clef in attributes['clefs']:
+            if clef['number'] == '1':
+                check_clef(clef.get('sign'))
+        if attributes['key'] is not None:
+            parse_fifths(attributes['key'].get('fifths'))
+        if attributes['time'] is not None:
+            parse_time(attributes['time'].get('beats'), attributes['time'].get('beat-type'))
+    except ScoreRejected as e:
+        return TriageResult(e.reason, e.detail)
+
+    return KEEP
@@ -0,0 +1,300 @@
+"""
+Integer vocabulary of the symbols of the sequences and annotations,
+encoding them as int32 NumPy arrays (with the offsets of their pages
+and bars) and writing them to memory-mapped .npy shards
+
+A staff is encoded as one word per token (its symbol), preceded by
+ADVANCE_SYMBOL when the token advances in time, so '+' separators are
+symbols of their own
+"""
+
+import os
+import json
+import collections
+
+import numpy as np
+
+# Version of the vocabulary file format
+VOCAB_VERSION = 1
+
+# Symbols every vocabulary starts with (their ids are fixed)
+PAD, UNK, ADVANCE_SYMBOL, BARLINE_SYMBOL = '<pad>', '<unk>', '+', 'barline'
+SPECIAL_SYMBOLS = (PAD, UNK, ADVANCE_SYMBOL, BARLINE_SYMBOL)
+PAD_ID, UNK_ID, ADVANCE_ID, BARLINE_ID = range(len(SPECIAL_SYMBOLS))
+
+# Token ids of a staff (int32), with the offsets in ids where each page starts
+# (followed by the end of the last one) and where each bar ends (preceded by 0)
+StaffArrays = collections.namedtuple('StaffArrays', ['ids', 'page_offsets', 'bar_offsets'])
+
+
+class Vocabulary():
+
+    """
+    Mapping between symbols and integer ids
+
+    A vocabulary grows as sequences are encoded (or added) until it is
+    frozen, then unknown symbols are encoded as UNK_ID.
+    """
+
+    def __init__(self, symbols=(), frozen=False):
+
+        """
+        symbols: symbols following the special ones, in id order
+        frozen: whether new symbols are rejected
+        """
+
+        self.symbols = []
+        self.ids = {}
+        self.frozen = False
+
+        for symbol in SPECIAL_SYMBOLS:
+            self.add(symbol)
+        for symbol in symbols:
+            self.add(symbol)
+
+        self.frozen = frozen
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        return symbol in self.ids
+
+    def __getitem__(self, symbol):
+        return self.ids.get(symbol, UNK_ID)
+
+    def add(self, symbol):
+
+        """
+        Returns the id of symbol, adding it if it is new
+
+        Raises ValueError for a new symbol if the vocabulary is frozen.
+        """
+
+        i = self.ids.get(symbol)
+        if i is None:
+            if self.frozen:
+                raise ValueError('Symbol not in the frozen vocabulary: ' + symbol)
+            i = len(self.symbols)
+            self.ids[symbol] = i
+            self.symbols.append(symbol)
+
+        return i
+
+    def freeze(self):
+        self.frozen = True
+        return self
+
+    def encode(self, words):
+
+        """
+        Returns the ids of words as an int32 array, adding the
+        new ones unless the vocabulary is frozen
+        """
+
+        if self.frozen:
+            get = self.ids.get
+            ids = [get(w, UNK_ID) for w in words]
+        else:
+            add = self.add
+            ids = [add(w) for w in words]
+
+        return np.array(ids, dtype=np.int32)
+
+    def decode(self, ids):
+
+        """
+        Returns the symbols of a sequence of ids
+        """
+
+        symbols = self.symbols
+        return [symbols[i] for i in ids]
+
+    def add_sequences(self, sequences):
+
+        """
+        Adds the symbols of sequences (as returned by MusicXML.get_sequences,
+        with strings or tokens)
+        """
+
+        for page in sequences:
+            for staff in page:
+                self.encode(staff_words(staff))
+
+    def add_annotations(self, bars):
+
+        """
+        Adds the symbols of annotations (as returned by gen_annotations
+        without times: the annotations of each bar)
+        """
+
+        for bar in bars:
+            self.encode(bar)
+
+    def save(self, path):
+
+        """
+        Writes the vocabulary as JSON
+        """
+
+        with open(path, 'w') as f:
+            json.dump({'version': VOCAB_VERSION, 'frozen': self.frozen,
+                       'symbols': self.symbols[len(SPECIAL_SYMBOLS):]}, f)
+
+    @classmethod
+    def load(cls, path):
+
+        """
+        Reads a vocabulary written by save
+        """
+
+        with open(path, 'r') as f:
+            data = json.load(f)
+
+        if data.get('version') != VOCAB_VERSION:
+            raise ValueError('Unsupported vocabulary version: ' + str(data.get('version')))
+
+        return cls(data['symbols'], frozen=data['frozen'])
+
+
+def staff_words(staff):
+
+    """
+    Returns the words of a staff of one page: the symbol of each token,
+    preceded by ADVANCE_SYMBOL when its separator is an advance (a staff
+    in the string format is split on whitespace)
+    """
+
+    if isinstance(staff, str):
+        return staff.split()
+
+    words = []
+    for t in staff:
+        if ADVANCE_SYMBOL in t.sep:
+            words.append(ADVANCE_SYMBOL)
+        words.append(t.symbol)
+
+    return words
+
+
+def encode_sequences(sequences, vocab):
+
+    """
+    Returns the StaffArrays of each staff of sequences (as returned by
+    MusicXML.get_sequences, with strings or tokens), the pages of a
+    staff being concatenated
+
+    vocab: Vocabulary (new symbols are added to it unless it is frozen)
+    """
+
+    num_staves = len(sequences[0]) if len(sequences) > 0 else 0
+
+    arrays = []
+    for s in range(num_staves):
+        pages = [vocab.encode(staff_words(page[s])) for page in sequences]
+        ids = np.concatenate(pages) if len(pages) > 0 else np.zeros(0, dtype=np.int32)
+
+        page_offsets = np.zeros(len(pages) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in pages], out=page_offsets[1:])
+
+        # Bars end right after their barline
+        bar_offsets = np.concatenate(([0], np.flatnonzero(ids == BARLINE_ID) + 1))
+
+        arrays.append(StaffArrays(ids, page_offsets, bar_offsets))
+
+    return arrays
+
+
+def encode_annotations(bars, vocab):
+
+    """
+    Returns the ids of annotations (as returned by gen_annotations
+    without times) and the offsets where each bar ends preceded by 0
+
+    vocab: Vocabulary (new symbols are added to it unless it is frozen)
+    """
+
+    ids = vocab.encode([a for bar in bars for a in bar])
+
+    bar_offsets = np.zeros(len(bars) + 1, dtype=np.int64)
+    np.cumsum([len(bar) for bar in bars], out=bar_offsets[1:])
+
+    return ids, bar_offsets
+
+
+def shard_offsets_path(path):
+
+    """
+    Returns the path of the offsets file of the shard at path
+    """
+
+    root, ext = os.path.splitext(os.fspath(path))
+    return root + '.offsets.npz'
+
+
+def write_shard(path, records):
+
+    """
+    Writes StaffArrays to a shard: their ids concatenated in a single
+    int32 .npy file (written through a memory map) and their page and
+    bar offsets next to it (see shard_offsets_path)
+
+    path: path of the .npy file
+    records: list of StaffArrays
+    """
+
+    records = list(records)
+    total = sum(len(r.ids) for r in records)
+
+    ids = np.lib.format.open_memmap(path, mode='w+', dtype=np.int32, shape=(total,))
+
+    # Offsets of every record (rebased on its start in the shard), record i
+    # has the offsets between record_pages[i] and record_pages[i + 1]
+    page_offsets, bar_offsets = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+    record_pages = np.zeros(len(records) + 1, dtype=np.int64)
+    record_bars = np.zeros(len(records) + 1, dtype=np.int64)
+
+    start = 0
+    for i, r in enumerate(records):
+        ids[start:start + len(r.ids)] = r.ids
+        page_offsets.append(np.asarray(r.page_offsets, dtype=np.int64) + start)
+        bar_offsets.append(np.asarray(r.bar_offsets, dtype=np.int64) + start)
+        record_pages[i + 1] = record_pages[i] + len(r.page_offsets)
+        record_bars[i + 1] = record_bars[i] + len(r.bar_offsets)
+        start += len(r.ids)
+
+    ids.flush()
+    del ids
+
+    np.savez(shard_offsets_path(path), page_offsets=np.concatenate(page_offsets),
+             bar_offsets=np.concatenate(bar_offsets), record_pages=record_pages, record_bars=record_bars)
+
+
+class Shard():
+
+    """
+    Shard written by write_shard, its ids are memory-mapped (read only)
+    and shard[i] returns the StaffArrays of record i (its ids being a view)
+    """
+
+    def __init__(self, path):
+        self.ids = np.load(path, mmap_mode='r')
+
+        with np.load(shard_offsets_path(path)) as offsets:
+            self.page_offsets = offsets['page_offsets']
+            self.bar_offsets = offsets['bar_offsets']
+            self.record_pages = offsets['record_pages']
+            self.record_bars = offsets['record_bars']
+
+    def __len__(self):
+        return len(self.record_pages) - 1
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self):
+            raise IndexError('Shard record out of range: ' + str(i))
+
+        page_offsets = self.page_offsets[self.record_pages[i]:self.record_pages[i + 1]]
+        bar_offsets = self.bar_offsets[self.record_bars[i]:self.record_bars[i + 1]]
+        start, end = page_offsets[0], page_offsets[-1]
+
+        return StaffArrays(self.ids[start:end], page_offsets - start, bar_offsets - start)
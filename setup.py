@@ -7,4 +7,19 @@ setuptools.setup(
     author="Me",
     description="",
     packages=["musicxmlannotations"],
-)
\ No newline at end of file
+    install_requires=["numpy"],
+    extras_require={
+        "lxml": ["lxml"],
+        "parquet": ["pyarrow"],
+    },
+    entry_points={
+        "console_scripts": [
+            "musicxmlannotations=musicxmlannotations.batch:main",
+            "musicxmlannotations-merge=musicxmlannotations.shards:main",
+            "musicxmlannotations-server=musicxmlannotations.server:main",
+            "musicxmlannotations-client=musicxmlannotations.client:main",
+            "musicxmlannotations-export=musicxmlannotations.export:main",
+            "musicxmlannotations-search=musicxmlannotations.search:main",
+        ],
+    },
+)
@@ -0,0 +1,94 @@
+"""
+Incremental parsing: after measures are inserted or removed, the
+sequences match a full parse and the unchanged measures are reused
+"""
+
+import re
+
+from benchmarks.synthetic import generate_score
+from musicxmlannotations.musicxml import MusicXML
+
+MEASURE = re.compile(rb'<measure .*?</measure>\s*', re.DOTALL)
+
+
+def write_score(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def read_incremental(path):
+
+    """
+    Checks the incremental sequences of a score against get_sequences,
+    returns the MusicXML object (with its measures_read/reused counts)
+    """
+
+    expected = MusicXML(path).get_sequences(tokens=True)
+
+    musicxml = MusicXML(path)
+    sequences = musicxml.get_sequences_incremental(tokens=True)
+    assert [[[t.fields() for t in s] for s in page] for page in sequences] \
+        == [[[t.fields() for t in s] for s in page] for page in expected]
+
+    return musicxml
+
+
+def edit_measures(data, edit):
+
+    """
+    Returns the bytes of a score with its list of measure byte strings
+    replaced by edit(measures)
+    """
+
+    spans = [m.span() for m in MEASURE.finditer(data)]
+    measures = [data[a:b] for a, b in spans]
+    return data[:spans[0][0]] + b''.join(edit(measures)) + data[spans[-1][1]:]
+
+
+def test_insert_measure(tmp_path):
+    path = tmp_path / 'score.musicxml'
+    data = generate_score(7, measures=40, page_breaks=0.1)
+    write_score(path, data)
+
+    first = read_incremental(path)
+    assert first.measures_reused == 0
+
+    write_score(path, edit_measures(data, lambda m: m[:20] + [m[25]] + m[20:]))
+    musicxml = read_incremental(path)
+    assert musicxml.measures_read > 0
+    assert musicxml.measures_reused >= 20
+
+
+def test_remove_measure(tmp_path):
+    path = tmp_path / 'score.musicxml'
+    data = generate_score(8, measures=40, page_breaks=0.1)
+    write_score(path, data)
+    read_incremental(path)
+
+    write_score(path, edit_measures(data, lambda m: m[:20] + m[21:]))
+    musicxml = read_incremental(path)
+    assert musicxml.measures_reused >= 20
+
+
+def test_unchanged_score(tmp_path):
+    path = tmp_path / 'score.musicxml'
+    write_score(path, generate_score(9, measures=30))
+    read_incremental(path)
+
+    musicxml = read_incremental(path)
+    assert musicxml.measures_read == 0
+    assert musicxml.measures_reused == 30
+
+
+def test_repeated_edits(tmp_path):
+    path = tmp_path / 'score.musicxml'
+    data = generate_score(10, measures=30, page_breaks=0.2)
+    write_score(path, data)
+    read_incremental(path)
+
+    # Measures moved around (the first one, declaring the staves, is kept),
+    # each edit compared with a full parse
+    for edit in (lambda m: m[:5] + m[6:], lambda m: m[:10] + m[2:4] + m[10:], lambda m: m[:1] + m[2:] + m[1:2]):
+        data = edit_measures(data, edit)
+        write_score(path, data)
+        read_incremental(path)
@@ -0,0 +1,78 @@
+"""
+Measure offset index: pages read through the index match a full parse,
+and the sidecar is rebuilt once the score changes
+"""
+
+import os
+
+from benchmarks.synthetic import generate_score
+from musicxmlannotations.musicxml import MusicXML
+from musicxmlannotations.index import index_path, file_stamp, load_index
+
+
+def write_score(path, seed, measures):
+    with open(path, 'wb') as f:
+        f.write(generate_score(seed, measures=measures, page_breaks=0.2))
+
+
+def check_pages(path):
+
+    """
+    Checks every page read through the index against get_sequences
+    and returns the index
+    """
+
+    sequences = MusicXML(path).get_sequences()
+    index = MusicXML(path).get_index()
+
+    assert index['num_pages'] == len(sequences)
+    for n in range(index['num_pages']):
+        assert MusicXML(path).get_page(n) == sequences[n]
+
+    return index
+
+
+def test_index_matches_full_parse(tmp_path):
+    path = tmp_path / 'score.musicxml'
+    write_score(path, 1, 40)
+
+    index = check_pages(path)
+
+    assert os.path.exists(index_path(path))
+    assert load_index(index_path(path), path) == index
+
+
+def test_index_rebuilt_after_change(tmp_path):
+    path = tmp_path / 'score.musicxml'
+    write_score(path, 1, 40)
+    before = check_pages(path)
+
+    # Another score of a different length, with a later modification time
+    write_score(path, 2, 55)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, before['stamp'][1] + 10 ** 9))
+
+    assert load_index(index_path(path), path) is None
+
+    after = check_pages(path)
+    assert after['stamp'] == file_stamp(path)
+    assert len(after['measures']) == 55
+    assert load_index(index_path(path), path) == after
+
+
+def test_index_rebuilt_after_same_size_change(tmp_path):
+    path = tmp_path / 'score.musicxml'
+    write_score(path, 3, 30)
+    before = check_pages(path)
+
+    # Same size, different content: only the modification time tells them apart
+    with open(path, 'r+b') as f:
+        data = f.read()
+        f.seek(0)
+        f.write(data.replace(b'<step>C</step>', b'<step>D</step>'))
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, before['stamp'][1] + 10 ** 9))
+    assert os.path.getsize(path) == before['stamp'][0]
+
+    assert load_index(index_path(path), path) is None
+    check_pages(path)
@@ -0,0 +1,105 @@
+"""
+Annotation index: queries over several segments (with files indexed
+again and removed) match a brute force evaluation on the annotations
+"""
+
+import random
+
+import pytest
+
+from musicxmlannotations.search import AnnotationIndex, parse_query
+
+SYMBOLS = ['p-dynamic', 'f-dynamic', 'cresc.-words', 'dim.-words', 'timeSignature-3/4', 'timeSignature-4/4']
+
+QUERIES = [
+    'p-dynamic',
+    'timeSignature-*',
+    'p-dynamic AND f-dynamic',
+    'p-dynamic f-dynamic',
+    'p-dynamic OR cresc.-words',
+    'p-dynamic NOT f-dynamic',
+    'p-dynamic AND NOT timeSignature-*',
+    'cresc.-words NEAR/2 f-dynamic',
+    'cresc.-words NEAR/0 dim.-words',
+    '(p-dynamic OR f-dynamic) NEAR/1 timeSignature-3/4',
+    '"dim.-words" AND (cresc.-words OR timeSignature-*) NOT p-dynamic',
+]
+
+
+def random_bars(rng):
+    return [[s for s in SYMBOLS if rng.random() < 0.15] for _ in range(rng.randint(0, 40))]
+
+
+def brute_force(node, files):
+
+    """
+    Returns the set of (path, bar) of a query tree over files (dict of the
+    bar annotations of each path)
+    """
+
+    op = node[0]
+
+    if op in ('term', 'prefix'):
+        match = (lambda s: s == node[1]) if op == 'term' else (lambda s: s.startswith(node[1]))
+        return {(path, i) for path, bars in files.items() for i, bar in enumerate(bars) if any(map(match, bar))}
+
+    a, b = brute_force(node[1], files), brute_force(node[2], files)
+
+    if op == 'or':
+        return a | b
+    if op == 'and':
+        both = {p for p, _ in a} & {p for p, _ in b}
+        return {k for k in a | b if k[0] in both}
+    if op == 'not':
+        excluded = {p for p, _ in b}
+        return {k for k in a if k[0] not in excluded}
+    if op == 'near':
+        def close(x, y):
+            return {(p, i) for p, i in x if any(q == p and abs(i - j) <= node[3] for q, j in y)}
+        return close(a, b) | close(b, a)
+
+    raise ValueError(op)
+
+
+def check_queries(index, files):
+    for query in QUERIES:
+        expected = brute_force(parse_query(query), files)
+        found = {(path, bar) for path, bars in index.search(query) for bar in bars}
+        assert found == expected, query
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_queries_across_segments(tmp_path, seed):
+    rng = random.Random(seed)
+    files = {}
+
+    with AnnotationIndex(tmp_path / 'index') as index:
+        for n in range(40):
+            path = 'score-%d.musicxml' % n
+            files[path] = random_bars(rng)
+            index.add(path, files[path])
+            # One segment every few files
+            if n % 7 == 6:
+                index.flush()
+
+    index = AnnotationIndex(tmp_path / 'index')
+    assert len(index.segments) > 1
+    check_queries(index, files)
+
+    # Files indexed again (their older postings live in other segments) and removed
+    for n in rng.sample(range(40), 10):
+        path = 'score-%d.musicxml' % n
+        files[path] = random_bars(rng)
+        index.add(path, files[path])
+    for n in rng.sample(range(40), 5):
+        path = 'score-%d.musicxml' % n
+        files.pop(path, None)
+        index.remove(path)
+    index.commit()
+
+    index = AnnotationIndex(tmp_path / 'index')
+    check_queries(index, files)
+
+    index.merge()
+    assert len(index.segments) == 1
+    check_queries(AnnotationIndex(tmp_path / 'index'), files)
@@ -0,0 +1,86 @@
+"""
+Checkpointed outputs: a run resumed after its output was cut short
+ends with exactly one result per file
+"""
+
+import os
+import json
+
+from benchmarks.synthetic import generate_score
+from musicxmlannotations import batch
+from musicxmlannotations.shards import Checkpoint, checkpoint_path
+
+
+def read_results(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_checkpoint_truncated_output(tmp_path):
+    output = tmp_path / 'out.jsonl'
+
+    with Checkpoint(output) as checkpoint:
+        for i in range(5):
+            checkpoint.write({'file': 'f%d' % i, 'status': 'ok', 'annotations': list(range(i))})
+
+    # The output lost the end of its last two results (the checkpoint did not)
+    with open(output, 'rb') as f:
+        lines = f.readlines()
+    with open(output, 'r+b') as f:
+        f.truncate(sum(len(line) for line in lines[:3]) + len(lines[3]) // 2)
+
+    with Checkpoint(output) as checkpoint:
+        assert checkpoint.done() == {'f0', 'f1', 'f2'}
+        assert os.path.getsize(output) == sum(len(line) for line in lines[:3])
+        for i in range(3, 5):
+            checkpoint.write({'file': 'f%d' % i, 'status': 'ok', 'annotations': list(range(i))})
+
+    assert [r['file'] for r in read_results(output)] == ['f%d' % i for i in range(5)]
+    with Checkpoint(output) as checkpoint:
+        assert checkpoint.done() == {'f%d' % i for i in range(5)}
+
+
+def test_checkpoint_partial_entry(tmp_path):
+    output = tmp_path / 'out.jsonl'
+
+    with Checkpoint(output) as checkpoint:
+        for i in range(3):
+            checkpoint.write({'file': 'f%d' % i, 'status': 'ok'})
+
+    # A run stopped while writing an entry
+    with open(checkpoint_path(output), 'ab') as f:
+        f.write(b'{"file": "f3", "sha')
+
+    with Checkpoint(output) as checkpoint:
+        assert checkpoint.done() == {'f0', 'f1', 'f2'}
+
+    with open(checkpoint_path(output), 'rb') as f:
+        assert all(line.endswith(b'\n') for line in f)
+
+
+def test_resume_after_truncated_output(tmp_path, capsys):
+    scores = tmp_path / 'scores'
+    scores.mkdir()
+    for seed in range(6):
+        with open(scores / ('s%d.musicxml' % seed), 'wb') as f:
+            f.write(generate_score(seed, measures=12))
+
+    expected = tmp_path / 'expected.jsonl'
+    batch.main([str(scores), '-o', str(expected), '-j', '1'])
+    expected = {r['file']: r for r in read_results(expected)}
+
+    output = tmp_path / 'out.jsonl'
+    batch.main([str(scores), '-o', str(output), '-j', '1', '--resume'])
+
+    # Cut the output in the middle of its third result
+    with open(output, 'rb') as f:
+        lines = f.readlines()
+    with open(output, 'r+b') as f:
+        f.truncate(len(lines[0]) + len(lines[1]) + len(lines[2]) // 2)
+
+    batch.main([str(scores), '-o', str(output), '-j', '1', '--resume'])
+
+    results = read_results(output)
+    assert sorted(r['file'] for r in results) == sorted(expected)
+    for r in results:
+        assert r == expected[r['file']]